@@ -0,0 +1,25 @@
+"""Gunicorn configuration for multi-worker deployments of the API.
+
+Run with:
+
+    gunicorn -c gunicorn.conf.py src.api.main:app
+
+Set STATE_BACKEND_URL (e.g. redis://redis:6379/0) so that caches, rate-limit
+counters and single-flight locks are shared by every worker and node.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+# Request handling is I/O-bound (waiting on the LLM provider); one async worker
+# per core keeps the event loops busy without oversubscribing CPU-bound parsing.
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# LLM generations can take minutes
+timeout = int(os.environ.get("WORKER_TIMEOUT", "300"))
+graceful_timeout = int(os.environ.get("WORKER_GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.environ.get("WORKER_MAX_REQUESTS", "2000"))
+max_requests_jitter = 200
+accesslog = "-"
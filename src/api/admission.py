@@ -0,0 +1,219 @@
+"""Admission control with per-endpoint priority classes.
+
+All LLM-bound endpoints share a fixed number of in-flight slots per worker.
+Each endpoint belongs to a priority class with its own in-flight limit,
+bounded queue and maximum queue time; free slots always go to the highest
+priority class waiting. Requests that would exceed a queue bound or wait too
+long are shed with a fast 503 and a `Retry-After` estimate, so a burst of
+content generation cannot starve `/api/chat` and `/api/context`. Users over
+their token quota (see usage.py) are rejected with a 429 before queueing.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List
+
+from starlette.responses import JSONResponse
+
+from . import metrics
+from .deadline import endpoint_name, request_user
+from .usage import aggregator as usage
+
+# In-flight requests per worker across all priority classes
+ADMISSION_CAPACITY = int(os.environ.get("ADMISSION_CAPACITY", "32"))
+# Slots only the interactive class can use, so lower classes cannot fill them all
+ADMISSION_INTERACTIVE_RESERVE = int(os.environ.get(
+    "ADMISSION_INTERACTIVE_RESERVE", max(1, ADMISSION_CAPACITY // 4)
+))
+
+
+def _setting(name: str, setting: str, default: float) -> float:
+    return float(os.environ.get(f"ADMISSION_{name.upper()}_{setting}", default))
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of being admitted"""
+
+    def __init__(self, reason: str, retry_after: int):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(reason)
+
+
+class PriorityClass:
+    """Limits and wait queue of one priority class."""
+
+    def __init__(self, name: str, max_in_flight: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.max_in_flight = int(_setting(name, "MAX_IN_FLIGHT", max_in_flight))
+        self.max_queue = int(_setting(name, "MAX_QUEUE", max_queue))
+        self.max_wait = _setting(name, "MAX_WAIT", max_wait)
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        # Moving average of handler duration, used to estimate Retry-After
+        self.service_time = 1.0
+
+    def retry_after(self) -> int:
+        backlog = len(self.waiters) + 1
+        return max(1, math.ceil(self.service_time * backlog / max(1, self.max_in_flight)))
+
+
+class AdmissionController:
+    """Strict-priority admission over a shared pool of in-flight slots.
+
+    Classes are listed from highest to lowest priority. `reserve` slots are
+    kept for the highest class: the other classes together never hold more
+    than `capacity - reserve`.
+    """
+
+    def __init__(self, capacity: int, classes: List[PriorityClass], reserve: int = 0):
+        self.capacity = capacity
+        self.classes = classes
+        self.reserve = min(reserve, capacity - 1)
+        self.in_flight = 0
+
+    def _can_start(self, cls: PriorityClass) -> bool:
+        if self.in_flight >= self.capacity or cls.in_flight >= cls.max_in_flight:
+            return False
+        if cls is self.classes[0]:
+            return True
+        return self.in_flight - self.classes[0].in_flight < self.capacity - self.reserve
+
+    def _start(self, cls: PriorityClass) -> None:
+        self.in_flight += 1
+        cls.in_flight += 1
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiters, highest priority first."""
+        granted = True
+        while granted and self.in_flight < self.capacity:
+            granted = False
+            for cls in self.classes:
+                while cls.waiters and cls.waiters[0].done():
+                    cls.waiters.popleft()
+                if cls.waiters and self._can_start(cls):
+                    self._start(cls)
+                    cls.waiters.popleft().set_result(True)
+                    granted = True
+                    break
+
+    async def acquire(self, cls: PriorityClass) -> None:
+        """Wait for a slot for `cls`.
+
+        Raises:
+            Overloaded: If the class queue is full or the wait exceeds its limit
+        """
+        higher_waiting = any(
+            c.waiters for c in self.classes[:self.classes.index(cls) + 1]
+        )
+        if not higher_waiting and self._can_start(cls):
+            self._start(cls)
+            return
+        if len(cls.waiters) >= cls.max_queue:
+            raise Overloaded("queue_full", cls.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        cls.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, cls.max_wait)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the wait ended: give the slot back
+                self.release(cls)
+            elif waiter in cls.waiters:
+                cls.waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                raise Overloaded("queue_timeout", cls.retry_after())
+            raise
+
+    def release(self, cls: PriorityClass, duration: float = None) -> None:
+        self.in_flight -= 1
+        cls.in_flight -= 1
+        if duration is not None:
+            cls.service_time = 0.8 * cls.service_time + 0.2 * duration
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "reserve": self.reserve,
+            "in_flight": self.in_flight,
+            "classes": {
+                cls.name: {
+                    "in_flight": cls.in_flight,
+                    "queued": sum(1 for w in cls.waiters if not w.done()),
+                    "max_in_flight": cls.max_in_flight,
+                    "max_queue": cls.max_queue,
+                }
+                for cls in self.classes
+            },
+        }
+
+
+INTERACTIVE = PriorityClass("interactive", ADMISSION_CAPACITY, 64, 5.0)
+STANDARD = PriorityClass("standard", max(1, ADMISSION_CAPACITY * 3 // 4), 32, 30.0)
+BATCH = PriorityClass("batch", max(1, ADMISSION_CAPACITY // 4), 16, 60.0)
+
+ENDPOINT_PRIORITY: Dict[str, PriorityClass] = {
+    "chat": INTERACTIVE,
+    "context": INTERACTIVE,
+    "plan": STANDARD,
+    "feedback": STANDARD,
+    "generate_content": BATCH,
+}
+
+controller = AdmissionController(
+    ADMISSION_CAPACITY, [INTERACTIVE, STANDARD, BATCH], ADMISSION_INTERACTIVE_RESERVE
+)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting, queueing or shedding LLM-bound requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # CORS preflights never reach an LLM
+        admitted = scope["type"] == "http" and scope.get("method") != "OPTIONS"
+        endpoint = endpoint_name(scope.get("path", "")) if admitted else None
+        cls = ENDPOINT_PRIORITY.get(endpoint)
+        if cls is None:
+            return await self.app(scope, receive, send)
+
+        user = request_user(scope)
+        if usage.over_quota(user):
+            metrics.increment("quota_rejected", endpoint=endpoint)
+            response = JSONResponse(
+                status_code=429,
+                content={
+                    "message": "Token quota exceeded, please retry later",
+                    "details": {"user": user, "quota": usage.quota, "used": usage.used(user)}
+                },
+                headers={"Retry-After": str(usage.retry_after())}
+            )
+            return await response(scope, receive, send)
+
+        queued_at = time.perf_counter()
+        try:
+            await controller.acquire(cls)
+        except Overloaded as e:
+            metrics.increment("admission_shed", endpoint=endpoint, priority=cls.name, reason=e.reason)
+            response = JSONResponse(
+                status_code=503,
+                content={
+                    "message": "Server overloaded, please retry later",
+                    "details": {"endpoint": endpoint, "priority": cls.name, "reason": e.reason}
+                },
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            return await response(scope, receive, send)
+
+        started = time.perf_counter()
+        metrics.observe("admission_queue_seconds", started - queued_at, endpoint=endpoint, priority=cls.name)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(cls, time.perf_counter() - started)
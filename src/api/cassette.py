@@ -0,0 +1,292 @@
+"""Record/replay of LLM calls ("cassettes").
+
+With `LLM_CASSETTE_MODE=record`, every chat model call is made to the real
+provider through streaming and stored in the cassette at `LLM_CASSETTE_PATH`:
+the chain it came from, the rendered prompt, each streamed chunk with its
+delay, the finish reason and token usage. With `LLM_CASSETTE_MODE=replay` the
+provider is never called; calls are answered from the cassette, by prompt
+hash (falling back to the next recording of the same chain unless
+`LLM_CASSETTE_STRICT=1`), with the recorded chunk timing divided by
+`LLM_CASSETTE_SPEED` (1 = faithful, 0 = no delay).
+
+Cassettes are JSON Lines, a version header then one call per line, so a
+recording is appended without rewriting the file; they are gzip-compressed
+when the path ends in `.gz`.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+CASSETTE_MODE = os.environ.get("LLM_CASSETTE_MODE", "off")
+CASSETTE_PATH = os.environ.get("LLM_CASSETTE_PATH", "llm_cassette.jsonl")
+CASSETTE_SPEED = float(os.environ.get("LLM_CASSETTE_SPEED", "1"))
+CASSETTE_STRICT = os.environ.get("LLM_CASSETTE_STRICT", "0") == "1"
+
+CASSETTE_VERSION = 1
+CHAIN_TAG_PREFIX = "chain:"
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when no recording matches a call"""
+    pass
+
+
+def serialize_messages(messages: List[BaseMessage]) -> List[Dict[str, str]]:
+    return [{"role": m.type, "content": m.content} for m in messages]
+
+
+def prompt_key(messages: List[BaseMessage]) -> str:
+    """Stable hash of a rendered prompt."""
+    payload = json.dumps(serialize_messages(messages), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+
+def chain_from_tags(tags: Optional[List[str]]) -> str:
+    """Name of the chain a call came from, taken from its `chain:<name>` tag."""
+    for tag in tags or []:
+        if tag.startswith(CHAIN_TAG_PREFIX):
+            return tag[len(CHAIN_TAG_PREFIX):]
+    return "llm"
+
+
+def chain_name(run_manager) -> str:
+    return chain_from_tags(getattr(run_manager, "tags", None))
+
+
+class Cassette:
+    """Recorded interactions, loaded from and appended to one file."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.interactions: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._index: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._cursors: Dict[Tuple[str, str], int] = {}
+        self._opener = gzip.open if self.path.suffix == ".gz" else open
+        if self.path.exists():
+            with self._opener(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if "version" in record:
+                        if record["version"] != CASSETTE_VERSION:
+                            raise ValueError(f"Unsupported cassette version {record['version']} in {self.path}")
+                        continue
+                    self._add(record)
+
+    def _add(self, interaction: Dict[str, Any]) -> None:
+        self.interactions.append(interaction)
+        for field in ("key", "chain"):
+            self._index.setdefault((field, interaction[field]), []).append(interaction)
+
+    def _next(self, field: str, value: str) -> Optional[Dict[str, Any]]:
+        matches = self._index.get((field, value))
+        if not matches:
+            return None
+        cursor = self._cursors.get((field, value), 0)
+        self._cursors[(field, value)] = cursor + 1
+        # Cycle through the recordings so a scenario can be replayed repeatedly
+        return matches[cursor % len(matches)]
+
+    def find(self, key: str, chain: str, strict: bool) -> Dict[str, Any]:
+        with self._lock:
+            interaction = self._next("key", key)
+            if interaction is None and not strict:
+                interaction = self._next("chain", chain)
+        if interaction is None:
+            raise CassetteMiss(f"No recording for chain '{chain}' (prompt {key}) in {self.path}")
+        return interaction
+
+    def append(self, interaction: Dict[str, Any]) -> None:
+        """Add a recording and append it to the file (blocking: run in a thread from async code)."""
+        line = json.dumps(interaction, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._add(interaction)
+            new = not self.path.exists()
+            with self._opener(self.path, "at", encoding="utf-8") as f:
+                if new:
+                    f.write(json.dumps({"version": CASSETTE_VERSION}) + "\n")
+                f.write(line + "\n")
+
+
+def _token_usage(message) -> Dict[str, int]:
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage:
+        return {
+            "prompt_tokens": usage.get("input_tokens", 0),
+            "completion_tokens": usage.get("output_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+        }
+    return dict(message.response_metadata.get("token_usage") or {})
+
+
+class Recorder:
+    """Accumulates the streamed chunks of one recorded call."""
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.chunks: List[List[Any]] = []
+        self.message = AIMessageChunk(content="")
+
+    def add(self, chunk: ChatGenerationChunk) -> None:
+        now = time.perf_counter()
+        self.chunks.append([round((now - self.last) * 1000, 1), chunk.message.content])
+        self.last = now
+        self.message = self.message + chunk.message
+
+    def interaction(self, messages: List[BaseMessage], run_manager) -> Dict[str, Any]:
+        return {
+            "chain": chain_name(run_manager),
+            "key": prompt_key(messages),
+            "prompt": serialize_messages(messages),
+            "chunks": self.chunks,
+            "finish_reason": self.message.response_metadata.get("finish_reason"),
+            "usage": _token_usage(self.message),
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 1),
+        }
+
+
+class CassetteChatModel(BaseChatModel):
+    """Chat model recording calls to `inner`, or replaying them from a cassette."""
+
+    inner: Optional[BaseChatModel] = None
+    cassette: Any
+    mode: str = "replay"
+    speed: float = 1.0
+    strict: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    def with_structured_output(self, schema, **kwargs):
+        raise ValueError(
+            "Structured output is not supported in cassette mode: cassettes record "
+            "free-text output only; set LLM_STRUCTURED_OUTPUT=off when recording or replaying"
+        )
+
+    # Replay
+
+    def _lookup(self, messages, run_manager) -> Dict[str, Any]:
+        return self.cassette.find(prompt_key(messages), chain_name(run_manager), self.strict)
+
+    def _delay(self, delay_ms: float) -> float:
+        return delay_ms / 1000 / self.speed if self.speed > 0 else 0
+
+    def _last_chunk_metadata(self, interaction: Dict[str, Any]) -> Dict[str, Any]:
+        usage = interaction.get("usage") or {}
+        return {
+            "response_metadata": {
+                "finish_reason": interaction.get("finish_reason"),
+                "token_usage": usage,
+            },
+            "usage_metadata": {
+                "input_tokens": usage.get("prompt_tokens", 0),
+                "output_tokens": usage.get("completion_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0),
+            },
+        }
+
+    def _replay_chunks(self, interaction: Dict[str, Any]) -> Iterator[Tuple[float, ChatGenerationChunk]]:
+        chunks = interaction["chunks"] or [[0, ""]]
+        for i, (delay_ms, text) in enumerate(chunks):
+            extra = self._last_chunk_metadata(interaction) if i == len(chunks) - 1 else {}
+            yield self._delay(delay_ms), ChatGenerationChunk(message=AIMessageChunk(content=text, **extra))
+
+    def _result(self, interaction: Dict[str, Any]) -> ChatResult:
+        text = "".join(text for _, text in interaction["chunks"])
+        message = AIMessage(content=text, **self._last_chunk_metadata(interaction))
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"token_usage": interaction.get("usage") or {}},
+        )
+
+    # BaseChatModel interface
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        if self.mode == "record":
+            recorder = Recorder()
+            async for chunk in self.inner._astream(messages, stop=stop, **kwargs):
+                recorder.add(chunk)
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+                yield chunk
+            await asyncio.to_thread(self.cassette.append, recorder.interaction(messages, run_manager))
+            return
+        for delay, chunk in self._replay_chunks(self._lookup(messages, run_manager)):
+            await asyncio.sleep(delay)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+            yield chunk
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        if self.mode == "record":
+            recorder = Recorder()
+            for chunk in self.inner._stream(messages, stop=stop, **kwargs):
+                recorder.add(chunk)
+                yield chunk
+            self.cassette.append(recorder.interaction(messages, run_manager))
+            return
+        for delay, chunk in self._replay_chunks(self._lookup(messages, run_manager)):
+            time.sleep(delay)
+            yield chunk
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.mode == "record":
+            recorder = Recorder()
+            async for chunk in self.inner._astream(messages, stop=stop, **kwargs):
+                recorder.add(chunk)
+            interaction = recorder.interaction(messages, run_manager)
+            await asyncio.to_thread(self.cassette.append, interaction)
+            return self._result(interaction)
+        interaction = self._lookup(messages, run_manager)
+        await asyncio.sleep(sum(self._delay(delay_ms) for delay_ms, _ in interaction["chunks"]))
+        return self._result(interaction)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.mode == "record":
+            recorder = Recorder()
+            for chunk in self.inner._stream(messages, stop=stop, **kwargs):
+                recorder.add(chunk)
+            interaction = recorder.interaction(messages, run_manager)
+            self.cassette.append(interaction)
+            return self._result(interaction)
+        interaction = self._lookup(messages, run_manager)
+        time.sleep(sum(self._delay(delay_ms) for delay_ms, _ in interaction["chunks"]))
+        return self._result(interaction)
+
+
+_cassette: Optional[Cassette] = None
+
+
+def with_cassette(model: BaseChatModel) -> BaseChatModel:
+    """Wrap a chat model for recording or replay, according to LLM_CASSETTE_MODE.
+
+    The wrapper takes over the model's callbacks and, when recording, its rate
+    limiter; in replay mode the provider is never called.
+    """
+    global _cassette
+    if CASSETTE_MODE not in ("record", "replay"):
+        return model
+    if _cassette is None:
+        _cassette = Cassette(CASSETTE_PATH)
+    return CassetteChatModel(
+        inner=model,
+        cassette=_cassette,
+        mode=CASSETTE_MODE,
+        speed=CASSETTE_SPEED,
+        strict=CASSETTE_STRICT,
+        callbacks=model.callbacks,
+        rate_limiter=model.rate_limiter if CASSETTE_MODE == "record" else None,
+    )
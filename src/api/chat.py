@@ -1,26 +1,72 @@
 """Chat functionality for the learning assistant."""
 
 from typing import List, Dict
-from .llm import llm, parse_llm_output
+from .llm import llm, hedge_llm, parse_llm_output
+from .hedging import hedged_ainvoke
+from .models import ChatRequest, PlanNotIndexed
+from . import metrics, retrieval
 
 def get_chat_prompt(context: str) -> str:
     """Generate the chat prompt with context."""
-    return f'''You are an AI learning assistant helping a student learn about a specific topic.
+    return f'''Tu es un assistant pédagogique qui aide un apprenant à maîtriser un sujet précis.
 
-CONTEXT:
+CONTEXTE :
 {context}
 
-Remember to:
-1. Use the context to personalize explanations
-2. Keep responses focused and engaging
-3. Provide practical examples
-4. Encourage active learning and critical thinking
+N'oublie pas de :
+1. Utiliser le contexte pour personnaliser tes explications
+2. Donner des réponses ciblées et engageantes
+3. Fournir des exemples pratiques
+4. Encourager l'apprentissage actif et l'esprit critique
 
-Respond to the student's next message.
+Réponds au prochain message de l'apprenant.
 '''
 
-def chat_with_assistant(context: str, message: str) -> str:
-    """Chat with the learning assistant.
+async def request_context(request: ChatRequest) -> str:
+    """Build the chat context of a request.
+    
+    When the request names a plan (by `plan_id`, or by sending it), the context
+    only holds the passages of the plan's contents relevant to the message
+    (see retrieval.py); otherwise the client's full `context` is used.
+    
+    Args:
+        request (ChatRequest): Chat request
+    
+    Returns:
+        str: Context for the chat prompt
+    
+    Raises:
+        PlanNotIndexed: If `plan_id` is unknown to this worker and no plan is sent
+    """
+    source = "plan_id"
+    index = retrieval.cache.get(request.plan_id) if request.plan_id else None
+    if index is None and request.plan is not None:
+        source = "plan"
+        index = await retrieval.cache.for_plan(request.plan)
+    if index is None and request.plan_id:
+        # `context` only holds the learner context: answering from it would
+        # drop the plan and chapter grounding without anyone noticing
+        metrics.increment("chat_plan_not_indexed")
+        raise PlanNotIndexed(
+            "Plan not indexed, resend plan",
+            {"plan_id": request.plan_id}
+        )
+    if index is None:
+        source = "context"
+        history = "\n".join(request.conversation_history)
+        context = f"{request.context}\n{history}" if history else request.context
+    else:
+        context = retrieval.chat_context(
+            index, request.message, request.current_chapter,
+            request.conversation_history, request.context
+        )
+    metrics.observe("chat_context_chars", len(context), source=source)
+    return context
+
+async def achat_with_assistant(context: str, message: str) -> str:
+    """Chat with the learning assistant without blocking the event loop.
+    
+    The call is hedged when `LLM_HEDGING=1` (see hedging.py).
     
     Args:
         context (str): Complete context including learning plan, current chapter, and conversation history
@@ -29,9 +75,10 @@ def chat_with_assistant(context: str, message: str) -> str:
     Returns:
         str: Assistant's response
     """
-    # Generate chat prompt
     prompt = get_chat_prompt(context)
-
-    # Get response from LLM
-    result = llm.invoke(prompt + f"\n\nStudent: {message}")
+    result = await hedged_ainvoke(
+        llm.with_config(tags=["chain:chat"]), prompt + f"\n\nApprenant : {message}",
+        key="chat",
+        hedge_runnable=hedge_llm.with_config(tags=["chain:chat"]) if hedge_llm is not llm else None
+    )
     return result.content
@@ -0,0 +1,110 @@
+"""Compact serialization of learning plans for prompts.
+
+Input tokens dominate time-to-first-token on large plans, so plans are
+embedded in prompts in the smallest form that keeps what the model needs:
+
+- chapter prompts, which only read the plan for context, get a text outline
+  (`c2. Titre (prérequis : c1)`) instead of JSON keys and punctuation;
+- the feedback prompt, which answers questions about chapters, gets the whole
+  plan with its contents as minified JSON without null or default fields and
+  with abbreviated keys, preceded by their legend. Contents of chapters the
+  model returns unchanged without content are restored afterwards.
+
+`PROMPT_COMPACTION=0` restores the verbose JSON serialization.
+"""
+import json
+import os
+from typing import Any, Dict, Optional
+
+from .models import LearningPlan, Chapter
+from .validation import copy_plan
+
+PROMPT_COMPACTION = os.environ.get("PROMPT_COMPACTION", "1") == "1"
+
+# Short names of the plan keys in the feedback prompt
+KEY_ABBREVIATIONS: Dict[str, str] = {
+    "title": "t", "description": "d", "chapters": "ch", "prerequisites": "p", "content": "c",
+    "introduction": "in", "theory": "th", "guided_practice": "gp", "challenge": "cl",
+    "conclusion": "co", "resources": "r",
+}
+KEY_EXPANSIONS: Dict[str, str] = {short: key for key, short in KEY_ABBREVIATIONS.items()}
+
+KEYS_LEGEND = (
+    "(clés abrégées : "
+    + ", ".join(f"{short} = {key}" for key, short in KEY_ABBREVIATIONS.items())
+    + " ; le plan modifié utilise les clés complètes)\n"
+)
+
+
+def chapter_line(chapter: Chapter) -> str:
+    """One-line outline of a chapter: id, title and prerequisites."""
+    line = f"{chapter.id}. {chapter.title}"
+    if chapter.prerequisites:
+        line += f" (prérequis : {', '.join(chapter.prerequisites)})"
+    return line
+
+
+def plan_outline(plan: LearningPlan, compact: bool = PROMPT_COMPACTION) -> str:
+    """Serialize the plan structure, without chapter contents, for chapter prompts."""
+    if not compact:
+        return json.dumps(
+            plan.model_dump(exclude={"chapters": {"__all__": {"content"}}}),
+            ensure_ascii=False
+        )
+    lines = [plan.title, plan.description, "Chapitres :"]
+    lines.extend(chapter_line(chapter) for chapter in plan.chapters)
+    return "\n".join(lines)
+
+
+def chapter_reference(chapter: Chapter, compact: bool = PROMPT_COMPACTION) -> str:
+    """Identify the chapter to write in chapter prompts."""
+    if not compact:
+        return json.dumps({"id": chapter.id, "title": chapter.title}, ensure_ascii=False)
+    return f"{chapter.id}. {chapter.title}"
+
+
+def rename_keys(data: Any, names: Dict[str, str]) -> Any:
+    """Rename the dict keys found in `names`, recursively."""
+    if isinstance(data, dict):
+        return {names.get(key, key): rename_keys(value, names) for key, value in data.items()}
+    if isinstance(data, list):
+        return [rename_keys(item, names) for item in data]
+    return data
+
+
+def expand_keys(data: Any) -> Any:
+    """Restore the full key names of abbreviated plan data; full keys are kept."""
+    return rename_keys(data, KEY_EXPANSIONS)
+
+
+def compact_plan_data(plan: LearningPlan) -> Dict[str, Any]:
+    """Plan data, contents included, with abbreviated keys and no null or default fields."""
+    return rename_keys(plan.model_dump(exclude_none=True, exclude_defaults=True), KEY_ABBREVIATIONS)
+
+
+def feedback_plan(plan: LearningPlan, compact: bool = PROMPT_COMPACTION) -> str:
+    """Serialize the current plan for the feedback prompt."""
+    if not compact:
+        return json.dumps(plan.model_dump(), ensure_ascii=False)
+    return KEYS_LEGEND + json.dumps(compact_plan_data(plan), ensure_ascii=False, separators=(",", ":"))
+
+
+def restore_contents(original: LearningPlan, updated: Optional[LearningPlan]) -> Optional[LearningPlan]:
+    """Give chapters the model returned unchanged back the content they had.
+
+    A chapter is unchanged when its id, title and prerequisites match a
+    chapter of `original`; content the model did return is kept.
+    """
+    if updated is None:
+        return None
+    contents = {
+        (chapter.id, chapter.title, tuple(chapter.prerequisites)): chapter.content
+        for chapter in original.chapters if chapter.content is not None
+    }
+    if not contents:
+        return updated
+    restored = copy_plan(updated)
+    for chapter in restored.chapters:
+        if chapter.content is None:
+            chapter.content = contents.get((chapter.id, chapter.title, tuple(chapter.prerequisites)))
+    return restored
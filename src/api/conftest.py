@@ -0,0 +1,68 @@
+"""Fixtures shared by the API tests: a small Docker learning plan and its chapter text."""
+import pytest
+
+from src.api import metrics
+from src.api.models import LearningPlan, ChapterContent
+
+SECTIONS = {
+    "introduction": "Intro",
+    "theory": "Théorie",
+    "guided_practice": "Pratique",
+    "challenge": "Défi",
+    "conclusion": "Conclusion",
+}
+RESOURCES = ["https://docs.docker.com"]
+
+
+@pytest.fixture
+def sections():
+    """Text of every chapter section except resources."""
+    return dict(SECTIONS)
+
+
+@pytest.fixture
+def chapter_content():
+    return ChapterContent(**SECTIONS, resources=list(RESOURCES))
+
+
+@pytest.fixture
+def plan():
+    """Plan without contents: c1 (Conteneurs), then c2 (Images)."""
+    return LearningPlan.model_validate({
+        "title": "Docker",
+        "description": "Les bases",
+        "chapters": [
+            {"id": "c1", "title": "Conteneurs"},
+            {"id": "c2", "title": "Images", "prerequisites": ["c1"]},
+        ],
+    })
+
+
+@pytest.fixture
+def full_plan(plan, chapter_content):
+    """The same plan with `chapter_content` in every chapter."""
+    return plan.model_copy(update={
+        "chapters": [c.model_copy(update={"content": chapter_content}) for c in plan.chapters]
+    })
+
+
+@pytest.fixture
+def tagged():
+    """Render sections as the XML-tagged text the chapter prompt asks for."""
+    def render(sections, resources=tuple(f"- {url}" for url in RESOURCES)):
+        parts = [f"<{name}>\n{text}\n</{name}>" for name, text in sections.items()]
+        if resources is not None:
+            parts.append("<resources>\n" + "\n".join(resources) + "\n</resources>")
+        return "\n\n".join(parts)
+    return render
+
+
+@pytest.fixture
+def counter():
+    """Total of a metric counter over the label sets that include `labels`."""
+    def total(name, **labels):
+        return sum(
+            c["value"] for c in metrics.snapshot()["counters"]
+            if c["name"] == name and c["labels"].items() >= labels.items()
+        )
+    return total
@@ -0,0 +1,131 @@
+"""Chapter content generation scheduled along the prerequisite graph."""
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .models import LearningPlan, Chapter, ChapterContent, LLMParsingError
+from .llm import (
+    chapter_chain, chapter_structured_chain, chapter_json_schema_prompt, chapter_json_chain,
+    ainvoke_structured
+)
+from .deadline import check_deadline
+from .plan_graph import build_plan_graph
+from .validation import copy_plan
+from .compaction import plan_outline, chapter_reference
+from .recovery import recover_chapter_content
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of chapter generations in flight for one request
+CONTENT_CONCURRENCY = int(os.environ.get("CONTENT_CONCURRENCY", "8"))
+
+# Characters kept per section when summarizing a prerequisite chapter
+SUMMARY_SECTION_CHARS = 300
+
+
+def _truncate(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit].rstrip() + "..."
+
+
+def summarize_chapter(chapter: Chapter) -> str:
+    """Build a compact summary of a chapter for use in dependent prompts."""
+    if chapter.content is None:
+        return f"- {chapter.id} ({chapter.title}) : contenu non disponible"
+    return (
+        f"- {chapter.id} ({chapter.title})\n"
+        f"  Objectifs : {_truncate(chapter.content.introduction, SUMMARY_SECTION_CHARS)}\n"
+        f"  Synthèse : {_truncate(chapter.content.conclusion, SUMMARY_SECTION_CHARS)}"
+    )
+
+
+async def generate_chapter(
+    outline: str, chapter: Chapter, prerequisites: List[Chapter]
+) -> ChapterContent:
+    """Generate the content of one chapter given its already generated prerequisites."""
+    summary = "\n".join(summarize_chapter(p) for p in prerequisites) or "Aucun (chapitre d'entrée)"
+    inputs = {
+        "learning_plan": outline,
+        "chapter": chapter_reference(chapter),
+        "prerequisites_summary": summary
+    }
+
+    async def recover(result) -> ChapterContent:
+        if chapter_structured_chain is None:
+            return await recover_chapter_content(inputs, result)
+        # Continue or regenerate in the JSON format the chapter was asked in
+        return await recover_chapter_content(
+            inputs, result, chapter_json_schema_prompt, chapter_json_chain
+        )
+
+    return await ainvoke_structured(
+        chapter_chain, chapter_structured_chain, inputs, ChapterContent, recover, "chapter"
+    )
+
+
+async def generate_plan_content(
+    plan: LearningPlan,
+    on_chapter: Optional[Callable[[Chapter], None]] = None
+) -> Tuple[LearningPlan, Dict[str, Dict[str, Any]]]:
+    """Generate content for every chapter of a plan along its prerequisite graph.
+
+    Each chapter starts as soon as its own prerequisites are done, so a slow
+    chapter only delays its dependents; each chapter prompt receives a
+    summary of its direct prerequisites' content.
+    A chapter that cannot be recovered keeps `content=None` without failing
+    the other chapters.
+
+    Args:
+        plan: Validated learning plan
+        on_chapter: Optional callback invoked as each chapter completes
+            (its `content` is None if it could not be generated)
+
+    Returns:
+        Tuple of (updated plan, failure details by chapter id)
+
+    Raises:
+        PlanGraphError: If the prerequisites do not form a valid DAG
+        LLMParsingError: If no chapter content could be generated at all
+    """
+    graph = build_plan_graph(plan)
+    updated_plan = copy_plan(plan)
+    chapters: Dict[str, Chapter] = {chapter.id: chapter for chapter in updated_plan.chapters}
+    outline = plan_outline(plan)
+    semaphore = asyncio.Semaphore(CONTENT_CONCURRENCY)
+    failures: Dict[str, Dict[str, Any]] = {}
+
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(chapter_id: str) -> None:
+        chapter = chapters[chapter_id]
+        prerequisites = [chapters[p] for p in graph.prerequisites[chapter_id]]
+        # Prerequisites come first in topological order, so their tasks exist
+        await asyncio.gather(*(tasks[p] for p in graph.prerequisites[chapter_id]))
+        check_deadline("chapter")
+        async with semaphore:
+            try:
+                chapter.content = await generate_chapter(outline, chapter, prerequisites)
+            except LLMParsingError as e:
+                logger.warning("Chapter %s could not be recovered: %s", chapter_id, e.details.get("error"))
+                chapter.content = None
+                failures[chapter_id] = e.details
+        if on_chapter is not None:
+            on_chapter(chapter)
+
+    for chapter_id in graph.topological_order():
+        tasks[chapter_id] = asyncio.create_task(run(chapter_id))
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+
+    if chapters and len(failures) == len(chapters):
+        raise LLMParsingError(
+            "Invalid or incomplete chapter contents",
+            {"error": "No chapter content could be recovered", "chapters": failures}
+        )
+    return updated_plan, failures
@@ -0,0 +1,241 @@
+"""Per-request deadlines and cancellation.
+
+Every `/api/*` request gets a deadline, from the `X-Request-Timeout` header
+(seconds) or the endpoint default. `DeadlineMiddleware` cancels the handler
+when the deadline passes or the client disconnects, which aborts any LLM call
+in flight. The deadline is kept in a context variable so that retries, repairs
+and parsing can check it before starting more work, and a callback on the chat
+model refuses to start a call once it has expired.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from . import metrics
+from .models import APIError
+
+# Default deadline per endpoint, in seconds (override with DEADLINE_<ENDPOINT>)
+DEFAULT_DEADLINES: Dict[str, float] = {
+    name: float(os.environ.get(f"DEADLINE_{name.upper()}", default))
+    for name, default in {
+        "chat": 30,
+        "context": 20,
+        "plan": 90,
+        "feedback": 90,
+        "generate_content": 300,
+    }.items()
+}
+# Upper bound for deadlines requested through the header
+MAX_REQUEST_TIMEOUT = float(os.environ.get("MAX_REQUEST_TIMEOUT", "600"))
+
+TIMEOUT_HEADER = b"x-request-timeout"
+# Identifies the user for usage accounting and quotas, when set by a trusted proxy
+USER_HEADER = b"x-user-id"
+# Client addresses allowed to set USER_HEADER (comma-separated), e.g. the
+# authenticating reverse proxy; the header is ignored from anyone else
+TRUSTED_PROXIES = frozenset(
+    address.strip() for address in os.environ.get("TRUSTED_PROXIES", "").split(",") if address.strip()
+)
+# User of requests without a trusted identity or a client address
+ANONYMOUS_USER = "anonymous"
+
+
+class DeadlineExceeded(APIError):
+    """Raised when a request runs out of time before starting more work"""
+    pass
+
+
+class RequestContext:
+    """Deadline and LLM usage of the request being handled."""
+
+    def __init__(self, endpoint: str, timeout: float, user: str = ANONYMOUS_USER):
+        self.endpoint = endpoint
+        self.user = user
+        self.deadline = time.monotonic() + timeout
+        self.completion_tokens = 0
+        self.prompt_tokens = 0
+        # Estimated prompt and streamed completion tokens of calls not completed,
+        # by run id: cancelled calls never report their usage (see usage.py)
+        self.inflight: Dict[UUID, List[int]] = {}
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def tokens_spent(self) -> int:
+        """Tokens of completed calls plus estimated tokens of interrupted ones."""
+        interrupted = sum(prompt + completion for prompt, completion in self.inflight.values())
+        return self.prompt_tokens + self.completion_tokens + interrupted
+
+
+current_request: ContextVar[Optional[RequestContext]] = ContextVar("current_request", default=None)
+
+
+def check_deadline(stage: str) -> None:
+    """Raise DeadlineExceeded if the current request has no time left.
+
+    Args:
+        stage: Name of the work about to start, reported in metrics and errors
+    """
+    context = current_request.get()
+    if context is not None and context.remaining() <= 0:
+        metrics.increment("deadline_exceeded", endpoint=context.endpoint, stage=stage)
+        raise DeadlineExceeded(
+            "Request deadline exceeded",
+            {"endpoint": context.endpoint, "stage": stage}
+        )
+
+
+class DeadlineCallbackHandler(AsyncCallbackHandler):
+    """Chat model callback refusing to start calls past the deadline.
+
+    Tokens per request are counted by the usage callback (see usage.py).
+    """
+
+    raise_error = True
+
+    async def on_chat_model_start(self, serialized, messages, **kwargs: Any) -> None:
+        check_deadline("llm_call")
+
+
+deadline_callback = DeadlineCallbackHandler()
+
+
+def endpoint_name(path: str) -> Optional[str]:
+    """Map `/api/<name>` to the endpoint name used for deadlines and metrics."""
+    if not path.startswith("/api/"):
+        return None
+    return path[len("/api/"):].strip("/") or None
+
+
+def request_user(scope) -> str:
+    """User making the request, taken from a trusted source only.
+
+    The principal authenticated by an authentication middleware (`scope["user"]`)
+    comes first; otherwise the `X-User-Id` header is used, if the request comes
+    from a TRUSTED_PROXIES address. Other requests are identified by their client
+    address, so rotating header values cannot dodge a quota and one client cannot
+    spend the quota of all the others.
+    """
+    principal = scope.get("user")
+    if principal is not None and getattr(principal, "is_authenticated", False):
+        return str(principal.display_name)[:128]
+    client = scope.get("client")
+    if not client:
+        return ANONYMOUS_USER
+    if client[0] in TRUSTED_PROXIES:
+        for name, value in scope.get("headers", []):
+            if name == USER_HEADER and value:
+                return value.decode("latin-1")[:128]
+    return client[0]
+
+
+def request_timeout(scope, endpoint: str) -> Optional[float]:
+    """Timeout requested by the client, or the endpoint default.
+
+    Values that are not positive finite numbers are ignored; others are capped
+    at MAX_REQUEST_TIMEOUT.
+    """
+    for name, value in scope.get("headers", []):
+        if name == TIMEOUT_HEADER:
+            try:
+                timeout = float(value)
+            except ValueError:
+                break
+            if math.isfinite(timeout) and timeout > 0:
+                return min(timeout, MAX_REQUEST_TIMEOUT)
+            break
+    return DEFAULT_DEADLINES.get(endpoint)
+
+
+class DeadlineMiddleware:
+    """ASGI middleware cancelling handlers on deadline or client disconnect."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # CORS preflights are answered immediately, without a deadline
+        tracked = scope["type"] == "http" and scope.get("method") != "OPTIONS"
+        endpoint = endpoint_name(scope.get("path", "")) if tracked else None
+        timeout = request_timeout(scope, endpoint) if endpoint else None
+        if timeout is None:
+            return await self.app(scope, receive, send)
+
+        # Buffer the body so the real receive channel can be watched for disconnects
+        messages = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            messages.append(message)
+            if not message.get("more_body"):
+                break
+        disconnected = asyncio.Event()
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        response_started = False
+
+        async def tracked_send(message):
+            nonlocal response_started
+            response_started = True
+            await send(message)
+
+        context = RequestContext(endpoint, timeout, request_user(scope))
+        token = current_request.set(context)
+        try:
+            handler = asyncio.create_task(self.app(scope, replay, tracked_send))
+        finally:
+            current_request.reset(token)
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            done, _ = await asyncio.wait(
+                {handler, watcher}, timeout=max(context.remaining(), 0),
+                return_when=asyncio.FIRST_COMPLETED
+            )
+        except asyncio.CancelledError:
+            handler.cancel()
+            raise
+        finally:
+            watcher.cancel()
+        if handler in done:
+            return handler.result()
+
+        handler.cancel()
+        reason = "disconnect" if disconnected.is_set() else "deadline"
+        metrics.increment("requests_cancelled", endpoint=endpoint, reason=reason)
+        # Tokens already paid for in this request that nobody will read
+        try:
+            await handler
+        except asyncio.CancelledError:
+            pass
+        # Calls interrupted by the cancellation are counted from their estimates
+        metrics.increment("wasted_tokens", context.tokens_spent(), endpoint=endpoint, reason=reason)
+        if reason == "deadline" and not response_started:
+            body = json.dumps({
+                "message": "Request deadline exceeded",
+                "details": {"endpoint": endpoint, "timeout": timeout}
+            }).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 504,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
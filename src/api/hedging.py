@@ -0,0 +1,147 @@
+"""Request hedging for short, interactive LLM calls.
+
+A hedged call streams the primary request; if no first token arrives within
+the configured percentile of recently observed time-to-first-token, an
+identical request is issued (optionally to another model profile) and the
+first one to finish wins while the other is cancelled. Calls to another model
+profile are tracked under their own latency key (`<key>:hedge`), so their
+first-token latency does not shift the primary's percentile. Hedges draw from a
+budget replenished by every call, so they cannot amplify load beyond
+`HEDGE_BUDGET_RATIO` extra requests.
+
+Hedging is disabled unless `LLM_HEDGING=1`.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from . import metrics
+
+HEDGING_ENABLED = os.environ.get("LLM_HEDGING", "0") == "1"
+# Percentile of the observed time-to-first-token used as the hedge delay
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.95"))
+# Delay used until enough first-token latencies have been observed (seconds)
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "2.0"))
+# Extra requests allowed per call, and the maximum hedges that can be saved up
+HEDGE_BUDGET_RATIO = float(os.environ.get("HEDGE_BUDGET_RATIO", "0.1"))
+HEDGE_BUDGET_BURST = float(os.environ.get("HEDGE_BUDGET_BURST", "5"))
+
+MIN_SAMPLES = 20
+
+
+class LatencyTracker:
+    """Rolling window of time-to-first-token observations per key."""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self.samples: Dict[str, Deque[float]] = {}
+
+    def record(self, key: str, seconds: float) -> None:
+        self.samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key: str, q: float) -> Optional[float]:
+        """Return the q-quantile for `key`, or None without enough samples."""
+        samples = self.samples.get(key)
+        if not samples or len(samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class HedgeBudget:
+    """Token bucket limiting hedges to a fraction of all calls."""
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def on_call(self) -> None:
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+tracker = LatencyTracker()
+budget = HedgeBudget(HEDGE_BUDGET_RATIO, HEDGE_BUDGET_BURST)
+
+
+async def _stream(runnable, inputs: Any, key: str, first_token: asyncio.Event):
+    """Stream a call to completion, signalling and recording the first token.
+
+    A call cancelled before its first token (a slow primary that lost to its
+    hedge) records its elapsed time as a lower bound, so slow calls are not
+    left out of the percentile.
+    """
+    started = time.perf_counter()
+    result = None
+    try:
+        async for chunk in runnable.astream(inputs):
+            if not first_token.is_set():
+                tracker.record(key, time.perf_counter() - started)
+                first_token.set()
+            result = chunk if result is None else result + chunk
+    except asyncio.CancelledError:
+        if not first_token.is_set():
+            tracker.record(key, time.perf_counter() - started)
+        raise
+    return result
+
+
+async def hedged_ainvoke(runnable, inputs: Any, key: str, hedge_runnable=None):
+    """Invoke `runnable`, hedging with a second call if the first token is late.
+
+    Args:
+        runnable: Chain or chat model to call
+        inputs: Inputs passed to the runnable
+        key: Latency bucket, usually the endpoint name
+        hedge_runnable: Optional alternative profile for the hedge call, whose
+            latency is tracked under `<key>:hedge`
+
+    Returns:
+        The message of whichever call finished first
+    """
+    if not HEDGING_ENABLED:
+        return await runnable.ainvoke(inputs)
+
+    budget.on_call()
+    delay = tracker.percentile(key, HEDGE_PERCENTILE) or HEDGE_DEFAULT_DELAY
+    first_token = asyncio.Event()
+    primary = asyncio.create_task(_stream(runnable, inputs, key, first_token))
+    waiter = asyncio.create_task(first_token.wait())
+    try:
+        await asyncio.wait({primary, waiter}, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        primary.cancel()
+        raise
+    finally:
+        waiter.cancel()
+
+    if first_token.is_set() or primary.done() or not budget.try_acquire():
+        return await primary
+
+    metrics.increment("llm_hedges", endpoint=key)
+    if hedge_runnable is None:
+        hedge = asyncio.create_task(_stream(runnable, inputs, key, asyncio.Event()))
+    else:
+        hedge = asyncio.create_task(_stream(hedge_runnable, inputs, f"{key}:hedge", asyncio.Event()))
+    pending = {primary, hedge}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None:
+                    metrics.increment("llm_hedge_wins", endpoint=key,
+                                      winner="hedge" if task is hedge else "primary")
+                    return task.result()
+        # Both calls failed: surface the primary error
+        return primary.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -1,30 +1,64 @@
+import logging
 import os
 from pathlib import Path
 from langchain.prompts import PromptTemplate
 from langchain_mistralai.chat_models import ChatMistralAI
 from langchain.output_parsers import PydanticOutputParser
-from typing import Dict, Optional, Any, Union
-from .models import LearningPlan, FeedbackResponse, LLMParsingError
+from typing import Dict, Optional, Any, Union, Callable, Type
+from langchain_core.messages import AIMessage
+from pydantic import BaseModel
+from . import metrics
+from .state import provider_rate_limiter
+from .deadline import deadline_callback
+from .usage import usage_callback
+from .cassette import with_cassette
+from .prompt_profile import profiler
+from .offload import offload_parse
+from .compaction import expand_keys
+from .models import LearningPlan, ChapterContent, FeedbackResponse, LLMParsingError
+import inspect
 import json
 import re
 
-# Initialize the Mistral LLM
-llm = ChatMistralAI(
+logger = logging.getLogger(__name__)
+
+# Initialize the Mistral LLM (wrapped for record/replay when LLM_CASSETTE_MODE is set)
+llm = with_cassette(ChatMistralAI(
     mistral_api_key=os.environ.get("MISTRAL_API_KEY"),
     temperature=0.7,
     max_tokens=4000,  # Ensure enough tokens for complete responses
+    rate_limiter=provider_rate_limiter,  # Shared provider quota (see state.py)
+    callbacks=[deadline_callback, usage_callback],  # Per-request deadline and token usage (see deadline.py)
     model_kwargs={
         "stop": None,  # Don't stop generation early
         "frequency_penalty": 0.0,  # Reduce repetition
         "presence_penalty": 0.0  # Maintain focus
     }
-)
+))
+
+# Optional second model profile used for hedged requests (see hedging.py)
+hedge_llm = with_cassette(ChatMistralAI(
+    mistral_api_key=os.environ.get("MISTRAL_API_KEY"),
+    model=os.environ["HEDGE_MODEL"],
+    temperature=0.7,
+    max_tokens=4000,
+    rate_limiter=provider_rate_limiter,
+    callbacks=[deadline_callback, usage_callback]
+)) if os.environ.get("HEDGE_MODEL") else llm
+
+# Structured output mode: "off" parses free text, otherwise the provider is asked
+# to follow the Pydantic JSON schema ("json_schema", "function_calling" or "json_mode")
+STRUCTURED_OUTPUT = os.environ.get("LLM_STRUCTURED_OUTPUT", "off")
+# Extra structured calls made before falling back to free-text parsing
+STRUCTURED_OUTPUT_RETRIES = int(os.environ.get("STRUCTURED_OUTPUT_RETRIES", "1"))
 
 # Get paths to prompt files
 prompts_dir = Path(__file__).parent.parent / 'prompts'
 context_prompt_path = prompts_dir / 'prompt_context.txt'
 plan_prompt_path = prompts_dir / 'prompt_plan.txt'
-chapters_batch_prompt_path = prompts_dir / 'prompt_chapters_batch.txt'
+chapter_prompt_path = prompts_dir / 'prompt_chapter.txt'
+chapter_json_prompt_path = prompts_dir / 'prompt_chapter_json.txt'
+chapter_repair_prompt_path = prompts_dir / 'prompt_chapter_repair.txt'
 feedback_prompt_path = prompts_dir / 'prompt_feedback.txt'
 
 def read_prompt_template(file_path: str) -> str:
@@ -98,7 +132,7 @@ def parse_llm_output(output: str) -> str:
 
 def parse_text_content(text: str) -> Dict[str, Any]:
     """Parse text-based content with XML-like tags into a structured format."""
-    print("Parsing text content...")
+    logger.debug("Parsing text content")
     chapters = []
     current_chapter = None
     current_section = None
@@ -168,15 +202,19 @@ def parse_text_content(text: str) -> Dict[str, Any]:
 def try_parse_json(content: str) -> Dict[str, Any]:
     """Try to parse content as JSON first, then fall back to text parsing."""
     try:
-        print("Attempting direct JSON parse...")
-        return json.loads(content)
+        logger.debug("Attempting direct JSON parse")
+        data = json.loads(content)
+        metrics.increment("llm_parse", method="json")
+        return data
     except json.JSONDecodeError as e1:
-        print(f"Direct parse failed: {str(e1)}")
-        print("Attempting text-based parsing...")
+        logger.debug("Direct parse failed (%s), attempting text-based parsing", e1)
         try:
-            return parse_text_content(content)
+            data = parse_text_content(content)
+            metrics.increment("llm_parse", method="text")
+            return data
         except Exception as e2:
-            print(f"Text parsing failed: {str(e2)}")
+            logger.warning("Text parsing failed: %s", e2)
+            metrics.increment("llm_parse", method="failed")
             raise e1
 
 def parse_plan_output(result) -> LearningPlan:
@@ -196,6 +234,7 @@ def parse_plan_output(result) -> LearningPlan:
             return LearningPlan.model_validate(data)
         except Exception as e:
             # Last resort: create a minimal valid plan
+            metrics.increment("plan_parse_recovered_empty")
             content_summary = result.content[:100] + "..." if len(result.content) > 100 else result.content
             return LearningPlan(
                 title="Learning Plan (Recovered)",
@@ -208,6 +247,100 @@ def parse_plan_output(result) -> LearningPlan:
             {"error": str(e), "output": result.content}
         )
 
+def extract_chapter_data(text: str) -> Dict[str, Any]:
+    """Extract the raw content fields of a single chapter from LLM output.
+
+    Returns whatever sections could be found, possibly an empty dict, without
+    validating them against ChapterContent.
+    """
+    try:
+        if re.search(r'<(introduction|theory|guided_practice|challenge|conclusion|resources)>', text):
+            data = parse_text_content(text)
+        else:
+            data = try_parse_json(parse_llm_output(text))
+    except Exception:
+        return {}
+    # Accept a bare content object as well as the batch {"chapters": [...]} shape
+    if isinstance(data, dict) and isinstance(data.get("chapters"), list):
+        data = data["chapters"][0] if data["chapters"] else {}
+    if isinstance(data, dict) and isinstance(data.get("content"), dict):
+        data = data["content"]
+    return data if isinstance(data, dict) else {}
+
+def parse_chapter_output(result) -> ChapterContent:
+    """Parse the LLM output for a single chapter into a ChapterContent object."""
+    try:
+        return ChapterContent.model_validate(extract_chapter_data(result.content))
+    except Exception as e:
+        raise LLMParsingError(
+            "Failed to parse chapter content from LLM output",
+            {"error": str(e), "output": result.content}
+        )
+
+def structured_output_message(output: Dict[str, Any]) -> AIMessage:
+    """Raw message of a structured call, with tool call arguments as its content.
+
+    Lets the free-text parse-and-repair path work on function-calling output.
+    """
+    raw = output["raw"]
+    for call in getattr(raw, "tool_calls", None) or []:
+        return AIMessage(
+            content=json.dumps(call["args"], ensure_ascii=False),
+            response_metadata=raw.response_metadata
+        )
+    return raw
+
+async def _apply_fallback(fallback: Callable[[Any], Any], message):
+    """Run a fallback parser; large outputs are parsed off the event loop."""
+    if inspect.iscoroutinefunction(fallback):
+        return await fallback(message)
+    return await offload_parse(fallback, message, len(message.content))
+
+async def ainvoke_structured(
+    chain,
+    structured_chain,
+    inputs: Dict[str, Any],
+    schema: Type[BaseModel],
+    fallback: Callable[[Any], Any],
+    name: str
+):
+    """Invoke a chain in structured-output mode when enabled.
+
+    The provider-validated object is returned directly. When it is missing or
+    invalid, the raw output is validated locally against `schema`; if that
+    fails too the call is retried, and the last output finally goes through
+    the free-text `fallback` parser.
+
+    Args:
+        chain: Free-text chain, used when structured output is off
+        structured_chain: Chain returning {"raw", "parsed", "parsing_error"}, or None
+        inputs: Prompt variables
+        schema: Pydantic model the output must match
+        fallback: Parser taking an LLM message, e.g. parse_plan_output, or an
+            async function
+        name: Label used in metrics
+    """
+    if structured_chain is None:
+        return await _apply_fallback(fallback, await chain.ainvoke(inputs))
+
+    for attempt in range(STRUCTURED_OUTPUT_RETRIES + 1):
+        output = await structured_chain.ainvoke(inputs)
+        if output.get("parsed") is not None:
+            metrics.increment("structured_output", chain=name, outcome="provider")
+            return output["parsed"]
+
+        message = structured_output_message(output)
+        try:
+            parsed = schema.model_validate_json(message.content)
+            metrics.increment("structured_output", chain=name, outcome="local")
+            return parsed
+        except Exception:
+            if attempt < STRUCTURED_OUTPUT_RETRIES:
+                metrics.increment("structured_output", chain=name, outcome="retry")
+
+    metrics.increment("structured_output", chain=name, outcome="fallback")
+    return await _apply_fallback(fallback, message)
+
 def parse_feedback_output(result) -> FeedbackResponse:
     """Parse LLM output into a FeedbackResponse object."""
     try:
@@ -216,10 +349,11 @@ def parse_feedback_output(result) -> FeedbackResponse:
             data = try_parse_json(content)
             return FeedbackResponse(
                 response=data.get("response", ""),
-                plan=LearningPlan.model_validate(data["plan"]) if data.get("plan") else None
+                plan=LearningPlan.model_validate(expand_keys(data["plan"])) if data.get("plan") else None
             )
         except Exception:
             # If JSON parsing fails completely, extract text response
+            metrics.increment("feedback_parse_text_only")
             text = re.sub(r'```.*?```', '', content, flags=re.DOTALL)  # Remove code blocks
             text = re.sub(r'[\r\n]+', ' ', text)  # Normalize newlines
             text = text.strip()
@@ -241,9 +375,20 @@ plan_prompt = PromptTemplate(
     template=read_prompt_template(plan_prompt_path)
 )
 
-chapters_batch_prompt = PromptTemplate(
-    input_variables=["learning_plan"],
-    template=read_prompt_template(chapters_batch_prompt_path)
+chapter_prompt = PromptTemplate(
+    input_variables=["learning_plan", "chapter", "prerequisites_summary"],
+    template=read_prompt_template(chapter_prompt_path)
+)
+
+# Variant asking for JSON instead of XML sections, for structured output mode
+chapter_json_prompt = PromptTemplate(
+    input_variables=["learning_plan", "chapter", "prerequisites_summary"],
+    template=read_prompt_template(chapter_json_prompt_path)
+)
+
+chapter_repair_prompt = PromptTemplate(
+    input_variables=["learning_plan", "chapter", "sections", "errors", "previous_output"],
+    template=read_prompt_template(chapter_repair_prompt_path)
 )
 
 feedback_prompt = PromptTemplate(
@@ -251,8 +396,61 @@ feedback_prompt = PromptTemplate(
     template=read_prompt_template(feedback_prompt_path)
 )
 
+def schema_prompt(prompt: PromptTemplate, schema: Type[BaseModel]) -> PromptTemplate:
+    """`prompt` followed by the JSON schema of the expected answer.
+
+    The provider only receives the schema with "json_schema" and
+    "function_calling"; in "json_mode" the prompt is all the model sees.
+    """
+    schema_json = json.dumps(schema.model_json_schema(), ensure_ascii=False)
+    return PromptTemplate(
+        input_variables=prompt.input_variables,
+        template=(
+            prompt.template
+            + "\n\nSchéma JSON que la réponse doit respecter :\n"
+            + schema_json.replace("{", "{{").replace("}", "}}")
+        )
+    )
+
+def structured(prompt: PromptTemplate, schema: Type[BaseModel], name: str, model=None):
+    """JSON prompt piped into the schema-constrained model, or None when disabled.
+
+    Args:
+        prompt: Prompt asking for a JSON answer; the schema is appended to it
+        schema: Pydantic model of the answer
+        name: Chain name, for profiling and cassettes
+        model: Chat model, `llm` by default
+    """
+    if STRUCTURED_OUTPUT == "off":
+        return None
+    prompt = schema_prompt(prompt, schema)
+    model = model or llm
+    return (
+        profiler(prompt, name)
+        | prompt
+        | model.with_structured_output(schema, method=STRUCTURED_OUTPUT, include_raw=True)
+    ).with_config(tags=[f"chain:{name}"])
+
+def chain(prompt: PromptTemplate, model, name: str):
+    """Prompt piped into `model`, tagged with its name for cassettes and metrics.
+
+    Prompt sizes are profiled per variable (see prompt_profile.py).
+    """
+    return (profiler(prompt, name) | prompt | model).with_config(tags=[f"chain:{name}"])
+
 # Create the chains
-context_chain = context_prompt | llm
-plan_chain = plan_prompt | llm
-chapters_chain = chapters_batch_prompt | llm
-feedback_chain = feedback_prompt | llm
+context_chain = chain(context_prompt, llm, "context")
+# Only set with a distinct HEDGE_MODEL, whose latencies are tracked apart
+context_hedge_chain = chain(context_prompt, hedge_llm, "context") if hedge_llm is not llm else None
+plan_chain = chain(plan_prompt, llm, "plan")
+chapter_chain = chain(chapter_prompt, llm, "chapter")
+# Free-text counterpart of chapter_structured_chain, for continuation and regeneration
+chapter_json_schema_prompt = schema_prompt(chapter_json_prompt, ChapterContent)
+chapter_json_chain = chain(chapter_json_schema_prompt, llm, "chapter_json")
+chapter_repair_chain = chain(chapter_repair_prompt, llm, "chapter_repair")
+feedback_chain = chain(feedback_prompt, llm, "feedback")
+
+# Schema-constrained chains (None unless LLM_STRUCTURED_OUTPUT is enabled)
+plan_structured_chain = structured(plan_prompt, LearningPlan, "plan")
+chapter_structured_chain = structured(chapter_json_prompt, ChapterContent, "chapter")
+feedback_structured_chain = structured(feedback_prompt, FeedbackResponse, "feedback")
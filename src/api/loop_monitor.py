@@ -0,0 +1,128 @@
+"""Event-loop health diagnostics.
+
+With `LOOP_DIAGNOSTICS=1`, each worker runs:
+
+- a heartbeat task that sleeps `LOOP_LAG_INTERVAL` seconds and records how
+  late it wakes up (the event-loop lag), as the `event_loop_lag_seconds`
+  summary;
+- a watchdog thread that notices when the heartbeat stops for longer than
+  `LOOP_BLOCK_THRESHOLD` seconds, i.e. when a callback is blocking the loop,
+  and captures the loop thread's stack at that moment, so the blocking code
+  is named. Blocks are counted as `event_loop_blocked` and timed as
+  `event_loop_block_seconds`.
+
+Recent lag statistics and blocks with their stacks are served by
+`/api/admin/loop`.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from . import metrics
+
+LOOP_DIAGNOSTICS = os.environ.get("LOOP_DIAGNOSTICS", "0") == "1"
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.1"))
+LOOP_BLOCK_THRESHOLD = float(os.environ.get("LOOP_BLOCK_THRESHOLD", "0.1"))
+# Number of recent blocks kept with their stacks
+LOOP_BLOCK_HISTORY = int(os.environ.get("LOOP_BLOCK_HISTORY", "50"))
+
+# Lag samples kept for the admin endpoint statistics
+LAG_SAMPLES = 600
+
+
+class LoopMonitor:
+    """Measures event-loop lag and catches callbacks blocking the loop."""
+
+    def __init__(self, interval: float, threshold: float, history: int):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: Deque[float] = deque(maxlen=LAG_SAMPLES)
+        self.blocks: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self.blocked_total = 0
+        self._lock = threading.Lock()
+        self._heartbeat = time.monotonic()
+        self._current: Optional[Dict[str, Any]] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Start monitoring the running event loop."""
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _measure(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - start - self.interval)
+            with self._lock:
+                self._heartbeat = now
+                self.lags.append(lag)
+                if self._current is not None:
+                    # The blocking callback returned: record its full duration
+                    self._current["duration"] = round(lag, 4)
+                    metrics.observe("event_loop_block_seconds", lag)
+                    self._current = None
+            metrics.observe("event_loop_lag_seconds", lag)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 2):
+            with self._lock:
+                stalled = time.monotonic() - self._heartbeat - self.interval
+                if stalled <= self.threshold:
+                    continue
+                if self._current is not None:
+                    self._current["duration"] = round(stalled, 4)
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                self._current = {
+                    "started_at": time.time() - stalled,
+                    "duration": round(stalled, 4),
+                    "stack": traceback.format_stack(frame) if frame is not None else [],
+                }
+                self.blocks.append(self._current)
+                self.blocked_total += 1
+            metrics.increment("event_loop_blocked")
+
+    def stats(self) -> Dict[str, Any]:
+        """Lag statistics over recent samples and the most recent blocks."""
+        with self._lock:
+            lags = sorted(self.lags)
+            blocks: List[Dict[str, Any]] = [
+                {**block, "ongoing": block is self._current} for block in reversed(self.blocks)
+            ]
+        return {
+            "pid": os.getpid(),
+            "interval": self.interval,
+            "threshold": self.threshold,
+            "lag": {
+                "samples": len(lags),
+                "mean": sum(lags) / len(lags) if lags else 0.0,
+                "p99": lags[min(len(lags) - 1, int(0.99 * len(lags)))] if lags else 0.0,
+                "max": lags[-1] if lags else 0.0,
+            },
+            "blocked_total": self.blocked_total,
+            "blocks": blocks,
+        }
+
+
+monitor = LoopMonitor(LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD, LOOP_BLOCK_HISTORY)
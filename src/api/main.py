@@ -1,24 +1,74 @@
-import json
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hmac
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import Depends, FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from .models import (
     ContextRequest, PlanRequest, LearningPlan, ContentRequest,
     FeedbackRequest, FeedbackResponse, APIError, LLMParsingError,
-    ChatRequest, ChatResponse, ChapterContent
+    PlanGraphError, PlanNotIndexed, ChatRequest, ChatResponse
 )
-from .chat import chat_with_assistant
+from .chat import achat_with_assistant, request_context
+from .hedging import hedged_ainvoke
+from .state import cached
+from .deadline import DeadlineMiddleware, DeadlineExceeded
+from .validation import json_response, PLAN_ADAPTER
+from .admission import AdmissionMiddleware, controller as admission_controller
+from .content import generate_plan_content
+from .compaction import feedback_plan, restore_contents
+from . import plan_library, retrieval
+from .loop_monitor import LOOP_DIAGNOSTICS, monitor as loop_monitor
+from . import offload
+from .usage import USAGE_FLUSH_INTERVAL, aggregator as usage_aggregator
+from . import metrics
 from .llm import (
-    context_chain, plan_chain, chapters_chain, feedback_chain,
-    parse_plan_output, parse_feedback_output, parse_llm_output, try_parse_json
+    context_chain, context_hedge_chain, plan_chain, feedback_chain,
+    plan_structured_chain, feedback_structured_chain, ainvoke_structured,
+    parse_plan_output, parse_feedback_output
 )
 
+# Seconds a generated context question is shared across workers. Disabled by
+# default: learners asking about the same subject would get the same question
+CONTEXT_CACHE_TTL = float(os.environ.get("CONTEXT_CACHE_TTL", "0"))
+# Bearer token of the /api/admin/* routes, which are not served when unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Event-loop lag and blocking-call diagnostics, per worker
+    if LOOP_DIAGNOSTICS:
+        loop_monitor.start()
+    # Parsing process pool, when PARSE_EXECUTOR=process
+    offload.start()
+    # Periodic flush of token usage to storage
+    usage_flusher = asyncio.create_task(usage_aggregator.run(USAGE_FLUSH_INTERVAL))
+    # Plan library, reloaded when the build job replaces the file
+    library_watcher = asyncio.create_task(plan_library.watch(plan_library.PLAN_LIBRARY_RELOAD_INTERVAL))
+    yield
+    for task in (usage_flusher, library_watcher):
+        task.cancel()
+    await asyncio.gather(usage_flusher, library_watcher, return_exceptions=True)
+    offload.shutdown()
+    if LOOP_DIAGNOSTICS:
+        await loop_monitor.stop()
+
 app = FastAPI(
     title="Learning Path Generator API",
     description="API for generating personalized learning paths using LLMs",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Queue or shed LLM-bound requests by endpoint priority
+app.add_middleware(AdmissionMiddleware)
+
+# Cancel requests whose deadline passed or whose client disconnected; wraps
+# admission so queue time counts against the deadline, and is wrapped by CORS
+app.add_middleware(DeadlineMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -26,8 +76,29 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Plan-Id", "X-Failed-Chapters"],
 )
 
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request, exc: DeadlineExceeded):
+    return JSONResponse(
+        status_code=504,
+        content={
+            "message": exc.message,
+            "details": exc.details
+        }
+    )
+
+@app.exception_handler(PlanNotIndexed)
+async def plan_not_indexed_handler(request, exc: PlanNotIndexed):
+    return JSONResponse(
+        status_code=409,
+        content={
+            "message": exc.message,
+            "details": exc.details
+        }
+    )
+
 # Custom error handler
 @app.exception_handler(APIError)
 async def api_error_handler(request, exc: APIError):
@@ -43,13 +114,14 @@ async def api_error_handler(request, exc: APIError):
 async def chat(request: ChatRequest) -> ChatResponse:
     """Chat with the learning assistant about the current topic."""
     try:
-        # Get response from assistant with simplified context
-        response = chat_with_assistant(
-            context=request.context,
+        response = await achat_with_assistant(
+            context=await request_context(request),
             message=request.message
         )
         
         return ChatResponse(response=response)
+    except (DeadlineExceeded, PlanNotIndexed):
+        raise
     except Exception as e:
         raise APIError(
             message="Failed to process chat message",
@@ -59,9 +131,19 @@ async def chat(request: ChatRequest) -> ChatResponse:
 @app.post("/api/context", response_model=str)
 async def generate_context_question(request: ContextRequest) -> str:
     """Generate a context question based on the learning subject."""
-    try:
-        result = await context_chain.ainvoke({"subject": request.subject})
+    async def generate() -> str:
+        result = await hedged_ainvoke(
+            context_chain, {"subject": request.subject},
+            key="context", hedge_runnable=context_hedge_chain
+        )
         return result.content
+
+    try:
+        if CONTEXT_CACHE_TTL > 0:
+            return await cached("context", (request.subject.strip().lower(),), generate, CONTEXT_CACHE_TTL)
+        return await generate()
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -73,14 +155,23 @@ async def generate_context_question(request: ContextRequest) -> str:
 
 @app.post("/api/plan", response_model=LearningPlan)
 async def generate_learning_plan(request: PlanRequest) -> LearningPlan:
-    """Generate a learning plan based on subject and context."""
+    """Generate a learning plan based on subject and context.
+    
+    Plans pre-generated in the plan library are served without calling the LLM.
+    """
+    cached_plan = plan_library.lookup_plan(request.subject, request.context)
+    if cached_plan is not None:
+        return Response(content=cached_plan, media_type="application/json")
     try:
         # Generate learning plan
-        result = await plan_chain.ainvoke({
-            "sujet": request.subject,
-            "context": request.context
-        })
-        return parse_plan_output(result)
+        plan = await ainvoke_structured(
+            plan_chain, plan_structured_chain,
+            {"sujet": request.subject, "context": request.context},
+            LearningPlan, parse_plan_output, "plan"
+        )
+        return json_response(plan)
+    except DeadlineExceeded:
+        raise
     except LLMParsingError as e:
         raise APIError(
             message="Failed to generate a valid learning plan",
@@ -103,7 +194,18 @@ async def generate_content(request: ContentRequest) -> LearningPlan:
     """Generate detailed content for each chapter in the learning plan.
     
     This endpoint takes an existing learning plan and generates detailed content
-    for each chapter in the plan.
+    for each chapter in the plan. Chapters are generated in prerequisite order:
+    chapters of the same topological level run in parallel, and each chapter's
+    prompt includes a summary of its prerequisites' content.
+    
+    Chapters whose output cannot be repaired are returned with `content: null`
+    and listed in the `X-Failed-Chapters` response header, so the client only
+    needs to regenerate those.
+    
+    Contents of plans from the plan library are served pre-generated.
+    
+    Contents are indexed for /api/chat as chapters complete; the plan id to
+    send with chat messages is returned in the `X-Plan-Id` header.
     
     Example request:
     {
@@ -120,84 +222,33 @@ async def generate_content(request: ContentRequest) -> LearningPlan:
         }
     }
     """
+    cached_plan = plan_library.lookup_content(request.plan)
+    if cached_plan is not None:
+        await retrieval.cache.for_json(cached_plan)
+        return Response(
+            content=cached_plan, media_type="application/json",
+            headers={"X-Plan-Id": retrieval.plan_id(cached_plan)}
+        )
     try:
-        # Generate all chapter contents
-        result = await chapters_chain.ainvoke({
-            "learning_plan": json.dumps(request.plan.model_dump(), ensure_ascii=False)
-        })
-        
-        # Debug: Print raw LLM output
-        print("Raw LLM output:")
-        print(result.content)
-        
-        # Extract and parse the JSON content
-        content = parse_llm_output(result.content)
-        print("\nParsed content:")
-        print(content)
-        try:
-            data = try_parse_json(content)
-            
-            # Validate the response structure
-            if not isinstance(data, dict) or 'chapters' not in data or not isinstance(data['chapters'], list):
-                raise ValueError("Invalid response structure: missing or invalid 'chapters' array")
-            
-            # Create a deep copy of the plan to avoid modifying the original
-            updated_plan = request.plan.model_copy(deep=True)
-            
-            # Create a map of chapter IDs to their indices for faster lookup
-            chapter_map = {chapter.id: i for i, chapter in enumerate(updated_plan.chapters)}
-            
-            # Get the original chapter IDs in order
-            chapter_ids = [c.id for c in request.plan.chapters]
-            
-            # Process each chapter's content
-            for i, chapter_data in enumerate(data['chapters']):
-                # Validate chapter data structure
-                if not isinstance(chapter_data, dict):
-                    print(f"Invalid chapter data type: {type(chapter_data)}")
-                    continue
-                    
-                chapter_content = chapter_data.get('content')
-                if not chapter_content:
-                    print(f"Missing content for chapter")
-                    continue
-                
-                # Map the chapter to the correct ID from the plan
-                if i < len(chapter_ids):
-                    chapter_id = chapter_ids[i]
-                    chapter_data['id'] = chapter_id
-                else:
-                    print(f"Extra chapter content ignored")
-                    continue
-                
-                print(f"\nProcessing chapter {chapter_id}")
-                print("Content:", json.dumps(chapter_content, indent=2))
-                
-                # Find and update the chapter if it exists in our plan
-                if chapter_id in chapter_map:
-                    try:
-                        print(f"Validating content against ChapterContent model...")
-                        validated_content = ChapterContent.model_validate(chapter_content)
-                        print("Content validation successful")
-                        updated_plan.chapters[chapter_map[chapter_id]].content = validated_content
-                    except Exception as e:
-                        print(f"Error validating content for chapter {chapter_id}: {str(e)}")
-                        raise ValueError(f"Invalid content structure for chapter {chapter_id}: {str(e)}")
-                else:
-                    print(f"Chapter {chapter_id} not found in plan")
-            
-            return updated_plan
-            
-        except ValueError as e:
-            raise LLMParsingError(
-                "Invalid or incomplete chapter contents",
-                {"error": str(e), "output": content}
-            )
-        except Exception as e:
-            raise LLMParsingError(
-                "Failed to parse chapter contents",
-                {"error": str(e), "output": content}
-            )
+        index = retrieval.ChapterIndex(request.plan.title)
+        plan, failures = await generate_plan_content(request.plan, on_chapter=index.add_chapter)
+        data = PLAN_ADAPTER.dump_json(plan)
+        key = retrieval.plan_id(data)
+        retrieval.cache.put(key, index)
+        headers = {"X-Plan-Id": key}
+        if failures:
+            headers["X-Failed-Chapters"] = ",".join(failures)
+        return Response(content=data, media_type="application/json", headers=headers)
+    except DeadlineExceeded:
+        raise
+    except PlanGraphError as e:
+        raise APIError(
+            message="Invalid chapter prerequisites",
+            details={
+                "error": str(e),
+                "graph_error": e.details
+            }
+        )
     except LLMParsingError as e:
         raise APIError(
             message="Failed to generate valid chapter contents",
@@ -228,13 +279,20 @@ async def process_feedback(request: FeedbackRequest) -> FeedbackResponse:
     """
     try:
         # Get feedback
-        result = await feedback_chain.ainvoke({
-            "context": request.context,
-            "current_plan": json.dumps(request.current_plan.model_dump(), ensure_ascii=False),
-            "user_message": request.user_message,
-            "conversation_history": "\n".join(request.conversation_history)
-        })
-        return parse_feedback_output(result)
+        feedback = await ainvoke_structured(
+            feedback_chain, feedback_structured_chain,
+            {
+                "context": request.context,
+                "current_plan": feedback_plan(request.current_plan),
+                "user_message": request.user_message,
+                "conversation_history": "\n".join(request.conversation_history)
+            },
+            FeedbackResponse, parse_feedback_output, "feedback"
+        )
+        feedback.plan = restore_contents(request.current_plan, feedback.plan)
+        return json_response(feedback)
+    except DeadlineExceeded:
+        raise
     except LLMParsingError as e:
         # If parsing fails but we have a response message, return it
         if "output" in e.details:
@@ -254,3 +312,36 @@ async def process_feedback(request: FeedbackRequest) -> FeedbackResponse:
                 "error": str(e)
             }
         )
+
+@app.get("/api/metrics")
+async def get_metrics() -> dict:
+    """Export in-process counters, timing summaries and admission state."""
+    return {**metrics.snapshot(), "admission": admission_controller.stats()}
+
+async def require_admin(authorization: Optional[str] = Header(None)) -> None:
+    """Allow admin routes only with `Authorization: Bearer <ADMIN_TOKEN>`.
+    
+    They expose user ids, token usage and stack traces, so they answer 404
+    when no ADMIN_TOKEN is configured.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid admin token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+@app.get("/api/admin/loop", dependencies=[Depends(require_admin)])
+async def get_loop_health() -> dict:
+    """Event-loop lag and recent blocking callbacks with their stacks (LOOP_DIAGNOSTICS=1)."""
+    if not LOOP_DIAGNOSTICS:
+        return {"enabled": False}
+    return {"enabled": True, **loop_monitor.stats()}
+
+@app.get("/api/admin/usage", dependencies=[Depends(require_admin)])
+async def get_usage() -> dict:
+    """Token usage per user known to this worker, and usage not yet flushed."""
+    return usage_aggregator.stats()
@@ -12,6 +12,14 @@ class LLMParsingError(APIError):
     """Raised when the LLM output cannot be parsed"""
     pass
 
+class PlanGraphError(APIError):
+    """Raised when chapter prerequisites do not form a valid DAG"""
+    pass
+
+class PlanNotIndexed(APIError):
+    """Raised when a chat names a plan_id this worker has no index for, without the plan"""
+    pass
+
 class ChapterContent(BaseModel):
     introduction: str = Field(..., description="Chapter objectives and importance")
     theory: str = Field(..., description="Clear explanation of essential concepts")
@@ -69,8 +77,12 @@ class FeedbackResponse(BaseModel):
 
 class ChatRequest(BaseModel):
     """Request model for chat endpoint."""
-    context: str = Field(..., description="Complete context including learning plan, current chapter, and conversation history")
+    context: str = Field("", description="Complete context including learning plan, current chapter, and conversation history; with plan_id or plan, only the learner's context")
     message: str = Field(..., description="User's message to respond to")
+    plan_id: Optional[str] = Field(None, description="Plan id returned by /api/generate_content in the X-Plan-Id header")
+    plan: Optional[LearningPlan] = Field(None, description="Learning plan with contents, used when plan_id is unknown to the server")
+    current_chapter: Optional[str] = Field(None, description="ID of the chapter being studied")
+    conversation_history: List[str] = Field(default_factory=list, description="Previous conversation messages")
 
     class Config:
         json_schema_extra = {
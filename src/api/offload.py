@@ -0,0 +1,140 @@
+"""Running CPU-heavy parsing off the event loop.
+
+Parsing, repairing and validating LLM output (regex repair, text-section
+extraction, Pydantic validation) is pure CPU work. Inputs larger than
+`PARSE_OFFLOAD_THRESHOLD` characters are parsed by an executor so other
+requests keep being served; smaller ones are parsed inline, where the
+handoff would cost more than it saves.
+
+`PARSE_EXECUTOR` selects the executor:
+
+- `thread` (default): a worker thread; frees the event loop, but parsing
+  still holds the GIL;
+- `process`: a pool of `PARSE_PROCESSES` processes (default one per core), so
+  parsing scales with cores. The raw text is handed over through shared
+  memory rather than pickled through the pool's pipe; parsers must be
+  module-level functions. Metrics recorded by the parser in the worker are
+  merged back into this process.
+
+Every job is timed as the `parse_job_seconds` summary (labels `parser` and
+`executor`); process jobs also record the worker's CPU time as
+`parse_job_cpu_seconds`.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from langchain_core.messages import AIMessage
+
+from . import metrics
+
+# Characters above which parsing is offloaded (0 disables offloading). Parsing
+# a 16000-character chapter takes about 0.1 ms as XML sections and 0.2 ms as
+# JSON, the cost of a thread handoff (0.1 ms) or less than a process one
+# (0.5 ms), so smaller outputs are parsed inline (src/scripts/bench_offload.py)
+PARSE_OFFLOAD_THRESHOLD = int(os.environ.get("PARSE_OFFLOAD_THRESHOLD", "16000"))
+PARSE_EXECUTOR = os.environ.get("PARSE_EXECUTOR", "thread")
+PARSE_PROCESSES = int(os.environ.get("PARSE_PROCESSES", "0")) or os.cpu_count() or 1
+
+T = TypeVar("T")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _warm() -> None:
+    """Import the parsers once per worker process, before the first job."""
+    from . import llm, recovery  # noqa: F401
+
+
+def _run_job(parser: Callable[[Any], T], shm_name: str, size: int, message: bool) -> Tuple[T, List[Dict[str, Any]], float]:
+    """Worker side of a process job: read the text from shared memory and parse it.
+
+    Returns:
+        Tuple of (parser result, metric counters it recorded, CPU seconds)
+    """
+    start = time.process_time()
+    # Spawned workers share the parent's resource tracker; the parent unlinks
+    shm = SharedMemory(name=shm_name)
+    try:
+        text = str(shm.buf[:size], "utf-8")
+    finally:
+        shm.close()
+    metrics.reset()
+    result = parser(AIMessage(content=text) if message else text)
+    return result, metrics.snapshot()["counters"], time.process_time() - start
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """The parsing process pool, started on first use."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=PARSE_PROCESSES,
+            # Forking a process running an event loop and threads is unsafe
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm,
+        )
+    return _pool
+
+
+def start() -> None:
+    """Start the process pool ahead of the first job, when it is used."""
+    if PARSE_EXECUTOR == "process" and PARSE_OFFLOAD_THRESHOLD:
+        pool = get_pool()
+        for _ in range(PARSE_PROCESSES):
+            pool.submit(_warm)
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def _run_in_process(parser: Callable[[Any], T], value: Any) -> T:
+    message = not isinstance(value, str)
+    data = (value.content if message else value).encode("utf-8")
+    shm = SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        shm.buf[:len(data)] = data
+        result, counters, cpu_seconds = await asyncio.get_running_loop().run_in_executor(
+            get_pool(), _run_job, parser, shm.name, len(data), message
+        )
+    finally:
+        shm.close()
+        shm.unlink()
+    for counter in counters:
+        metrics.increment(counter["name"], counter["value"], **counter["labels"])
+    metrics.observe("parse_job_cpu_seconds", cpu_seconds, parser=parser.__name__)
+    return result
+
+
+async def offload_parse(parser: Callable[[Any], T], value: Any, size: int) -> T:
+    """Run `parser(value)` inline, or in the configured executor when `size` is large.
+
+    Args:
+        parser: Synchronous, module-level parsing function
+        value: Its argument: raw text, or an LLM message (only its content is
+            passed to process workers)
+        size: Size of the input in characters
+    """
+    executor = "inline"
+    if PARSE_OFFLOAD_THRESHOLD and size > PARSE_OFFLOAD_THRESHOLD:
+        executor = "process" if PARSE_EXECUTOR == "process" else "thread"
+    start = time.perf_counter()
+    try:
+        if executor == "process":
+            return await _run_in_process(parser, value)
+        if executor == "thread":
+            return await asyncio.to_thread(parser, value)
+        return parser(value)
+    finally:
+        metrics.observe(
+            "parse_job_seconds", time.perf_counter() - start,
+            parser=parser.__name__, executor=executor
+        )
@@ -0,0 +1,110 @@
+"""Prerequisite graph of a learning plan.
+
+Chapters reference each other through `Chapter.prerequisites`. This module
+validates that graph (duplicate ids, dangling references, cycles) and derives
+the scheduling information used for content generation: the topological
+order and levels (chapters in the same level have no dependency on each
+other).
+"""
+from collections import Counter, deque
+from typing import Dict, List
+
+from .models import LearningPlan, PlanGraphError
+
+
+class PlanGraph:
+    """Validated prerequisite DAG of a learning plan.
+
+    Building the graph is O(V+E): Kahn's algorithm yields both the cycle check
+    and the topological levels in a single pass.
+    """
+
+    def __init__(self, plan: LearningPlan):
+        self.order: List[str] = [chapter.id for chapter in plan.chapters]
+        self.prerequisites: Dict[str, List[str]] = {}
+        self.dependents: Dict[str, List[str]] = {cid: [] for cid in self.order}
+
+        duplicates = sorted(cid for cid, count in Counter(self.order).items() if count > 1)
+        if duplicates:
+            raise PlanGraphError(
+                "Learning plan contains duplicate chapter ids",
+                {"duplicates": duplicates}
+            )
+
+        dangling: Dict[str, List[str]] = {}
+        for chapter in plan.chapters:
+            # Keep the declared order but ignore repeated prerequisites
+            prereqs = list(dict.fromkeys(chapter.prerequisites))
+            missing = [p for p in prereqs if p not in self.dependents]
+            if missing:
+                dangling[chapter.id] = missing
+                continue
+            self.prerequisites[chapter.id] = prereqs
+            for prereq in prereqs:
+                self.dependents[prereq].append(chapter.id)
+        if dangling:
+            raise PlanGraphError(
+                "Learning plan references unknown prerequisite chapters",
+                {"dangling": dangling}
+            )
+
+        self.levels: List[List[str]] = self._compute_levels()
+
+    def _compute_levels(self) -> List[List[str]]:
+        """Group chapters by depth using Kahn's algorithm, raising on cycles."""
+        indegree = {cid: len(self.prerequisites[cid]) for cid in self.order}
+        queue = deque(cid for cid in self.order if indegree[cid] == 0)
+        depth: Dict[str, int] = {cid: 0 for cid in queue}
+
+        while queue:
+            cid = queue.popleft()
+            for dependent in self.dependents[cid]:
+                depth[dependent] = max(depth.get(dependent, 0), depth[cid] + 1)
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    queue.append(dependent)
+
+        if len(depth) != len(self.order):
+            raise PlanGraphError(
+                "Learning plan prerequisites contain a cycle",
+                {"cycle": self._find_cycle(indegree)}
+            )
+
+        levels: List[List[str]] = [[] for _ in range(max(depth.values(), default=-1) + 1)]
+        for cid in self.order:
+            levels[depth[cid]].append(cid)
+        return levels
+
+    def _find_cycle(self, indegree: Dict[str, int]) -> List[str]:
+        """Return one concrete cycle among the chapters Kahn's algorithm could not order.
+
+        Every remaining chapter still has at least one remaining prerequisite,
+        so walking prerequisites from any of them must revisit a chapter.
+        """
+        remaining = {cid for cid, degree in indegree.items() if degree > 0}
+        start = next(cid for cid in self.order if cid in remaining)
+        seen: Dict[str, int] = {}
+        path: List[str] = []
+        current = start
+        while current not in seen:
+            seen[current] = len(path)
+            path.append(current)
+            current = next(p for p in self.prerequisites[current] if p in remaining)
+        cycle = path[seen[current]:]
+        # Report the cycle in dependency order (prerequisite first)
+        cycle.reverse()
+        return cycle + [cycle[0]]
+
+    def topological_order(self) -> List[str]:
+        """Chapter ids ordered so that prerequisites always come first."""
+        return [cid for level in self.levels for cid in level]
+
+
+def build_plan_graph(plan: LearningPlan) -> PlanGraph:
+    """Validate the prerequisites of a plan and return its graph.
+
+    Raises:
+        PlanGraphError: If chapter ids are duplicated, a prerequisite does not
+            exist or the prerequisites form a cycle
+    """
+    return PlanGraph(plan)
@@ -0,0 +1,288 @@
+"""Pre-generated library of learning plans and chapter contents.
+
+Most traffic is for a few hundred subjects, so plans and their contents are
+generated offline (src/scripts/build_plan_library.py) for a list of subjects
+and learner profiles, and served from a single memory-mapped file:
+
+    MAGIC | index length (uint64) | index JSON | entry bytes...
+
+The index maps each key to the offset, length and CRC32 of a plan already
+serialized as response JSON, and to the fingerprint of the prompts (and
+structured output mode) it was generated with. Checksums are verified once
+when the file is opened, dropping corrupt entries, so a lookup is one dict
+access and one slice of the mapping; entries built with prompts that have
+since changed count as misses, so a stale library is never served.
+
+Keys:
+- `plan:<subject>:<profile>`: plan without contents, served by /api/plan when
+  the subject matches and the learner context matches a profile's keywords
+- `content:<structure hash>`: the same plan with every chapter's content,
+  served by /api/generate_content for an identical plan structure; the hash
+  of each structure seen is cached
+
+`PLAN_LIBRARY_PATH` enables the library. It is opened at startup, and the
+file, replaced atomically by the build job, is checked every
+`PLAN_LIBRARY_RELOAD_INTERVAL` seconds and reloaded when it changed.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import unicodedata
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import metrics
+from .compaction import PROMPT_COMPACTION
+from .llm import (
+    llm, plan_prompt, chapter_prompt, chapter_json_prompt, chapter_repair_prompt, STRUCTURED_OUTPUT
+)
+from .models import LearningPlan
+
+logger = logging.getLogger(__name__)
+
+PLAN_LIBRARY_PATH = os.environ.get("PLAN_LIBRARY_PATH", "")
+# Seconds between checks for a new library file (0 = only load at startup)
+PLAN_LIBRARY_RELOAD_INTERVAL = float(os.environ.get("PLAN_LIBRARY_RELOAD_INTERVAL", "60"))
+
+MAGIC = b"LPGPLIB1"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<Q")
+
+
+def normalize_subject(subject: str) -> str:
+    """Case-, accent- and whitespace-insensitive form of a subject."""
+    decomposed = unicodedata.normalize("NFKD", subject.casefold())
+    return " ".join("".join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+
+def _fingerprint(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def prompt_fingerprints() -> Dict[str, str]:
+    """Fingerprints of everything plan and content generation depend on."""
+    model = getattr(llm, "model", "")
+    return {
+        "plan": _fingerprint(model, plan_prompt.template, STRUCTURED_OUTPUT),
+        "content": _fingerprint(
+            model, chapter_prompt.template, chapter_json_prompt.template,
+            chapter_repair_prompt.template, str(PROMPT_COMPACTION), STRUCTURED_OUTPUT
+        ),
+    }
+
+
+@lru_cache(maxsize=4096)
+def _structure_hash(title: str, description: str, chapters: Tuple[Tuple[Any, ...], ...]) -> str:
+    structure = {
+        "title": title,
+        "description": description,
+        "chapters": [
+            {"id": cid, "title": ctitle, **({"prerequisites": list(prereqs)} if prereqs else {})}
+            for cid, ctitle, prereqs in chapters
+        ],
+    }
+    return _fingerprint(json.dumps(structure, ensure_ascii=False, sort_keys=True))
+
+
+def structure_hash(plan: LearningPlan) -> str:
+    """Hash of a plan's title, description and chapter outline (not contents)."""
+    return _structure_hash(plan.title, plan.description, tuple(
+        (chapter.id, chapter.title, tuple(chapter.prerequisites)) for chapter in plan.chapters
+    ))
+
+
+def plan_key(subject: str, profile: str) -> str:
+    return f"plan:{normalize_subject(subject)}:{profile}"
+
+
+def content_key(plan: LearningPlan) -> str:
+    return f"content:{structure_hash(plan)}"
+
+
+def match_profile(profiles: Dict[str, Dict[str, Any]], context: str) -> Optional[str]:
+    """First profile with a keyword in the learner context, else the default one.
+
+    Profiles are matched in order on their `match` keywords; a profile with
+    `"default": true` is used when none matches.
+    """
+    text = normalize_subject(context)
+    default = None
+    for name, profile in profiles.items():
+        if any(normalize_subject(keyword) in text for keyword in profile.get("match", [])):
+            return name
+        if profile.get("default"):
+            default = name
+    return default
+
+
+def write_library(
+    path: str,
+    entries: Dict[str, Tuple[bytes, str]],
+    profiles: Dict[str, Dict[str, Any]],
+    version: int,
+) -> None:
+    """Write a library file atomically.
+
+    Args:
+        path: Destination file
+        entries: Serialized plan and prompt fingerprint by key
+        profiles: Learner profiles, stored for request-time matching
+        version: Library version, incremented by each build
+    """
+    index_entries: Dict[str, List[Any]] = {}
+    offset = 0
+    for key, (data, fingerprint) in entries.items():
+        index_entries[key] = [offset, len(data), zlib.crc32(data), fingerprint]
+        offset += len(data)
+    index = json.dumps({
+        "format": FORMAT_VERSION,
+        "version": version,
+        "profiles": profiles,
+        "entries": index_entries,
+    }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(len(index)))
+        f.write(index)
+        for data, _ in entries.values():
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+class PlanLibrary:
+    """Read-only, memory-mapped view of a library file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a plan library")
+        start = len(MAGIC) + HEADER.size
+        (index_length,) = HEADER.unpack_from(self._map, len(MAGIC))
+        index = json.loads(self._map[start:start + index_length])
+        if index["format"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported plan library format {index['format']}")
+        self._data_start = start + index_length
+        self.version: int = index["version"]
+        self.profiles: Dict[str, Dict[str, Any]] = index["profiles"]
+        self.entries: Dict[str, List[Any]] = {}
+        for key, entry in index["entries"].items():
+            offset, length, crc, _ = entry
+            begin = self._data_start + offset
+            if zlib.crc32(self._map[begin:begin + length]) == crc:
+                self.entries[key] = entry
+            else:
+                metrics.increment("plan_library_corrupt")
+                logger.warning("Plan library entry %s is corrupt and will not be served", key)
+        self.fingerprints = prompt_fingerprints()
+        stat = os.stat(path)
+        self.file_id = (stat.st_ino, stat.st_mtime_ns)
+
+    def get(self, key: str, fingerprint: Optional[str] = None) -> Optional[bytes]:
+        """Stored bytes for `key`, or None if absent, stale or corrupt.
+
+        Args:
+            key: Entry key
+            fingerprint: Required prompt fingerprint (None accepts any)
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        offset, length, _, entry_fingerprint = entry
+        if fingerprint is not None and entry_fingerprint != fingerprint:
+            metrics.increment("plan_library_stale")
+            return None
+        start = self._data_start + offset
+        return self._map[start:start + length]
+
+    def lookup_plan(self, subject: str, context: str) -> Optional[bytes]:
+        """Response JSON of the plan for this subject and learner context, if built."""
+        profile = match_profile(self.profiles, context)
+        if profile is None:
+            return None
+        return self.get(plan_key(subject, profile), self.fingerprints["plan"])
+
+    def lookup_content(self, plan: LearningPlan) -> Optional[bytes]:
+        """Response JSON of this plan with all chapter contents, if built."""
+        return self.get(content_key(plan), self.fingerprints["content"])
+
+    def close(self) -> None:
+        self._map.close()
+
+
+_library: Optional[PlanLibrary] = None
+_loaded = False
+
+
+def reload() -> Optional[PlanLibrary]:
+    """(Re)open the library at PLAN_LIBRARY_PATH; None when disabled or missing."""
+    global _library, _loaded
+    _loaded = True
+    library = None
+    if PLAN_LIBRARY_PATH and os.path.exists(PLAN_LIBRARY_PATH):
+        try:
+            library = PlanLibrary(PLAN_LIBRARY_PATH)
+            logger.info("Loaded plan library v%s (%d entries)", library.version, len(library.entries))
+        except (OSError, ValueError) as e:
+            logger.warning("Plan library %s could not be loaded: %s", PLAN_LIBRARY_PATH, e)
+    # Lookups copy entry bytes out of the mapping, so the previous one can be
+    # dropped and unmapped as soon as it is replaced
+    _library = library
+    return library
+
+
+def get_library() -> Optional[PlanLibrary]:
+    """The loaded library, opening it on first use."""
+    if not _loaded:
+        reload()
+    return _library
+
+
+def _changed() -> bool:
+    """Whether the file at PLAN_LIBRARY_PATH is not the one loaded."""
+    try:
+        stat = os.stat(PLAN_LIBRARY_PATH)
+    except OSError:
+        return _library is not None
+    return _library is None or (stat.st_ino, stat.st_mtime_ns) != _library.file_id
+
+
+async def watch(interval: float) -> None:
+    """Load the library, then reload it whenever the build job replaces the file.
+
+    Opening a library verifies every checksum, so it runs in a thread.
+    """
+    await asyncio.to_thread(reload)
+    while PLAN_LIBRARY_PATH and interval > 0:
+        await asyncio.sleep(interval)
+        if _changed():
+            await asyncio.to_thread(reload)
+
+
+def _record(kind: str, data: Optional[bytes]) -> Optional[bytes]:
+    metrics.increment("plan_library", kind=kind, outcome="hit" if data is not None else "miss")
+    return data
+
+
+def lookup_plan(subject: str, context: str) -> Optional[bytes]:
+    """Pre-generated plan response for a plan request, or None to generate live."""
+    library = get_library()
+    if library is None:
+        return None
+    return _record("plan", library.lookup_plan(subject, context))
+
+
+def lookup_content(plan: LearningPlan) -> Optional[bytes]:
+    """Pre-generated content response for a plan, or None to generate live."""
+    library = get_library()
+    if library is None:
+        return None
+    return _record("content", library.lookup_content(plan))
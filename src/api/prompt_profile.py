@@ -0,0 +1,76 @@
+"""Prompt size profiling.
+
+Every templated chain call is measured before it is sent: the estimated token
+count of each template variable and of the fixed template text. Counts are
+recorded in `/api/metrics` as the `prompt_tokens` summary (labels `chain` and
+`part`), and with `PROMPT_PROFILING=log` one line per call is also logged.
+
+Token counts are estimated from character length (`PROMPT_CHARS_PER_TOKEN`),
+which is close enough to compare variables and track regressions; the exact
+totals are in the provider's usage metadata.
+"""
+import logging
+import math
+import os
+import re
+from typing import Any, Dict
+
+from langchain.prompts import PromptTemplate
+from langchain_core.runnables import RunnableLambda
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# "0" disables profiling, "1" records metrics, "log" also logs each call
+PROMPT_PROFILING = os.environ.get("PROMPT_PROFILING", "1")
+CHARS_PER_TOKEN = float(os.environ.get("PROMPT_CHARS_PER_TOKEN", "3.5"))
+
+TEMPLATE_PART = "_template"
+
+_template_tokens: Dict[int, int] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count of `text`."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def template_tokens(prompt: PromptTemplate) -> int:
+    """Estimated tokens of the fixed text of a template, without its variables."""
+    key = id(prompt)
+    if key not in _template_tokens:
+        fixed = re.sub(r"(?<!\{)\{[a-zA-Z_]\w*\}(?!\})", "", prompt.template)
+        _template_tokens[key] = estimate_tokens(fixed.replace("{{", "{").replace("}}", "}"))
+    return _template_tokens[key]
+
+
+def profile_prompt(name: str, prompt: PromptTemplate, inputs: Dict[str, Any]) -> Dict[str, int]:
+    """Measure and record the size of one rendered prompt.
+
+    Args:
+        name: Chain name, used as the `chain` metric label
+        prompt: Template being rendered
+        inputs: Template variables
+
+    Returns:
+        Estimated tokens by part (each variable, and `_template`)
+    """
+    sizes = {TEMPLATE_PART: template_tokens(prompt)}
+    for variable in prompt.input_variables:
+        sizes[variable] = estimate_tokens(str(inputs.get(variable, "")))
+    for part, tokens in sizes.items():
+        metrics.observe("prompt_tokens", tokens, chain=name, part=part)
+    if PROMPT_PROFILING == "log":
+        detail = ", ".join(f"{part} {tokens}" for part, tokens in sizes.items())
+        logger.info("Prompt %s: ~%d tokens (%s)", name, sum(sizes.values()), detail)
+    return sizes
+
+
+def profiler(prompt: PromptTemplate, name: str):
+    """Pass-through runnable profiling the inputs of `prompt`, to put in front of it."""
+    def profile_inputs(inputs: Dict[str, Any]) -> Dict[str, Any]:
+        if PROMPT_PROFILING != "0":
+            profile_prompt(name, prompt, inputs)
+        return inputs
+    return RunnableLambda(profile_inputs, name=f"profile_{name}")
@@ -0,0 +1,173 @@
+"""Recovery of malformed chapter output.
+
+Instead of discarding a chapter whose output does not validate, the failure is
+classified and repaired as cheaply as possible:
+
+- truncation: the model hit `max_tokens`, generation resumes where it stopped
+- missing_field / bad_type: only the broken sections are re-prompted and merged
+- unparseable: nothing usable was produced, the chapter is regenerated
+
+Continuation and regeneration reuse the prompt the chapter was generated with
+(XML sections, or JSON in structured output mode); repaired sections are
+always requested as XML and merged field by field.
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.prompts import PromptTemplate
+from langchain_core.messages import AIMessage, HumanMessage
+from pydantic import ValidationError
+
+from . import metrics
+from .deadline import check_deadline
+from .offload import offload_parse
+from .models import ChapterContent, LLMParsingError
+from .llm import (
+    llm, chapter_prompt, chapter_chain, chapter_repair_prompt, chapter_repair_chain,
+    extract_chapter_data
+)
+
+TRUNCATION = "truncation"
+MISSING_FIELD = "missing_field"
+BAD_TYPE = "bad_type"
+UNPARSEABLE = "unparseable"
+
+# Maximum number of "continue" calls for a truncated chapter
+MAX_CONTINUATIONS = int(os.environ.get("CONTENT_MAX_CONTINUATIONS", "2"))
+# Maximum number of repair or regeneration calls for an invalid chapter
+MAX_REPAIRS = int(os.environ.get("CONTENT_MAX_REPAIRS", "1"))
+
+CONTINUE_INSTRUCTION = (
+    "Ta réponse a été interrompue. Reprends exactement là où elle s'est arrêtée, "
+    "sans répéter ce qui a déjà été écrit et en gardant le même format."
+)
+
+CHAPTER_FIELDS = list(ChapterContent.model_fields)
+
+
+def is_truncated(result) -> bool:
+    """Whether the model stopped because it reached `max_tokens`."""
+    metadata = getattr(result, "response_metadata", None) or {}
+    return metadata.get("finish_reason") in ("length", "max_tokens")
+
+
+def classify_failure(data: Dict[str, Any], error: ValidationError) -> Tuple[str, List[str]]:
+    """Classify a validation failure and list the chapter fields to repair."""
+    if not any(field in data for field in CHAPTER_FIELDS):
+        return UNPARSEABLE, CHAPTER_FIELDS
+    missing: List[str] = []
+    bad: List[str] = []
+    for err in error.errors():
+        field = str(err["loc"][0]) if err["loc"] else ""
+        if field not in CHAPTER_FIELDS:
+            continue
+        target = missing if err["type"] == "missing" else bad
+        if field not in target:
+            target.append(field)
+    return (MISSING_FIELD if missing else BAD_TYPE), missing + bad
+
+
+async def continue_truncated(prompt: PromptTemplate, inputs: Dict[str, Any], partial: str):
+    """Ask the model to resume a truncated output from where it stopped."""
+    return await llm.ainvoke([
+        HumanMessage(content=prompt.format(**inputs)),
+        AIMessage(content=partial),
+        HumanMessage(content=CONTINUE_INSTRUCTION),
+    ], config={"tags": ["chain:continuation"]})
+
+
+async def complete_output(prompt: PromptTemplate, inputs: Dict[str, Any], result) -> str:
+    """Return the output text of `prompt`, resuming it while it is truncated."""
+    text = result.content
+    for _ in range(MAX_CONTINUATIONS):
+        if not is_truncated(result):
+            break
+        check_deadline("continuation")
+        metrics.increment("chapter_recovery_attempts", kind=TRUNCATION)
+        result = await continue_truncated(prompt, inputs, text)
+        text += result.content
+    return text
+
+
+async def repair_sections(
+    inputs: Dict[str, Any], fields: List[str], error: ValidationError, previous_output: str
+) -> Tuple[Dict[str, Any], str]:
+    """Re-prompt only the broken sections of a chapter.
+
+    Returns:
+        Tuple of (repaired fields, repair output)
+    """
+    repair_inputs = {
+        "learning_plan": inputs["learning_plan"],
+        "chapter": inputs["chapter"],
+        "sections": ", ".join(fields),
+        "errors": "\n".join(
+            f"- {'.'.join(str(part) for part in err['loc'])} : {err['msg']}"
+            for err in error.errors()
+        ),
+        "previous_output": previous_output,
+    }
+    result = await chapter_repair_chain.ainvoke(repair_inputs)
+    text = await complete_output(chapter_repair_prompt, repair_inputs, result)
+    data = await offload_parse(extract_chapter_data, text, len(text))
+    return {k: v for k, v in data.items() if k in fields}, text
+
+
+def parse_chapter_text(text: str) -> Tuple[Dict[str, Any], Optional[ChapterContent]]:
+    """Extract the chapter sections from raw output and validate them.
+
+    Returns:
+        Tuple of (extracted data, validated content or None if invalid)
+    """
+    data = extract_chapter_data(text)
+    try:
+        return data, ChapterContent.model_validate(data)
+    except ValidationError:
+        return data, None
+
+
+async def recover_chapter_content(
+    inputs: Dict[str, Any], result, prompt: Optional[PromptTemplate] = None, regenerate=None
+) -> ChapterContent:
+    """Validate a chapter generation, repairing it when possible.
+
+    Args:
+        inputs: Variables used to render the chapter prompt
+        result: LLM message returned by the chapter chain
+        prompt: Prompt the chapter was generated with, `chapter_prompt` by default
+        regenerate: Free-text chain for that prompt, `chapter_chain` by default
+
+    Returns:
+        ChapterContent: The validated chapter content
+
+    Raises:
+        LLMParsingError: If the chapter is still invalid after all repair attempts
+    """
+    prompt = prompt or chapter_prompt
+    regenerate = regenerate or chapter_chain
+    text = await complete_output(prompt, inputs, result)
+    check_deadline("parsing")
+    data, content = await offload_parse(parse_chapter_text, text, len(text))
+
+    for attempt in range(MAX_REPAIRS + 1):
+        try:
+            content = content or ChapterContent.model_validate(data)
+            metrics.increment("chapter_validations", outcome="repaired" if attempt else "valid")
+            return content
+        except ValidationError as e:
+            kind, fields = classify_failure(data, e)
+            if attempt == MAX_REPAIRS:
+                metrics.increment("chapter_validations", outcome="failed", kind=kind)
+                raise LLMParsingError(
+                    "Failed to recover chapter content from LLM output",
+                    {"error": str(e), "failure": kind, "fields": fields, "output": text}
+                )
+            check_deadline("repair")
+            metrics.increment("chapter_recovery_attempts", kind=kind)
+            if kind == UNPARSEABLE:
+                result = await regenerate.ainvoke(inputs)
+                text = await complete_output(prompt, inputs, result)
+                data, content = await offload_parse(parse_chapter_text, text, len(text))
+            else:
+                repaired, text = await repair_sections(inputs, fields, e, text)
+                data = {**data, **repaired}
@@ -0,0 +1,250 @@
+"""Chapter-scoped passage retrieval for the chat assistant.
+
+Instead of packing the whole plan into every chat prompt, the generated
+chapter contents of a plan are split into passages (one per section, long
+sections split by paragraph) and indexed with BM25. A chat prompt then only
+includes the `RETRIEVAL_TOP_K` passages most relevant to the user's message,
+with passages of the chapter being studied boosted.
+
+Indexes are built incrementally as chapters are generated by
+/api/generate_content and cached per plan (`RETRIEVAL_CACHE_SIZE` plans per
+worker) under the plan id returned in the `X-Plan-Id` header: the hash of the
+plan's JSON, so any worker can rebuild the index from the plan itself. Whole
+plans are indexed through the parsing executor (see offload.py), so a large
+plan does not block the event loop.
+"""
+import hashlib
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Set
+
+from . import metrics
+from .models import LearningPlan, Chapter
+from .offload import offload_parse
+from .validation import PLAN_ADAPTER
+
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "256"))
+# Sections longer than this are split into paragraph passages
+PASSAGE_CHARS = int(os.environ.get("RETRIEVAL_PASSAGE_CHARS", "800"))
+# Score multiplier for passages of the chapter being studied
+CHAPTER_BOOST = float(os.environ.get("RETRIEVAL_CHAPTER_BOOST", "1.5"))
+# Conversation messages kept in chat prompts built from an index
+RETRIEVAL_HISTORY_MESSAGES = int(os.environ.get("RETRIEVAL_HISTORY_MESSAGES", "6"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+SECTIONS = ["introduction", "theory", "guided_practice", "challenge", "conclusion", "resources"]
+
+STOPWORDS = frozenset(
+    "a au aux avec ce ces cette dans de des du elle en est et il ils je la le les leur "
+    "mais me mes mon ne nous on ou par pas pour qu que qui sa se ses son sont sur ta te "
+    "tes ton tu un une vous y d l j c n s t m qu est-ce comment quoi quel quelle"
+    .split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, accent-free word tokens without French stopwords."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    plain = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return [token for token in re.findall(r"\w+", plain) if token not in STOPWORDS]
+
+
+def split_section(text: str) -> List[str]:
+    """Split a section into passages of at most about PASSAGE_CHARS characters."""
+    if len(text) <= PASSAGE_CHARS:
+        return [text]
+    passages: List[str] = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        if current and len(current) + len(paragraph) > PASSAGE_CHARS:
+            passages.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+
+class Passage:
+    """One indexed piece of a chapter's content."""
+
+    def __init__(self, chapter_id: str, chapter_title: str, section: str, text: str):
+        self.chapter_id = chapter_id
+        self.chapter_title = chapter_title
+        self.section = section
+        self.text = text
+
+
+class ChapterIndex:
+    """BM25 index over the passages of a plan's chapter contents."""
+
+    def __init__(self, title: str = ""):
+        self.title = title
+        self.chapter_titles: Dict[str, str] = {}
+        self.passages: List[Optional[Passage]] = []
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._lengths: List[int] = []
+        self._total_length = 0
+        self._live = 0
+        self._chapters: Dict[str, List[int]] = {}
+        # Terms of each chapter's passages, so removal only visits those
+        self._chapter_terms: Dict[str, Set[str]] = {}
+
+    def add_chapter(self, chapter: Chapter) -> None:
+        """Index a chapter's content, replacing any earlier version of it."""
+        self.remove_chapter(chapter.id)
+        self.chapter_titles[chapter.id] = chapter.title
+        if chapter.content is None:
+            return
+        for section in SECTIONS:
+            value = getattr(chapter.content, section)
+            text = "\n".join(value) if isinstance(value, list) else value
+            for passage_text in split_section(text):
+                self._add(Passage(chapter.id, chapter.title, section, passage_text))
+
+    def _add(self, passage: Passage) -> None:
+        doc = len(self.passages)
+        self.passages.append(passage)
+        tokens = tokenize(passage.text)
+        counts = Counter(tokens)
+        for term, count in counts.items():
+            self._postings.setdefault(term, {})[doc] = count
+        self._lengths.append(len(tokens))
+        self._total_length += len(tokens)
+        self._live += 1
+        self._chapters.setdefault(passage.chapter_id, []).append(doc)
+        self._chapter_terms.setdefault(passage.chapter_id, set()).update(counts)
+
+    def remove_chapter(self, chapter_id: str) -> None:
+        docs = self._chapters.pop(chapter_id, [])
+        for term in self._chapter_terms.pop(chapter_id, set()):
+            postings = self._postings[term]
+            for doc in docs:
+                postings.pop(doc, None)
+            if not postings:
+                del self._postings[term]
+        for doc in docs:
+            self._total_length -= self._lengths[doc]
+            self._lengths[doc] = 0
+            self.passages[doc] = None
+        self._live -= len(docs)
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K, chapter_id: Optional[str] = None) -> List[Passage]:
+        """Top-k passages for `query`, boosting those of `chapter_id`."""
+        live = self._live
+        if not live:
+            return []
+        average_length = self._total_length / live or 1
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (live - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[doc] / average_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        if chapter_id is not None:
+            for doc in self._chapters.get(chapter_id, []):
+                if doc in scores:
+                    scores[doc] *= CHAPTER_BOOST
+        ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [self.passages[doc] for doc in ranked]
+
+
+def plan_id(data: bytes) -> str:
+    """Id of a plan, from its JSON serialization."""
+    return hashlib.sha256(data).hexdigest()[:24]
+
+
+def build_index(plan: LearningPlan) -> ChapterIndex:
+    index = ChapterIndex(plan.title)
+    for chapter in plan.chapters:
+        index.add_chapter(chapter)
+    return index
+
+
+def index_from_json(data: str) -> ChapterIndex:
+    """Validate a plan's JSON and index it (run by the parsing executor)."""
+    return build_index(PLAN_ADAPTER.validate_json(data))
+
+
+class IndexCache:
+    """Least-recently-used chapter indexes by plan id."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._indexes: "OrderedDict[str, ChapterIndex]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[ChapterIndex]:
+        index = self._indexes.get(key)
+        if index is not None:
+            self._indexes.move_to_end(key)
+        return index
+
+    def put(self, key: str, index: ChapterIndex) -> None:
+        self._indexes[key] = index
+        self._indexes.move_to_end(key)
+        while len(self._indexes) > self.size:
+            self._indexes.popitem(last=False)
+
+    async def for_json(self, data: bytes) -> ChapterIndex:
+        """Cached index of a plan given as JSON, built off the event loop on first use."""
+        key = plan_id(data)
+        index = self.get(key)
+        if index is None:
+            index = await offload_parse(index_from_json, data.decode("utf-8"), len(data))
+            self.put(key, index)
+            metrics.increment("retrieval_index", outcome="built")
+        return index
+
+    async def for_plan(self, plan: LearningPlan) -> ChapterIndex:
+        """Cached index of a plan sent by the client."""
+        return await self.for_json(PLAN_ADAPTER.dump_json(plan))
+
+
+cache = IndexCache(RETRIEVAL_CACHE_SIZE)
+
+
+def chat_context(
+    index: ChapterIndex,
+    message: str,
+    chapter_id: Optional[str] = None,
+    history: Optional[List[str]] = None,
+    context: str = "",
+) -> str:
+    """Build a compact chat context for `message`.
+
+    Args:
+        index: Index of the plan being studied
+        message: User's message, used as the search query
+        chapter_id: Chapter being studied, whose passages are boosted
+        history: Previous conversation messages; only the last
+            RETRIEVAL_HISTORY_MESSAGES are kept
+        context: Learner context sent by the client, if any
+
+    Returns:
+        str: Plan and chapter titles, top-k passages and recent history
+    """
+    lines = [context] if context else []
+    if index.title:
+        lines.append(f"Plan d'apprentissage : {index.title}")
+    if chapter_id in index.chapter_titles:
+        lines.append(f"Chapitre en cours : {chapter_id}. {index.chapter_titles[chapter_id]}")
+    passages = index.search(message, chapter_id=chapter_id)
+    metrics.observe("retrieval_passages", len(passages))
+    if passages:
+        lines.append("\nExtraits pertinents du cours :")
+        for passage in passages:
+            lines.append(f"[{passage.chapter_id}. {passage.chapter_title} / {passage.section}]\n{passage.text}")
+    if history:
+        lines.append("\nConversation récente :")
+        lines.extend(history[-RETRIEVAL_HISTORY_MESSAGES:])
+    return "\n".join(lines)
@@ -0,0 +1,216 @@
+"""Shared state for multi-worker deployments.
+
+Caches, rate-limit counters and single-flight locks live behind a small
+backend interface so that every uvicorn worker, on every node, sees the same
+state. `STATE_BACKEND_URL=redis://host:6379/0` selects the Redis backend
+(requires the optional `redis` package); without it a process-local stand-in
+with the same semantics is used, which is enough for a single worker.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from . import metrics
+
+STATE_BACKEND_URL = os.environ.get("STATE_BACKEND_URL", "")
+# Prefix for every key, so several deployments can share one Redis
+STATE_KEY_PREFIX = os.environ.get("STATE_KEY_PREFIX", "lpg:")
+# Provider requests allowed per minute across all workers (0 = unlimited)
+PROVIDER_RPM_LIMIT = int(os.environ.get("PROVIDER_RPM_LIMIT", "0"))
+
+
+class LocalBackend:
+    """In-process backend with Redis-like expiry semantics."""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[Any, Optional[float]]] = {}
+
+    def _live(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def _expiry(self, ttl: Optional[float]) -> Optional[float]:
+        return time.monotonic() + ttl if ttl else None
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self._data[key] = (value, self._expiry(ttl))
+
+    def incr_sync(self, key: str, ttl: Optional[float] = None, amount: int = 1) -> int:
+        current = self._live(key)
+        if current is None:
+            self._data[key] = (amount, self._expiry(ttl))
+            return amount
+        self._data[key] = (current + amount, self._data[key][1])
+        return current + amount
+
+    async def incr(self, key: str, ttl: Optional[float] = None, amount: int = 1) -> int:
+        return self.incr_sync(key, ttl, amount)
+
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        if self._live(key) is not None:
+            return None
+        token = uuid.uuid4().hex
+        self._data[key] = (token, self._expiry(ttl))
+        return token
+
+    async def release_lock(self, key: str, token: str) -> None:
+        if self._live(key) == token:
+            del self._data[key]
+
+
+class RedisBackend:
+    """Backend storing state in Redis (or any server speaking its protocol)."""
+
+    # Delete the lock only if it is still held by the caller
+    RELEASE_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+
+    # Increment, setting the expiry only on a key that has none, so the first
+    # increment of a window sets it (PEXPIRE NX needs Redis 7)
+    INCR_SCRIPT = """
+    local count = redis.call('incrby', KEYS[1], ARGV[1])
+    if tonumber(ARGV[2]) > 0 and redis.call('pttl', KEYS[1]) == -1 then
+        redis.call('pexpire', KEYS[1], ARGV[2])
+    end
+    return count
+    """
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError(
+                "STATE_BACKEND_URL is set but the 'redis' package is not installed "
+                "(pip install redis)"
+            ) from e
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        await self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def incr(self, key: str, ttl: Optional[float] = None, amount: int = 1) -> int:
+        return await self.client.eval(self.INCR_SCRIPT, 1, key, amount, int(ttl * 1000) if ttl else 0)
+
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        acquired = await self.client.set(key, token, nx=True, px=int(ttl * 1000))
+        return token if acquired else None
+
+    async def release_lock(self, key: str, token: str) -> None:
+        await self.client.eval(self.RELEASE_SCRIPT, 1, key, token)
+
+
+backend = RedisBackend(STATE_BACKEND_URL) if STATE_BACKEND_URL else LocalBackend()
+
+
+def make_key(namespace: str, *parts: Any) -> str:
+    """Build a compact backend key from arbitrary (JSON-serializable) parts."""
+    digest = hashlib.sha256(
+        json.dumps(parts, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:32]
+    return f"{STATE_KEY_PREFIX}{namespace}:{digest}"
+
+
+async def cached(
+    namespace: str,
+    key_parts: Tuple[Any, ...],
+    compute: Callable[[], Awaitable[Any]],
+    ttl: float,
+    lock_ttl: float = 60.0,
+) -> Any:
+    """Return a cached JSON value, computing it at most once across workers.
+
+    On a miss, a distributed single-flight lock ensures only one worker calls
+    `compute`; the others poll the cache until the value appears, retrying the
+    lock on each poll so one of them takes over as soon as the holder releases
+    it without a value (its `compute` failed) or the lock expires.
+    """
+    key = make_key(namespace, *key_parts)
+    value = await backend.get(key)
+    if value is not None:
+        metrics.increment("state_cache", namespace=namespace, outcome="hit")
+        return json.loads(value)
+
+    lock_key = f"{key}:lock"
+    token = await backend.acquire_lock(lock_key, lock_ttl)
+    while token is None:
+        await asyncio.sleep(0.1)
+        value = await backend.get(key)
+        if value is not None:
+            metrics.increment("state_cache", namespace=namespace, outcome="coalesced")
+            return json.loads(value)
+        token = await backend.acquire_lock(lock_key, lock_ttl)
+    metrics.increment("state_cache", namespace=namespace, outcome="miss")
+    try:
+        result = await compute()
+        await backend.set(key, json.dumps(result, ensure_ascii=False), ttl)
+        return result
+    finally:
+        if token is not None:
+            await backend.release_lock(lock_key, token)
+
+
+class SharedRateLimiter(BaseRateLimiter):
+    """Fixed-window request limit shared by all workers through the backend.
+
+    Plugged into the chat model as its `rate_limiter`, so every provider call
+    counts against the same quota. Synchronous calls only see the counters of
+    their own process.
+    """
+
+    def __init__(self, name: str, limit: int, window: float = 60.0):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self._local = LocalBackend()
+
+    def _window_key(self) -> Tuple[str, float]:
+        index = int(time.time() // self.window)
+        wait = (index + 1) * self.window - time.time()
+        return f"{STATE_KEY_PREFIX}ratelimit:{self.name}:{index}", wait
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        while True:
+            key, wait = self._window_key()
+            if self._local.incr_sync(key, self.window) <= self.limit:
+                return True
+            if not blocking:
+                return False
+            time.sleep(wait)
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        while True:
+            key, wait = self._window_key()
+            if await backend.incr(key, self.window) <= self.limit:
+                return True
+            metrics.increment("rate_limit_waits", limiter=self.name)
+            if not blocking:
+                return False
+            await asyncio.sleep(wait)
+
+
+provider_rate_limiter = (
+    SharedRateLimiter("provider", PROVIDER_RPM_LIMIT) if PROVIDER_RPM_LIMIT > 0 else None
+)
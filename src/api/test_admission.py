@@ -0,0 +1,97 @@
+"""Test priority admission control."""
+import asyncio
+
+import pytest
+
+from src.api import admission
+from src.api.admission import AdmissionController, AdmissionMiddleware, Overloaded, PriorityClass
+
+
+def test_lower_classes_leave_reserve_for_interactive():
+    interactive = PriorityClass("test_interactive", 4, 8, 0.05)
+    standard = PriorityClass("test_standard", 4, 8, 0.05)
+    batch = PriorityClass("test_batch", 4, 8, 0.05)
+    controller = AdmissionController(4, [interactive, standard, batch], reserve=1)
+
+    async def scenario():
+        await controller.acquire(standard)
+        await controller.acquire(batch)
+        await controller.acquire(batch)
+        # Lower classes hold capacity - reserve slots: the next one waits
+        with pytest.raises(Overloaded):
+            await controller.acquire(standard)
+        await asyncio.wait_for(controller.acquire(interactive), 0.01)
+
+    asyncio.run(scenario())
+    assert controller.in_flight == 4
+    assert interactive.in_flight == 1
+
+
+def test_freed_slot_goes_to_highest_priority_waiter():
+    interactive = PriorityClass("test_interactive", 1, 8, 1.0)
+    batch = PriorityClass("test_batch", 1, 8, 1.0)
+    controller = AdmissionController(1, [interactive, batch])
+    granted = []
+
+    async def wait(cls):
+        await controller.acquire(cls)
+        granted.append(cls.name)
+
+    async def scenario():
+        await controller.acquire(batch)
+        # The batch request queued first, the interactive one second
+        waiters = [asyncio.create_task(wait(batch))]
+        await asyncio.sleep(0.01)
+        waiters.append(asyncio.create_task(wait(interactive)))
+        await asyncio.sleep(0.01)
+        controller.release(batch)
+        await asyncio.sleep(0.01)
+        assert granted == ["test_interactive"]
+        controller.release(interactive)
+        await asyncio.gather(*waiters)
+
+    asyncio.run(scenario())
+    assert granted == ["test_interactive", "test_batch"]
+
+
+def call(path: str):
+    """Send one POST through AdmissionMiddleware, return (app called, sent messages)."""
+    called = []
+    sent = []
+
+    async def app(scope, receive, send):
+        called.append(scope["path"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": path, "headers": [], "client": ("10.0.0.1", 1)}
+    asyncio.run(AdmissionMiddleware(app)(scope, None, send))
+    return called, sent
+
+
+@pytest.fixture
+def full_controller(monkeypatch):
+    """A single-slot controller for /api/chat whose slot is already taken."""
+    cls = PriorityClass("test_interactive", 1, 8, 0.05)
+    controller = AdmissionController(1, [cls])
+    asyncio.run(controller.acquire(cls))
+    monkeypatch.setattr(admission, "controller", controller)
+    monkeypatch.setattr(admission, "ENDPOINT_PRIORITY", {"chat": cls})
+    return controller
+
+
+def test_queue_timeout_is_shed_with_retry_after(full_controller):
+    called, sent = call("/api/chat")
+    assert called == []
+    assert sent[0]["status"] == 503
+    headers = dict(sent[0]["headers"])
+    assert int(headers[b"retry-after"]) >= 1
+    assert b"queue_timeout" in sent[1]["body"]
+
+
+def test_other_paths_bypass_admission(full_controller):
+    for path in ("/api/metrics", "/docs"):
+        called, sent = call(path)
+        assert called == [path] and sent[0]["status"] == 200
@@ -0,0 +1,83 @@
+"""Test the async command-line client (src/scripts/calls.py)."""
+import asyncio
+import importlib
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+@pytest.fixture
+def calls(monkeypatch):
+    monkeypatch.setenv("MISTRAL_API_KEY", "unused")
+    return importlib.import_module("src.scripts.calls")
+
+
+class FakeChain:
+    def __init__(self, text: str):
+        self.text = text
+
+    async def ainvoke(self, inputs):
+        return SimpleNamespace(content=self.text)
+
+
+def test_ask_returns_the_typed_line(calls, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda prompt: f"réponse à {prompt}")
+    assert asyncio.run(calls.ask("?")) == "réponse à ?"
+
+
+def test_interrupted_ask_does_not_wait_for_enter(calls, monkeypatch):
+    enter = threading.Event()
+
+    def blocking_input(prompt):
+        enter.wait()
+        return ""
+
+    monkeypatch.setattr("builtins.input", blocking_input)
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(calls.ask("> "), 0.05))
+    # asyncio.run returned although input() is still blocked
+    assert time.monotonic() - started < 1
+    enter.set()
+
+
+def test_prefetch_restarts_when_the_plan_changes(calls, monkeypatch, plan):
+    answers = iter(["Docker", "Débutant", "Plus court", "v"])
+    generated, cancelled, saved = [], [], []
+
+    async def ask(prompt):
+        await asyncio.sleep(0.01)
+        return next(answers)
+
+    async def generate_plan_content(plan, on_chapter=None):
+        generated.append(plan.title)
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            cancelled.append(plan.title)
+            raise
+        return plan, {}
+
+    data = plan.model_dump()
+    short_plan = {**data, "title": "Docker express", "chapters": data["chapters"][:1]}
+    monkeypatch.setattr(calls, "ask", ask)
+    monkeypatch.setattr(calls, "context_chain", FakeChain("Quel est ton niveau ?"))
+    monkeypatch.setattr(calls, "plan_chain", FakeChain(plan.model_dump_json()))
+    monkeypatch.setattr(calls, "feedback_chain", FakeChain(json.dumps({"response": "Fait", "plan": short_plan})))
+    monkeypatch.setattr(calls, "generate_plan_content", generate_plan_content)
+    monkeypatch.setattr(calls, "save_output", saved.append)
+
+    asyncio.run(calls.main(prefetch=True))
+    assert generated == ["Docker", "Docker express"]
+    assert cancelled == ["Docker"]
+    assert [plan.title for plan in saved] == ["Docker express"]
+
+
+def test_save_output_replaces_the_file(calls, tmp_path, plan):
+    path = tmp_path / "final_output.json"
+    path.write_text("ancien")
+    calls.save_output(plan, path)
+    assert json.loads(path.read_text())["title"] == "Docker"
+    assert [p.name for p in tmp_path.iterdir()] == ["final_output.json"]
@@ -0,0 +1,63 @@
+"""Replay the synthetic cassette through every endpoint (see src/scripts/replay_regression.py).
+
+The cassette is scripted (src/scripts/make_synthetic_cassette.py): these tests
+check that replay and parsing work end to end, not real provider latency.
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from src.api.cassette import Cassette, CassetteChatModel, prompt_key
+
+ROOT = Path(__file__).parent.parent.parent
+SAMPLE = Path(__file__).parent / "cassettes" / "synthetic_session.jsonl"
+
+
+def test_replay_reproduces_recording():
+    cassette = Cassette(str(SAMPLE))
+    recorded = next(i for i in cassette.interactions if i["chain"] == "chat")
+    messages = [HumanMessage(content=recorded["prompt"][0]["content"])]
+    assert prompt_key(messages) == recorded["key"]
+
+    model = CassetteChatModel(cassette=cassette, speed=0, strict=True)
+    result = model.invoke(messages)
+    assert result.content == "".join(text for _, text in recorded["chunks"])
+    assert result.response_metadata["finish_reason"] == "stop"
+    chunks = list(model.stream(messages))
+    assert len(chunks) == len(recorded["chunks"])
+
+
+def test_replay_regression_suite(tmp_path):
+    report_path = tmp_path / "report.json"
+    result = subprocess.run(
+        [
+            sys.executable, "-m", "src.scripts.replay_regression",
+            "--cassette", str(SAMPLE), "--speed", "20",
+            "--sessions", "4", "--concurrency", "2",
+            "--min-parse-success", "1",
+            "--report", str(report_path),
+        ],
+        cwd=ROOT, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    report = json.loads(report_path.read_text(encoding="utf-8"))
+    assert report["failures"] == []
+    assert set(report["endpoints"]) == {"context", "plan", "feedback", "generate_content", "chat"}
+    assert all(stats["calls"] == 4 for stats in report["endpoints"].values())
+
+
+def test_recordings_are_appended(tmp_path):
+    path = tmp_path / "session.jsonl.gz"
+    cassette = Cassette(str(path))
+    for i in range(3):
+        cassette.append({"chain": "chat", "key": f"k{i}", "prompt": [], "chunks": [[1.0, f"r{i}"]]})
+    reloaded = Cassette(str(path))
+    assert [i["key"] for i in reloaded.interactions] == ["k0", "k1", "k2"]
+
+    model = CassetteChatModel(cassette=reloaded)
+    with pytest.raises(ValueError):
+        model.with_structured_output(dict)
@@ -0,0 +1,84 @@
+"""Test compact plan serialization and prompt profiling."""
+import json
+from types import SimpleNamespace
+
+from src.api import compaction, prompt_profile
+from src.api.llm import feedback_prompt, parse_feedback_output
+from src.api.models import LearningPlan
+from src.scripts.bench_validation import make_plan_data
+
+def test_outline_keeps_plan_structure(full_plan):
+    outline = compaction.plan_outline(full_plan, compact=True)
+    assert outline.splitlines() == [
+        "Docker", "Les bases", "Chapitres :", "c1. Conteneurs", "c2. Images (prérequis : c1)"
+    ]
+    assert compaction.chapter_reference(full_plan.chapters[1], compact=True) == "c2. Images"
+
+
+def test_feedback_plan_is_lossless(full_plan):
+    text = compaction.feedback_plan(full_plan, compact=True)
+    legend, data = text.split("\n", 1)
+    assert "gp = guided_practice" in legend
+    assert "null" not in data and '"p":[]' not in data and '"guided_practice"' not in data
+    assert len(data) < len(compaction.feedback_plan(full_plan, compact=False)) * 0.8
+    # Chapter contents are kept: the model can answer questions about them
+    assert '"th":"Théorie"' in data
+    assert LearningPlan.model_validate(compaction.expand_keys(json.loads(data))) == full_plan
+
+
+def test_legend_pays_off_on_larger_plans():
+    plan = LearningPlan.model_validate(make_plan_data(10))
+    compact = compaction.feedback_plan(plan, compact=True)
+    assert len(compact) < len(compaction.feedback_plan(plan, compact=False))
+
+
+def feedback_answer(current_plan: str) -> SimpleNamespace:
+    """Answer of a model reading the plan from the prompt and adding a chapter."""
+    data = compaction.expand_keys(json.loads(current_plan.splitlines()[-1]))
+    assert data["chapters"][1]["content"]["theory"] == "Théorie"
+    for chapter in data["chapters"]:
+        chapter["content"] = None
+    data["chapters"].append({"id": "c3", "title": "Volumes", "prerequisites": ["c1"], "content": None})
+    return SimpleNamespace(content=json.dumps({"response": "Ajouté", "plan": data}))
+
+
+def test_feedback_answer_is_the_same_with_either_serialization(full_plan, chapter_content):
+    plans = []
+    for compact in (False, True):
+        feedback = parse_feedback_output(feedback_answer(compaction.feedback_plan(full_plan, compact)))
+        plans.append(compaction.restore_contents(full_plan, feedback.plan))
+    assert plans[0] == plans[1]
+    assert [c.content for c in plans[1].chapters] == [chapter_content, chapter_content, None]
+
+
+def test_abbreviated_answer_keys_are_expanded(full_plan):
+    answer = {"response": "Ok", "plan": compaction.compact_plan_data(full_plan)}
+    feedback = parse_feedback_output(SimpleNamespace(content=json.dumps(answer)))
+    assert feedback.plan == full_plan
+
+
+def test_restore_contents_of_unchanged_chapters(full_plan, chapter_content):
+    updated = LearningPlan.model_validate({
+        "title": "Docker",
+        "description": "Les bases",
+        "chapters": [
+            {"id": "c1", "title": "Conteneurs"},
+            {"id": "c2", "title": "Images et Dockerfile", "prerequisites": ["c1"]},
+        ],
+    })
+    restored = compaction.restore_contents(full_plan, updated)
+    assert restored.chapters[0].content == chapter_content
+    assert restored.chapters[1].content is None
+    assert compaction.restore_contents(full_plan, None) is None
+
+
+def test_profile_prompt_by_variable(full_plan):
+    inputs = {
+        "context": "", "user_message": "Bonjour",
+        "current_plan": compaction.feedback_plan(full_plan), "conversation_history": "",
+    }
+    sizes = prompt_profile.profile_prompt("feedback", feedback_prompt, inputs)
+    assert set(sizes) == {"_template", "context", "current_plan", "user_message", "conversation_history"}
+    assert sizes["context"] == 0
+    assert sizes["current_plan"] == prompt_profile.estimate_tokens(inputs["current_plan"])
+    assert sizes["_template"] > 100
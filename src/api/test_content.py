@@ -0,0 +1,39 @@
+"""Test chapter scheduling along the prerequisite graph."""
+import asyncio
+
+from src.api import content
+from src.api.models import LearningPlan, ChapterContent
+
+DELAYS = {"c1": 0.2, "c2": 0.0, "c3": 0.0, "c4": 0.0}
+
+
+def test_chapters_only_wait_for_their_own_prerequisites(monkeypatch):
+    plan = LearningPlan.model_validate({
+        "title": "Docker",
+        "description": "Les bases",
+        "chapters": [
+            {"id": "c1", "title": "Lent"},
+            {"id": "c2", "title": "Rapide"},
+            {"id": "c3", "title": "Après c2", "prerequisites": ["c2"]},
+            {"id": "c4", "title": "Après c1", "prerequisites": ["c1"]},
+        ],
+    })
+    started = []
+
+    async def generate_chapter(outline, chapter, prerequisites):
+        started.append(chapter.id)
+        assert all(p.content is not None for p in prerequisites)
+        await asyncio.sleep(DELAYS[chapter.id])
+        return ChapterContent(
+            introduction=chapter.title, theory="", guided_practice="",
+            challenge="", conclusion="", resources=[]
+        )
+
+    monkeypatch.setattr(content, "generate_chapter", generate_chapter)
+    done = []
+    updated, failures = asyncio.run(content.generate_plan_content(plan, lambda c: done.append(c.id)))
+    assert failures == {}
+    # c3 does not wait for c1, which is on another branch
+    assert done.index("c3") < done.index("c1") < done.index("c4")
+    assert started.index("c4") == 3
+    assert all(chapter.content is not None for chapter in updated.chapters)
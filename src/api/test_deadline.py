@@ -0,0 +1,111 @@
+"""Test request deadlines and the token accounting of cancelled calls."""
+import asyncio
+import json
+from uuid import uuid4
+
+from langchain_core.messages import HumanMessage
+
+from src.api.deadline import (
+    DEFAULT_DEADLINES, MAX_REQUEST_TIMEOUT, DeadlineMiddleware, RequestContext, current_request,
+    request_timeout
+)
+from src.api.usage import usage_callback
+
+
+def timeout_for(value: bytes):
+    return request_timeout({"headers": [(b"x-request-timeout", value)]}, "chat")
+
+
+def test_invalid_timeouts_fall_back_to_default():
+    assert timeout_for(b"12.5") == 12.5
+    assert timeout_for(b"100000") == MAX_REQUEST_TIMEOUT
+    for value in (b"-1", b"0", b"nan", b"inf", b"soon"):
+        assert timeout_for(value) == DEFAULT_DEADLINES["chat"]
+
+
+def test_cancelled_calls_count_as_spent():
+    context = RequestContext("chat", 30)
+    token = current_request.set(context)
+    cancelled, failed = uuid4(), uuid4()
+
+    async def scenario():
+        messages = [[HumanMessage(content="x" * 350)]]
+        for run_id in (cancelled, failed):
+            await usage_callback.on_chat_model_start({}, messages, run_id=run_id)
+        for _ in range(5):
+            await usage_callback.on_llm_new_token("mot", run_id=cancelled)
+        await usage_callback.on_llm_error(asyncio.CancelledError(), run_id=cancelled)
+        await usage_callback.on_llm_error(RuntimeError("provider error"), run_id=failed)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        current_request.reset(token)
+    assert context.tokens_spent() == 100 + 5
+
+
+class SlowApp:
+    """ASGI app reading the body, then answering after `delay` seconds."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.cancelled = False
+        self.remaining = None
+
+    async def __call__(self, scope, receive, send):
+        await receive()
+        self.remaining = current_request.get().remaining()
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+def call(app, timeout: bytes, disconnect_after: float = None):
+    """Send one /api/chat request through DeadlineMiddleware, return the sent messages."""
+    scope = {
+        "type": "http", "method": "POST", "path": "/api/chat",
+        "headers": [(b"x-request-timeout", timeout)], "client": ("127.0.0.1", 1234),
+    }
+    incoming = [{"type": "http.request", "body": b"{}", "more_body": False}]
+    sent = []
+
+    async def receive():
+        if incoming:
+            return incoming.pop(0)
+        if disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(DeadlineMiddleware(app)(scope, receive, send))
+    return sent
+
+
+def test_handler_within_deadline_answers():
+    app = SlowApp(0.01)
+    sent = call(app, b"5")
+    assert sent[0]["status"] == 200 and not app.cancelled
+    assert 0 < app.remaining <= 5
+
+
+def test_handler_past_deadline_gets_504():
+    app = SlowApp(1.0)
+    sent = call(app, b"0.05")
+    assert app.cancelled
+    assert sent[0]["status"] == 504
+    assert json.loads(sent[1]["body"])["details"] == {"endpoint": "chat", "timeout": 0.05}
+
+
+def test_client_disconnect_cancels_handler():
+    app = SlowApp(1.0)
+    sent = call(app, b"5", disconnect_after=0.05)
+    assert app.cancelled
+    # Nobody is listening: nothing is sent
+    assert sent == []
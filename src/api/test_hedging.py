@@ -0,0 +1,82 @@
+"""Test hedged calls and their first-token latency samples."""
+import asyncio
+
+import pytest
+
+from src.api import hedging
+
+
+class FakeModel:
+    def __init__(self, delay: float, text: str):
+        self.delay = delay
+        self.text = text
+        self.calls = 0
+        self.cancelled = False
+
+    async def astream(self, inputs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        yield self.text
+
+
+@pytest.fixture
+def hedging_on(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGING_ENABLED", True)
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY", 0.05)
+    monkeypatch.setattr(hedging, "tracker", hedging.LatencyTracker())
+    monkeypatch.setattr(hedging, "budget", hedging.HedgeBudget(0.1, 5))
+
+
+def test_slow_primary_is_sampled_when_cancelled(hedging_on):
+    primary = FakeModel(1.0, "primary")
+    result = asyncio.run(hedging.hedged_ainvoke(primary, {}, key="chat", hedge_runnable=FakeModel(0.0, "hedge")))
+    assert result == "hedge"
+    # The losing primary is cancelled and sampled as a lower bound
+    assert primary.cancelled
+    samples = list(hedging.tracker.samples["chat"])
+    assert len(samples) == 1 and 0.05 <= samples[0] < 1.0
+    # The hedge model's latency has its own bucket
+    assert len(hedging.tracker.samples["chat:hedge"]) == 1
+
+
+def test_same_model_hedge_shares_the_key(hedging_on):
+    model = FakeModel(1.0, "slow")
+
+    async def scenario():
+        task = asyncio.create_task(hedging.hedged_ainvoke(model, {}, key="context"))
+        await asyncio.sleep(0.1)
+        # The hedge reuses the model: make it fast
+        model.delay = 0.0
+        return await task
+
+    assert asyncio.run(scenario()) == "slow"
+    assert model.calls == 2
+    assert set(hedging.tracker.samples) == {"context"}
+
+
+def test_fast_primary_is_not_hedged(hedging_on):
+    hedge = FakeModel(0.0, "hedge")
+    result = asyncio.run(hedging.hedged_ainvoke(FakeModel(0.0, "primary"), {}, key="chat", hedge_runnable=hedge))
+    assert result == "primary"
+    assert hedge.calls == 0
+    assert hedging.budget.tokens == 5
+
+
+def test_exhausted_budget_waits_for_the_primary(hedging_on, monkeypatch):
+    monkeypatch.setattr(hedging, "budget", hedging.HedgeBudget(0.1, 1))
+    hedging.budget.tokens = 0
+    hedge = FakeModel(0.0, "hedge")
+    result = asyncio.run(hedging.hedged_ainvoke(FakeModel(0.1, "primary"), {}, key="chat", hedge_runnable=hedge))
+    assert result == "primary"
+    assert hedge.calls == 0
+
+
+def test_slow_hedge_is_cancelled_when_primary_wins(hedging_on):
+    hedge = FakeModel(1.0, "hedge")
+    result = asyncio.run(hedging.hedged_ainvoke(FakeModel(0.1, "primary"), {}, key="chat", hedge_runnable=hedge))
+    assert result == "primary"
+    assert hedge.calls == 1 and hedge.cancelled
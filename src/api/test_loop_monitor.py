@@ -0,0 +1,29 @@
+"""Test event-loop lag measurement and blocking-call detection."""
+import asyncio
+import time
+
+from src.api.loop_monitor import LoopMonitor
+
+
+def blocking_parse():
+    time.sleep(0.3)
+
+
+def test_blocking_callback_is_caught_with_its_stack():
+    monitor = LoopMonitor(interval=0.02, threshold=0.05, history=10)
+
+    async def scenario():
+        monitor.start()
+        await asyncio.sleep(0.1)
+        blocking_parse()
+        await asyncio.sleep(0.1)
+        await monitor.stop()
+
+    asyncio.run(scenario())
+    stats = monitor.stats()
+    assert stats["blocked_total"] == 1
+    block = stats["blocks"][0]
+    assert not block["ongoing"]
+    assert block["duration"] >= 0.2
+    assert "blocking_parse" in "".join(block["stack"])
+    assert stats["lag"]["max"] >= 0.2
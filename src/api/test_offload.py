@@ -0,0 +1,42 @@
+"""Test offloaded parsing in a worker process."""
+import asyncio
+import json
+
+from src.api import metrics, offload
+from src.api.llm import parse_plan_output
+from src.api.recovery import parse_chapter_text
+
+
+def test_large_outputs_are_parsed_in_worker_process(monkeypatch, sections, tagged, counter):
+    monkeypatch.setattr(offload, "PARSE_EXECUTOR", "process")
+    monkeypatch.setattr(offload, "PARSE_OFFLOAD_THRESHOLD", 100)
+    monkeypatch.setattr(offload, "PARSE_PROCESSES", 1)
+    metrics.reset()
+    chapter_text = tagged({**sections, "theory": "Théorie détaillée. " * 50})
+    plan_json = json.dumps({
+        "title": "Docker", "description": "Les bases",
+        "chapters": [{"id": "c1", "title": "Conteneurs", "prerequisites": []}],
+    })
+
+    async def scenario():
+        chapter = await offload.offload_parse(parse_chapter_text, chapter_text, len(chapter_text))
+        plan = await offload.offload_parse(
+            parse_plan_output, offload.AIMessage(content=plan_json), len(plan_json)
+        )
+        small = await offload.offload_parse(parse_chapter_text, "<theory>x</theory>", 18)
+        return chapter, plan, small
+
+    try:
+        (data, content), plan, (_, small_content) = asyncio.run(scenario())
+    finally:
+        offload.shutdown()
+    assert content.theory.startswith("Théorie détaillée.")
+    assert plan.chapters[0].id == "c1"
+    assert small_content is None
+    # Counters recorded in the worker are merged into this process
+    assert counter("llm_parse", method="json") == 1
+    jobs = [(s["labels"]["parser"], s["labels"]["executor"]) for s in metrics.snapshot()["summaries"]
+            if s["name"] == "parse_job_seconds"]
+    assert sorted(jobs) == [
+        ("parse_chapter_text", "inline"), ("parse_chapter_text", "process"), ("parse_plan_output", "process")
+    ]
@@ -0,0 +1,51 @@
+"""Test prerequisite graph validation and scheduling."""
+import pytest
+
+from src.api.models import LearningPlan, PlanGraphError
+from src.api.plan_graph import build_plan_graph
+
+
+def make_plan(prerequisites):
+    """Build a plan from a {chapter_id: [prerequisite ids]} mapping."""
+    return LearningPlan(
+        title="Docker",
+        description="Learn Docker",
+        chapters=[
+            {"id": cid, "title": f"Chapter {cid}", "prerequisites": prereqs}
+            for cid, prereqs in prerequisites.items()
+        ]
+    )
+
+
+def test_levels_and_order():
+    graph = build_plan_graph(make_plan({
+        "c1": [],
+        "c2": ["c1"],
+        "c3": ["c1"],
+        "c4": ["c2", "c3"],
+        "c5": [],
+    }))
+    assert graph.levels == [["c1", "c5"], ["c2", "c3"], ["c4"]]
+    assert graph.topological_order() == ["c1", "c5", "c2", "c3", "c4"]
+
+
+def test_dangling_prerequisite():
+    with pytest.raises(PlanGraphError) as exc:
+        build_plan_graph(make_plan({"c1": [], "c2": ["c9"]}))
+    assert exc.value.details == {"dangling": {"c2": ["c9"]}}
+
+
+def test_duplicate_ids():
+    plan = make_plan({"c1": []})
+    plan.chapters.append(plan.chapters[0].model_copy())
+    with pytest.raises(PlanGraphError) as exc:
+        build_plan_graph(plan)
+    assert exc.value.details == {"duplicates": ["c1"]}
+
+
+def test_cycle_is_reported():
+    with pytest.raises(PlanGraphError) as exc:
+        build_plan_graph(make_plan({"c1": [], "c2": ["c1", "c4"], "c3": ["c2"], "c4": ["c3"]}))
+    cycle = exc.value.details["cycle"]
+    assert cycle[0] == cycle[-1]
+    assert set(cycle) == {"c2", "c3", "c4"}
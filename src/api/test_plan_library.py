@@ -0,0 +1,89 @@
+"""Test the memory-mapped plan library."""
+import asyncio
+
+import pytest
+
+from src.api import plan_library
+from src.api.validation import PLAN_ADAPTER
+
+PROFILES = {
+    "debutant": {"context": "Je débute", "match": ["débutant", "jamais"]},
+    "avance": {"context": "J'utilise déjà Docker", "match": ["avancé", "au travail"]},
+}
+
+
+@pytest.fixture
+def build(plan, full_plan):
+    """Write a library with the plan and its contents at `path`, and open it."""
+    def write(path, fingerprints=None):
+        fingerprints = fingerprints or plan_library.prompt_fingerprints()
+        entries = {
+            plan_library.plan_key("Docker", "debutant"): (PLAN_ADAPTER.dump_json(plan), fingerprints["plan"]),
+            plan_library.content_key(plan): (PLAN_ADAPTER.dump_json(full_plan), fingerprints["content"]),
+        }
+        plan_library.write_library(str(path), entries, PROFILES, version=3)
+        return plan_library.PlanLibrary(str(path))
+    return write
+
+
+def test_lookup_by_subject_and_profile(tmp_path, build, plan, chapter_content):
+    library = build(tmp_path / "plans.lib")
+    assert library.version == 3
+    data = library.lookup_plan("  docker ", "Je suis DÉBUTANT, 3h par semaine")
+    assert PLAN_ADAPTER.validate_json(data) == plan
+    assert library.lookup_plan("Docker", "Je l'utilise au travail") is None
+    assert library.lookup_plan("Docker", "Aucune indication") is None
+    assert library.lookup_plan("Kubernetes", "débutant") is None
+
+    stored = PLAN_ADAPTER.validate_json(library.lookup_content(plan))
+    assert all(chapter.content == chapter_content for chapter in stored.chapters)
+    # Contents sent back by the client do not change the lookup
+    assert library.lookup_content(stored) is not None
+
+
+def test_stale_and_corrupt_entries_are_misses(tmp_path, build, plan):
+    path = tmp_path / "plans.lib"
+    library = build(path, {"plan": "old", "content": "old"})
+    assert library.lookup_plan("Docker", "débutant") is None
+    assert library.get(plan_library.plan_key("Docker", "debutant")) is not None
+
+    library = build(path)
+    library.close()
+    raw = bytearray(path.read_bytes())
+    raw[-5] ^= 0xFF
+    path.write_bytes(bytes(raw))
+    assert plan_library.PlanLibrary(str(path)).lookup_content(plan) is None
+
+
+def test_fingerprint_covers_structured_output(monkeypatch):
+    before = plan_library.prompt_fingerprints()
+    monkeypatch.setattr(plan_library, "STRUCTURED_OUTPUT", "json_mode")
+    after = plan_library.prompt_fingerprints()
+    assert before["plan"] != after["plan"] and before["content"] != after["content"]
+
+
+def test_structure_hash_is_cached_and_ignores_contents(plan, full_plan):
+    key = plan_library.content_key(plan)
+    hits = plan_library._structure_hash.cache_info().hits
+    assert plan_library.content_key(full_plan) == key
+    assert plan_library._structure_hash.cache_info().hits == hits + 1
+
+
+def test_new_build_is_picked_up(tmp_path, monkeypatch, build):
+    path = tmp_path / "plans.lib"
+    monkeypatch.setattr(plan_library, "PLAN_LIBRARY_PATH", str(path))
+    # Restored afterwards, like the path
+    monkeypatch.setattr(plan_library, "_library", None)
+    monkeypatch.setattr(plan_library, "_loaded", False)
+    build(path).close()
+
+    async def scenario():
+        watcher = asyncio.create_task(plan_library.watch(0.01))
+        await asyncio.sleep(0.05)
+        version = plan_library.get_library().version
+        plan_library.write_library(str(path), {}, PROFILES, version=4)
+        await asyncio.sleep(0.1)
+        watcher.cancel()
+        return version, plan_library.get_library().version
+
+    assert asyncio.run(scenario()) == (3, 4)
@@ -0,0 +1,89 @@
+"""Test recovery of truncated and malformed chapter output."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pydantic import ValidationError
+
+from src.api import recovery
+from src.api.llm import chapter_json_schema_prompt
+from src.api.models import ChapterContent, LLMParsingError
+
+INPUTS = {"learning_plan": "{}", "chapter": '{"id": "c1"}', "prerequisites_summary": ""}
+
+
+def message(content, finish_reason="stop"):
+    return SimpleNamespace(content=content, response_metadata={"finish_reason": finish_reason})
+
+
+class FakeChain:
+    """Stand-in for a chain or chat model returning canned messages."""
+
+    def __init__(self, *outputs):
+        self.outputs = list(outputs)
+        self.calls = []
+
+    async def ainvoke(self, inputs, config=None):
+        self.calls.append(inputs)
+        return self.outputs.pop(0)
+
+
+def test_classify_failure():
+    data = {"introduction": "Intro", "theory": 3}
+    try:
+        ChapterContent.model_validate(data)
+    except ValidationError as e:
+        kind, fields = recovery.classify_failure(data, e)
+    assert kind == recovery.MISSING_FIELD
+    assert fields == ["guided_practice", "challenge", "conclusion", "resources", "theory"]
+    try:
+        ChapterContent.model_validate({})
+    except ValidationError as e:
+        assert recovery.classify_failure({}, e)[0] == recovery.UNPARSEABLE
+
+
+def test_truncated_output_is_resumed(monkeypatch, sections, tagged):
+    full = tagged(sections)
+    cut = full.index("<challenge>")
+    llm = FakeChain(message(full[cut:]))
+    monkeypatch.setattr(recovery, "llm", llm)
+
+    content = asyncio.run(recovery.recover_chapter_content(INPUTS, message(full[:cut], "length")))
+    assert content.challenge == "Défi"
+    assert len(llm.calls) == 1
+    assert llm.calls[0][1].content == full[:cut]
+
+
+def test_only_missing_sections_are_repaired(monkeypatch, sections, tagged):
+    repair_chain = FakeChain(message(tagged({"conclusion": "Réparée"}, resources=None)))
+    monkeypatch.setattr(recovery, "chapter_repair_chain", repair_chain)
+
+    broken = {k: v for k, v in sections.items() if k != "conclusion"}
+    content = asyncio.run(recovery.recover_chapter_content(INPUTS, message(tagged(broken))))
+    assert content.conclusion == "Réparée"
+    assert content.introduction == "Intro"
+    assert repair_chain.calls[0]["sections"] == "conclusion"
+
+
+def test_failed_repair_reports_the_repair_output(monkeypatch, sections, tagged):
+    repair_chain = FakeChain(message("Je ne peux pas"))
+    monkeypatch.setattr(recovery, "chapter_repair_chain", repair_chain)
+    monkeypatch.setattr(recovery, "MAX_REPAIRS", 1)
+
+    broken = {k: v for k, v in sections.items() if k != "conclusion"}
+    with pytest.raises(LLMParsingError) as exc:
+        asyncio.run(recovery.recover_chapter_content(INPUTS, message(tagged(broken))))
+    assert exc.value.details["output"] == "Je ne peux pas"
+
+
+def test_structured_chapter_is_resumed_with_its_json_prompt(monkeypatch):
+    llm = FakeChain(message('"Défi", "conclusion": "Conclusion", "resources": ["https://docs.docker.com"]}'))
+    monkeypatch.setattr(recovery, "llm", llm)
+    partial = '{"introduction": "Intro", "theory": "Théorie", "guided_practice": "Pratique", "challenge": '
+
+    content = asyncio.run(recovery.recover_chapter_content(
+        INPUTS, message(partial, "length"), chapter_json_schema_prompt
+    ))
+    assert content.challenge == "Défi"
+    prompt = llm.calls[0][0].content
+    assert "Schéma JSON" in prompt and "balises XML" not in prompt
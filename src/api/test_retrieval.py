@@ -0,0 +1,95 @@
+"""Test the chapter passage index used by the chat endpoint."""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.api import main, retrieval
+from src.api.chat import request_context
+from src.api.models import ChatRequest, PlanNotIndexed
+
+
+@pytest.fixture
+def docker_plan(full_plan):
+    """The shared plan plus a Volumes chapter, each chapter with its own theory."""
+    theories = {
+        "c1": "Un conteneur isole un processus.",
+        "c2": "Une image est construite à partir d'un Dockerfile.\n\nLes couches d'une image sont mises en cache.",
+        "c3": "Un volume persiste les données d'un conteneur.",
+    }
+    volumes = full_plan.chapters[1].model_copy(update={"id": "c3", "title": "Volumes"})
+    return full_plan.model_copy(update={"chapters": [
+        chapter.model_copy(update={"content": chapter.content.model_copy(update={"theory": theories[chapter.id]})})
+        for chapter in [*full_plan.chapters, volumes]
+    ]})
+
+
+def test_search_ranks_relevant_passages(docker_plan):
+    index = retrieval.build_index(docker_plan)
+    top = index.search("Comment écrire un dockerfile ?", k=1)
+    assert [(p.chapter_id, p.section) for p in top] == [("c2", "theory")]
+    # Passages of the current chapter win ties
+    assert index.search("conteneur", k=1, chapter_id="c3")[0].chapter_id == "c3"
+    assert index.search("kubernetes") == []
+
+
+def test_chapters_are_indexed_incrementally(docker_plan):
+    index = retrieval.ChapterIndex(docker_plan.title)
+    index.add_chapter(docker_plan.chapters[0])
+    assert index.search("volume") == []
+    index.add_chapter(docker_plan.chapters[2])
+    assert index.search("volume", k=1)[0].chapter_id == "c3"
+    # Re-adding a chapter replaces its passages
+    index.add_chapter(docker_plan.chapters[2].model_copy(update={"content": None}))
+    assert index.search("volume") == []
+    assert index.search("conteneur", k=1)[0].chapter_id == "c1"
+
+
+def test_removed_chapter_leaves_no_postings(docker_plan):
+    index = retrieval.ChapterIndex(docker_plan.title)
+    index.add_chapter(docker_plan.chapters[0])
+    index.add_chapter(docker_plan.chapters[2])
+    index.remove_chapter("c3")
+    assert "volume" not in index._postings
+    assert "conteneur" in index._postings
+    assert index._live == len(index._chapters["c1"])
+
+
+def test_long_sections_are_split():
+    paragraphs = ["mot " * 60] * 10
+    passages = retrieval.split_section("\n\n".join(paragraphs))
+    assert len(passages) > 1
+    assert all(len(p) <= retrieval.PASSAGE_CHARS for p in passages)
+
+
+def test_chat_context_only_holds_top_passages(docker_plan):
+    key = retrieval.plan_id(b"plan")
+    retrieval.cache.put(key, retrieval.build_index(docker_plan))
+    context = asyncio.run(request_context(ChatRequest(
+        message="Que persiste un volume ?", plan_id=key, current_chapter="c3",
+        conversation_history=[f"USER: message {i}" for i in range(10)],
+    )))
+    assert "Chapitre en cours : c3. Volumes" in context
+    assert "Un volume persiste" in context
+    assert "USER: message 9" in context and "USER: message 0" not in context
+    assert context.count("Intro") <= retrieval.RETRIEVAL_TOP_K
+
+    # An unknown plan id with the plan sent along builds and caches its index
+    request = ChatRequest(message="dockerfile", plan_id="unknown", plan=docker_plan)
+    assert "Dockerfile" in asyncio.run(request_context(request))
+    index = asyncio.run(retrieval.cache.for_plan(docker_plan))
+    assert asyncio.run(retrieval.cache.for_plan(docker_plan)) is index
+
+    # Without a plan, the client's context is used as before
+    request = ChatRequest(context="Plan complet", message="?")
+    assert asyncio.run(request_context(request)) == "Plan complet"
+
+
+def test_unknown_plan_id_without_plan_asks_for_the_plan():
+    request = ChatRequest(message="Que persiste un volume ?", plan_id="evicted", context="Je débute")
+    with pytest.raises(PlanNotIndexed):
+        asyncio.run(request_context(request))
+
+    response = TestClient(main.app).post("/api/chat", json=request.model_dump())
+    assert response.status_code == 409
+    assert response.json() == {"message": "Plan not indexed, resend plan", "details": {"plan_id": "evicted"}}
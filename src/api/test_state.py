@@ -0,0 +1,125 @@
+"""Test the shared state backend, the single-flight cache and the rate limiter."""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.api import metrics, state
+from src.api.state import cached
+
+
+@pytest.fixture(autouse=True)
+def local_backend(monkeypatch):
+    monkeypatch.setattr(state, "backend", state.LocalBackend())
+    metrics.reset()
+
+
+def outcomes():
+    return {
+        c["labels"]["outcome"]: c["value"] for c in metrics.snapshot()["counters"]
+        if c["name"] == "state_cache"
+    }
+
+
+def test_local_backend_expires_keys():
+    async def scenario():
+        backend = state.LocalBackend()
+        await backend.set("plain", "kept")
+        await backend.set("short", "gone", ttl=0.05)
+        assert await backend.incr("count", ttl=0.05) == 1
+        assert await backend.incr("count", ttl=10, amount=2) == 3
+        token = await backend.acquire_lock("lock", 0.05)
+        assert token and await backend.acquire_lock("lock", 0.05) is None
+        assert await backend.get("short") == "gone"
+
+        await asyncio.sleep(0.06)
+        assert await backend.get("plain") == "kept"
+        assert await backend.get("short") is None
+        # The first increment's expiry applies, and a new window starts at 1
+        assert await backend.incr("count") == 1
+        assert await backend.acquire_lock("lock", 1) is not None
+        await backend.release_lock("lock", token)
+        assert await backend.acquire_lock("lock", 1) is None
+
+    asyncio.run(scenario())
+
+
+def test_hit_skips_compute():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {"question": "Pourquoi Docker ?"}
+
+    async def scenario():
+        first = await cached("test", ("hit",), compute, 60)
+        second = await cached("test", ("hit",), compute, 60)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == second == {"question": "Pourquoi Docker ?"}
+    assert len(calls) == 1
+    assert outcomes() == {"miss": 1, "hit": 1}
+
+
+def test_concurrent_misses_are_coalesced():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.15)
+        return "question"
+
+    async def scenario():
+        return await asyncio.gather(*(cached("test", ("coalesced",), compute, 60) for _ in range(3)))
+
+    assert asyncio.run(scenario()) == ["question"] * 3
+    assert len(calls) == 1
+    assert outcomes() == {"miss": 1, "coalesced": 2}
+
+
+def test_waiter_takes_over_when_leader_fails():
+    calls = []
+
+    async def failing():
+        calls.append("leader")
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream error")
+
+    async def working():
+        calls.append("waiter")
+        return "question"
+
+    async def scenario():
+        leader = asyncio.create_task(cached("test", ("takeover",), failing, 60))
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        value = await cached("test", ("takeover",), working, 60)
+        with pytest.raises(RuntimeError):
+            await leader
+        return value, time.monotonic() - started
+
+    value, waited = asyncio.run(scenario())
+    assert value == "question"
+    assert calls == ["leader", "waiter"]
+    # Well before the 60s lock expiry
+    assert waited < 1
+
+
+def test_rate_limiter_counts_per_window(monkeypatch):
+    clock = SimpleNamespace(now=120.0)
+    monkeypatch.setattr(state, "time", SimpleNamespace(
+        time=lambda: clock.now, monotonic=time.monotonic, sleep=time.sleep
+    ))
+    limiter = state.SharedRateLimiter("test", limit=2, window=60)
+
+    async def acquire():
+        return await limiter.aacquire(blocking=False)
+
+    assert [asyncio.run(acquire()) for _ in range(3)] == [True, True, False]
+    # The next window has a fresh quota
+    clock.now += 60
+    assert asyncio.run(acquire())
+    assert limiter.acquire(blocking=False) and limiter.acquire(blocking=False)
+    assert not limiter.acquire(blocking=False)
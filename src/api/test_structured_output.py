@@ -0,0 +1,76 @@
+"""Test structured output mode with a model that follows the prompt's format."""
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from src.api import llm
+from src.api.models import ChapterContent
+
+INPUTS = {"learning_plan": "Docker", "chapter": "c1. Conteneurs", "prerequisites_summary": ""}
+
+
+class PromptFollowingModel:
+    """json_mode stand-in: the provider forces JSON syntax, not the schema.
+
+    Answers in the format the prompt asks for, with `sections` as chapter text.
+    """
+
+    def __init__(self, sections, tagged):
+        self.sections = sections
+        self.tagged = tagged
+
+    def answer(self, prompt) -> AIMessage:
+        text = prompt.to_string()
+        if "balises XML" in text:
+            return AIMessage(content=self.tagged(self.sections))
+        schema = json.loads(text.split("Schéma JSON que la réponse doit respecter :\n")[1])
+        data = {name: self.sections.get(name, "") for name in schema["required"]}
+        data["resources"] = ["https://docs.docker.com"]
+        return AIMessage(content=json.dumps(data, ensure_ascii=False))
+
+    def with_structured_output(self, schema, method, include_raw):
+        def parse(message):
+            try:
+                parsed = schema.model_validate_json(message.content)
+            except Exception:
+                parsed = None
+            return {"raw": message, "parsed": parsed, "parsing_error": None}
+        return RunnableLambda(self.answer) | RunnableLambda(parse)
+
+
+@pytest.fixture
+def generate(monkeypatch, sections, tagged):
+    """Generate a chapter from `prompt` with a PromptFollowingModel, return (content, fallbacks)."""
+    monkeypatch.setattr(llm, "STRUCTURED_OUTPUT", "json_mode")
+    model = PromptFollowingModel(sections, tagged)
+    return lambda prompt: generate_with(prompt, model)
+
+
+def generate_with(prompt, model):
+    structured_chain = llm.structured(prompt, ChapterContent, "chapter", model=model)
+    fallbacks = []
+
+    def fallback(message):
+        fallbacks.append(message)
+        return llm.parse_chapter_output(message)
+
+    content = asyncio.run(llm.ainvoke_structured(
+        None, structured_chain, INPUTS, ChapterContent, fallback, "chapter"
+    ))
+    return content, fallbacks
+
+
+def test_chapter_json_prompt_is_parsed_without_fallback(generate):
+    content, fallbacks = generate(llm.chapter_json_prompt)
+    assert fallbacks == []
+    assert content.theory == "Théorie" and content.resources == ["https://docs.docker.com"]
+
+
+def test_xml_chapter_prompt_only_succeeds_through_fallback(generate):
+    # The free-text prompt asks for XML sections, which no schema accepts
+    content, fallbacks = generate(llm.chapter_prompt)
+    assert len(fallbacks) == 1
+    assert content.theory == "Théorie"
@@ -0,0 +1,137 @@
+"""Test token metering, usage flushing and quota enforcement."""
+import asyncio
+import json
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+from src.api import admission, deadline, main, usage
+from src.api.deadline import RequestContext, current_request
+
+
+def llm_result(prompt_tokens, completion_tokens, cached_tokens=0):
+    message = AIMessage(content="ok", usage_metadata={
+        "input_tokens": prompt_tokens,
+        "output_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "input_token_details": {"cache_read": cached_tokens},
+    })
+    return LLMResult(generations=[[ChatGeneration(message=message)]])
+
+
+def test_calls_are_metered_per_user_endpoint_and_chain(tmp_path, monkeypatch):
+    log_path = tmp_path / "usage.jsonl"
+    monkeypatch.setattr(usage, "USAGE_LOG_PATH", str(log_path))
+    aggregator = usage.UsageAggregator(quota=1000, window=3600)
+    monkeypatch.setattr(usage, "aggregator", aggregator)
+
+    context = RequestContext("plan", 60, user="alice")
+
+    async def scenario():
+        current_request.set(context)
+        for _ in range(2):
+            await usage.usage_callback.on_llm_end(
+                llm_result(300, 100, cached_tokens=50), run_id=uuid4(), tags=["chain:plan"]
+            )
+        assert aggregator.used("alice") == 800
+        assert not aggregator.over_quota("alice")
+        await usage.usage_callback.on_llm_end(llm_result(150, 50), run_id=uuid4(), tags=["chain:plan"])
+        assert aggregator.over_quota("alice")
+        await aggregator.flush()
+
+    asyncio.run(scenario())
+    # The same callback counts the request's own tokens
+    assert (context.prompt_tokens, context.completion_tokens) == (750, 250)
+    # Flushed usage still counts against the quota
+    assert aggregator.used("alice") == 1000
+    assert not aggregator.over_quota("bob")
+    [line] = log_path.read_text(encoding="utf-8").splitlines()
+    record = json.loads(line)
+    assert (record["user"], record["endpoint"], record["chain"]) == ("alice", "plan", "plan")
+    assert (record["calls"], record["prompt_tokens"], record["completion_tokens"], record["cached_tokens"]) == (3, 750, 250, 100)
+
+
+def test_admission_rejects_users_over_quota(monkeypatch):
+    monkeypatch.setattr(deadline, "TRUSTED_PROXIES", frozenset({"10.0.0.1"}))
+    aggregator = usage.UsageAggregator(quota=100, window=3600)
+    aggregator.record("alice", "chat", "chat", {"prompt_tokens": 90, "completion_tokens": 20, "cached_tokens": 0})
+    monkeypatch.setattr(admission, "usage", aggregator)
+    sent = []
+
+    async def app(scope, receive, send):
+        sent.append("handled")
+
+    async def send(message):
+        sent.append(message)
+
+    async def call(user):
+        scope = {"type": "http", "path": "/api/chat", "headers": [(b"x-user-id", user)], "client": ("10.0.0.1", 1)}
+        await admission.AdmissionMiddleware(app)(scope, None, send)
+
+    asyncio.run(call(b"bob"))
+    assert sent == ["handled"]
+    sent.clear()
+    asyncio.run(call(b"alice"))
+    assert sent[0]["status"] == 429
+    assert (b"retry-after", str(aggregator.retry_after()).encode()) in sent[0]["headers"]
+
+
+def test_user_header_is_only_trusted_from_proxies(monkeypatch):
+    monkeypatch.setattr(deadline, "TRUSTED_PROXIES", frozenset({"10.0.0.1"}))
+    headers = [(b"x-user-id", b"alice")]
+    assert deadline.request_user({"headers": headers, "client": ("10.0.0.1", 1)}) == "alice"
+    # Other clients are told apart by address, whatever header they send
+    assert deadline.request_user({"headers": headers, "client": ("203.0.113.7", 1)}) == "203.0.113.7"
+    assert deadline.request_user({"headers": headers, "client": ("203.0.113.8", 1)}) == "203.0.113.8"
+    assert deadline.request_user({"headers": [], "client": ("10.0.0.1", 1)}) == "10.0.0.1"
+    assert deadline.request_user({"headers": headers}) == "anonymous"
+
+
+def test_quota_checks_see_usage_being_flushed(monkeypatch):
+    aggregator = usage.UsageAggregator(quota=1000, window=3600)
+    seen_during_flush = []
+
+    class SlowBackend:
+        async def incr(self, key, ttl, amount):
+            seen_during_flush.append(aggregator.used("alice"))
+            return amount
+
+    monkeypatch.setattr(usage, "backend", SlowBackend())
+    aggregator.record("alice", "chat", "chat", {"prompt_tokens": 300, "completion_tokens": 100, "cached_tokens": 0})
+    asyncio.run(aggregator.flush())
+    assert seen_during_flush == [400]
+    assert aggregator.used("alice") == 400
+
+
+def test_usage_is_credited_to_the_window_it_was_spent_in(monkeypatch):
+    aggregator = usage.UsageAggregator(quota=1000, window=3600)
+    flushed = {}
+
+    class Backend:
+        async def incr(self, key, ttl, amount):
+            flushed[key] = flushed.get(key, 0) + amount
+            return flushed[key]
+
+    monkeypatch.setattr(usage, "backend", Backend())
+    aggregator.record("alice", "chat", "chat", {"prompt_tokens": 300, "completion_tokens": 100, "cached_tokens": 0})
+    window = aggregator._window_index
+    # The window rolls over before the flush
+    monkeypatch.setattr(aggregator, "_current_window", lambda: window + 1)
+    assert aggregator.used("alice") == 0
+    asyncio.run(aggregator.flush())
+    assert flushed[usage.make_key("usage_quota", "alice", window)] == 400
+    assert aggregator.used("alice") == 0
+
+
+def test_admin_routes_require_the_admin_token(monkeypatch):
+    client = TestClient(main.app)
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    assert client.get("/api/admin/usage").status_code == 404
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    for path in ("/api/admin/usage", "/api/admin/loop"):
+        assert client.get(path).status_code == 401
+        assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 401
+        assert client.get(path, headers={"Authorization": "Bearer s3cret"}).status_code == 200
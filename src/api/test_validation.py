@@ -0,0 +1,36 @@
+"""Test the plan copy and JSON response fast paths."""
+import json
+
+import pytest
+
+from src.api.validation import PLAN_ADAPTER, copy_plan, json_response
+
+@pytest.fixture
+def partial_plan(full_plan):
+    """Plan whose second chapter has no content yet."""
+    plan = full_plan.model_copy(deep=True)
+    plan.chapters[1].content = None
+    return plan
+
+
+def test_copy_is_isolated_from_source(partial_plan):
+    before = partial_plan.model_dump()
+    copy = copy_plan(partial_plan)
+    assert copy.model_dump() == before
+
+    copy.title = "Kubernetes"
+    copy.chapters[0].content = None
+    copy.chapters[1].prerequisites.append("c0")
+    copy.chapters.append(copy.chapters[0])
+    assert partial_plan.model_dump() == before
+
+
+def test_json_response_serializes_the_model(partial_plan):
+    response = json_response(partial_plan, headers={"X-Plan-Id": "abc"}, status_code=201)
+    assert response.status_code == 201
+    assert response.media_type == "application/json"
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["x-plan-id"] == "abc"
+    assert response.body == partial_plan.model_dump_json().encode("utf-8")
+    assert PLAN_ADAPTER.validate_json(response.body) == partial_plan
+    assert json.loads(response.body)["chapters"][1]["content"] is None
@@ -0,0 +1,272 @@
+"""Token usage accounting and per-user quotas.
+
+A callback on the chat models meters every LLM call: prompt, completion and
+cached prompt tokens, attributed to the user (see `deadline.request_user`),
+the endpoint and the chain. Calls are aggregated in memory and flushed every
+`USAGE_FLUSH_INTERVAL` seconds:
+
+- to `USAGE_LOG_PATH`, one JSON line per (user, endpoint, chain) and flush
+  period, when set;
+- to a per-user counter in the shared state backend, when `USAGE_QUOTA_TOKENS`
+  is set. The total it returns is kept locally, so admission control can
+  check a user's quota with a few dict lookups; usage from other workers is
+  seen at most one flush interval late.
+
+Token totals are also exported in `/api/metrics` as `llm_tokens` (by
+endpoint, chain and kind), without per-user labels.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from . import metrics
+from .cassette import chain_from_tags
+from .deadline import current_request
+from .prompt_profile import estimate_tokens
+from .state import backend, make_key
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_INTERVAL = float(os.environ.get("USAGE_FLUSH_INTERVAL", "10"))
+USAGE_LOG_PATH = os.environ.get("USAGE_LOG_PATH", "")
+# Tokens (prompt + completion) allowed per user and window (0 = unlimited)
+USAGE_QUOTA_TOKENS = int(os.environ.get("USAGE_QUOTA_TOKENS", "0"))
+USAGE_QUOTA_WINDOW = float(os.environ.get("USAGE_QUOTA_WINDOW", "86400"))
+
+FIELDS = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+def token_usage(response: LLMResult) -> Dict[str, int]:
+    """Prompt, completion and cached prompt tokens reported for one LLM call."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                details = usage.get("input_token_details") or {}
+                return {
+                    "prompt_tokens": usage.get("input_tokens", 0) or 0,
+                    "completion_tokens": usage.get("output_tokens", 0) or 0,
+                    "cached_tokens": details.get("cache_read", 0) or 0,
+                }
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", 0) or 0,
+        "completion_tokens": usage.get("completion_tokens", 0) or 0,
+        "cached_tokens": details.get("cached_tokens", 0) or 0,
+    }
+
+
+class UsageAggregator:
+    """In-memory token usage by (user, endpoint, chain), flushed periodically.
+
+    Pending quota tokens are kept by (window, user), so usage recorded just
+    before a window rolls over is credited to the window it was spent in.
+    While a flush is adding them to the shared counters they are counted as
+    `flushing`, and they move to `totals` in the same step as the counter
+    total replaces it, so a quota check never misses them.
+    """
+
+    def __init__(self, quota: int, window: float):
+        self.quota = quota
+        self.window = window
+        # Callbacks of sync LLM calls may run in other threads
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str, str], Dict[str, int]] = {}
+        self._pending_by_user: Dict[Tuple[int, str], int] = {}
+        self._flushing: Dict[Tuple[int, str], int] = {}
+        self._totals: Dict[str, int] = {}
+        self._seen: Set[str] = set()
+        self._window_index = self._current_window()
+        self._period_start = time.time()
+
+    def _current_window(self) -> int:
+        return int(time.time() // self.window)
+
+    def _roll_window(self) -> int:
+        window = self._current_window()
+        if window != self._window_index:
+            self._window_index = window
+            self._totals.clear()
+        return window
+
+    def record(self, user: str, endpoint: str, chain: str, usage: Dict[str, int]) -> None:
+        """Add one LLM call's usage."""
+        with self._lock:
+            window = self._roll_window()
+            bucket = self._pending.get((user, endpoint, chain))
+            if bucket is None:
+                bucket = self._pending[(user, endpoint, chain)] = dict.fromkeys(FIELDS, 0)
+            bucket["calls"] += 1
+            for field, value in usage.items():
+                bucket[field] += value
+            tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+            self._pending_by_user[(window, user)] = self._pending_by_user.get((window, user), 0) + tokens
+        for kind in ("prompt", "completion", "cached"):
+            metrics.increment("llm_tokens", usage[f"{kind}_tokens"], endpoint=endpoint, chain=chain, kind=kind)
+
+    def _used(self, window: int, user: str) -> int:
+        return (
+            self._totals.get(user, 0)
+            + self._flushing.get((window, user), 0)
+            + self._pending_by_user.get((window, user), 0)
+        )
+
+    def used(self, user: str) -> int:
+        """Tokens used by `user` in the current window, as far as this worker knows."""
+        with self._lock:
+            window = self._roll_window()
+            self._seen.add(user)
+            return self._used(window, user)
+
+    def over_quota(self, user: str) -> bool:
+        return self.quota > 0 and self.used(user) >= self.quota
+
+    def retry_after(self) -> int:
+        """Seconds until the current quota window ends."""
+        return max(1, int((self._window_index + 1) * self.window - time.time()))
+
+    async def flush(self) -> None:
+        """Write pending usage to storage and refresh quota totals."""
+        with self._lock:
+            window = self._roll_window()
+            pending, self._pending = self._pending, {}
+            by_user, self._pending_by_user = self._pending_by_user, {}
+            seen, self._seen = self._seen, set()
+            period = (self._period_start, time.time())
+            self._period_start = period[1]
+            if self.quota > 0:
+                for key, tokens in by_user.items():
+                    self._flushing[key] = self._flushing.get(key, 0) + tokens
+
+        if self.quota > 0:
+            # Users seen in quota checks are refreshed with other workers' usage
+            keys = list(by_user) + [(window, user) for user in seen if (window, user) not in by_user]
+            for i, (key_window, user) in enumerate(keys):
+                amount = by_user.get((key_window, user), 0)
+                try:
+                    total = await backend.incr(
+                        make_key("usage_quota", user, key_window), self.window, amount
+                    )
+                except BaseException:
+                    # Not flushed: back to pending for the next flush
+                    with self._lock:
+                        for key in keys[i:]:
+                            tokens = by_user.get(key, 0)
+                            if tokens:
+                                self._unflush(key, tokens)
+                                self._pending_by_user[key] = self._pending_by_user.get(key, 0) + tokens
+                    raise
+                with self._lock:
+                    self._unflush((key_window, user), amount)
+                    if key_window == self._window_index:
+                        self._totals[user] = total
+
+        if USAGE_LOG_PATH and pending:
+            lines = [
+                json.dumps({
+                    "start": round(period[0], 3), "end": round(period[1], 3),
+                    "user": user, "endpoint": endpoint, "chain": chain, **bucket
+                }, ensure_ascii=False)
+                for (user, endpoint, chain), bucket in pending.items()
+            ]
+            await asyncio.to_thread(_append_lines, USAGE_LOG_PATH, lines)
+
+    def _unflush(self, key: Tuple[int, str], tokens: int) -> None:
+        remaining = self._flushing.get(key, 0) - tokens
+        if remaining > 0:
+            self._flushing[key] = remaining
+        else:
+            self._flushing.pop(key, None)
+
+    async def run(self, interval: float) -> None:
+        """Flush every `interval` seconds until cancelled, then flush once more."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.warning("Usage flush failed: %s", e)
+        finally:
+            await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            window = self._roll_window()
+            pending: List[Dict[str, Any]] = [
+                {"user": user, "endpoint": endpoint, "chain": chain, **bucket}
+                for (user, endpoint, chain), bucket in self._pending.items()
+            ]
+            users = {
+                user: self._used(window, user)
+                for user in set(self._totals) | {
+                    user for key_window, user in list(self._pending_by_user) + list(self._flushing)
+                    if key_window == window
+                }
+            }
+        return {"quota": self.quota, "window": self.window, "users": users, "pending": pending}
+
+
+def _append_lines(path: str, lines: List[str]) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+aggregator = UsageAggregator(USAGE_QUOTA_TOKENS, USAGE_QUOTA_WINDOW)
+
+
+class UsageCallbackHandler(AsyncCallbackHandler):
+    """Chat model callback metering every call.
+
+    The single source of token counts: each call's usage goes both to the
+    aggregator and to the request's own counters, which the deadline
+    middleware reports as wasted when it cancels the request. Calls that never
+    complete are tracked from an estimate of their prompt and the chunks
+    streamed so far, since they report no usage.
+    """
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        context = current_request.get()
+        if context is not None:
+            text = "".join(str(m.content) for batch in messages for m in batch)
+            context.inflight[run_id] = [estimate_tokens(text), 0]
+
+    async def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        context = current_request.get()
+        if context is not None and run_id in context.inflight:
+            # One streamed chunk is about one token
+            context.inflight[run_id][1] += 1
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        context = current_request.get()
+        # Cancelled calls stay in flight, to be counted as wasted
+        if context is not None and not isinstance(error, asyncio.CancelledError):
+            context.inflight.pop(run_id, None)
+
+    async def on_llm_end(
+        self, response: LLMResult, *, run_id: UUID, tags: Optional[List[str]] = None, **kwargs: Any
+    ) -> None:
+        usage = token_usage(response)
+        context = current_request.get()
+        if context is not None:
+            context.inflight.pop(run_id, None)
+            context.prompt_tokens += usage["prompt_tokens"]
+            context.completion_tokens += usage["completion_tokens"]
+        aggregator.record(
+            context.user if context else "system",
+            context.endpoint if context else "-",
+            chain_from_tags(tags),
+            usage,
+        )
+
+
+usage_callback = UsageCallbackHandler()
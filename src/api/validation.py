@@ -0,0 +1,65 @@
+"""Validation fast paths for learning plans.
+
+Untrusted data (request bodies, LLM output, stored JSON) is always fully
+validated. Plans the server already holds as validated models are copied
+with `model_construct` instead of deepcopy, and responses are serialized
+straight to JSON so FastAPI's `response_model` re-validation is skipped.
+
+`model_construct` is deliberately not used to rebuild plans from dicts:
+building the models in Python is about 3x slower than pydantic-core
+validation. Request bodies are left to FastAPI: `validate_json` on the raw
+bytes is no faster than its `json.loads` then validate (see
+src/scripts/bench_validation.py).
+"""
+from functools import lru_cache
+from typing import Dict, Optional, Type, TypeVar
+
+from fastapi.responses import Response
+from pydantic import BaseModel, TypeAdapter
+
+from .models import LearningPlan, Chapter
+
+T = TypeVar("T")
+
+
+@lru_cache(maxsize=None)
+def adapter(tp: Type[T]) -> TypeAdapter:
+    """Return the cached TypeAdapter for `tp`, building it on first use."""
+    return TypeAdapter(tp)
+
+
+# Built at import time, for stored plans validated straight from JSON bytes
+PLAN_ADAPTER = adapter(LearningPlan)
+
+
+def copy_plan(plan: LearningPlan) -> LearningPlan:
+    """Copy a validated plan for modification, without deepcopy or validation.
+
+    Chapters are new objects; chapter contents are immutable in practice and
+    are shared with the original plan.
+    """
+    return LearningPlan.model_construct(
+        title=plan.title,
+        description=plan.description,
+        chapters=[
+            Chapter.model_construct(
+                id=chapter.id,
+                title=chapter.title,
+                prerequisites=list(chapter.prerequisites),
+                content=chapter.content,
+            )
+            for chapter in plan.chapters
+        ],
+    )
+
+
+def json_response(
+    model: BaseModel, headers: Optional[Dict[str, str]] = None, status_code: int = 200
+) -> Response:
+    """Serialize a validated model directly, bypassing `response_model` re-validation."""
+    return Response(
+        content=adapter(type(model)).dump_json(model),
+        media_type="application/json",
+        status_code=status_code,
+        headers=headers,
+    )
@@ -0,0 +1,67 @@
+"""Microbenchmark of chapter parsing cost versus offloading overhead.
+
+Times `parse_chapter_text` inline on chapter outputs of 2 000 to 32 000
+characters, with XML sections and as JSON, and one round trip to each
+executor, to place `PARSE_OFFLOAD_THRESHOLD` where the handoff costs less
+than the parsing it moves off the event loop.
+
+Run from the repository root:
+
+    python -m src.scripts.bench_offload
+"""
+import asyncio
+import json
+import time
+import timeit
+
+from src.api import offload
+from src.api.recovery import parse_chapter_text
+from src.scripts.make_synthetic_cassette import chapter_text
+
+SIZES = [2000, 4000, 8000, 16000, 32000]
+ROUNDS = 200
+
+
+def chapter_of_size(size: int) -> str:
+    text = chapter_text("Volumes et réseaux")
+    return text.replace("\n</theory>", " mot" * ((size - len(text)) // 4) + "\n</theory>")
+
+
+def json_chapter_of_size(size: int) -> str:
+    data = parse_chapter_text(chapter_of_size(size))[0]
+    return json.dumps(data, ensure_ascii=False)
+
+
+def parse_seconds(text: str) -> float:
+    return timeit.timeit(lambda: parse_chapter_text(text), number=ROUNDS) / ROUNDS
+
+
+async def handoff(executor: str, text: str) -> float:
+    """Mean seconds of one offloaded parse, minus the parse itself."""
+    offload.PARSE_EXECUTOR = executor
+    offload.PARSE_OFFLOAD_THRESHOLD = 1
+    await offload.offload_parse(parse_chapter_text, text, len(text))
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        await offload.offload_parse(parse_chapter_text, text, len(text))
+    return (time.perf_counter() - start) / ROUNDS - parse_seconds(text)
+
+
+def main() -> None:
+    print(f"{'chars':>8} {'xml (ms)':>9} {'json (ms)':>10}")
+    for size in SIZES:
+        xml, data = chapter_of_size(size), json_chapter_of_size(size)
+        print(f"{size:>8} {parse_seconds(xml) * 1000:>9.3f} {parse_seconds(data) * 1000:>10.3f}")
+
+    text = chapter_of_size(8000)
+    offload.PARSE_PROCESSES = 1
+    try:
+        for executor in ("thread", "process"):
+            seconds = asyncio.run(handoff(executor, text))
+            print(f"{executor} handoff: {seconds * 1000:.3f} ms")
+    finally:
+        offload.shutdown()
+
+
+if __name__ == "__main__":
+    main()
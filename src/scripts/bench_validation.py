@@ -0,0 +1,100 @@
+"""Microbenchmark of learning plan validation cost by chapter count.
+
+Times one call, for plans of 5 to 200 chapters with full content, of:
+
+- validate:   LearningPlan.model_validate(dict)
+- construct:  recursive model_construct from the same dict (no validation)
+- loads+val:  json.loads then model_validate, as for a raw LLM or cache payload
+- json:       cached TypeAdapter.validate_json on the raw bytes
+- deepcopy:   plan.model_copy(deep=True)
+- copy_plan:  validation.copy_plan (model_construct on validated instances)
+- response:   dump, re-validate and dump again, as FastAPI's response_model does
+- dump:       TypeAdapter.dump_json only, as validation.json_response does
+
+Run from the repository root:
+
+    python -m src.scripts.bench_validation
+"""
+import json
+import timeit
+from typing import Any, Callable, Dict
+
+from src.api.models import LearningPlan, Chapter, ChapterContent
+from src.api.validation import PLAN_ADAPTER, copy_plan
+
+CHAPTER_COUNTS = [5, 10, 25, 50, 100, 200]
+
+
+def make_plan_data(chapters: int) -> Dict[str, Any]:
+    """Build a plan dict with `chapters` chapters of realistic content size."""
+    paragraph = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 10
+    return {
+        "title": "Plan de test",
+        "description": "Plan utilisé pour mesurer le coût de validation",
+        "chapters": [
+            {
+                "id": f"c{i}",
+                "title": f"Chapitre {i}",
+                "prerequisites": [f"c{i - 1}"] if i > 1 else [],
+                "content": {
+                    "introduction": paragraph,
+                    "theory": paragraph * 3,
+                    "guided_practice": paragraph * 2,
+                    "challenge": paragraph,
+                    "conclusion": paragraph,
+                    "resources": [f"https://example.com/{i}/{j}" for j in range(3)],
+                },
+            }
+            for i in range(1, chapters + 1)
+        ],
+    }
+
+
+def construct_plan(data: Dict[str, Any]) -> LearningPlan:
+    """Build a plan without validation (model_construct does not recurse)."""
+    return LearningPlan.model_construct(
+        title=data["title"],
+        description=data["description"],
+        chapters=[
+            Chapter.model_construct(
+                id=chapter["id"],
+                title=chapter["title"],
+                prerequisites=chapter["prerequisites"],
+                content=ChapterContent.model_construct(**chapter["content"]),
+            )
+            for chapter in data["chapters"]
+        ],
+    )
+
+
+def per_call_us(fn: Callable[[], Any], number: int) -> float:
+    """Best-of-5 time per call, in microseconds."""
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main() -> None:
+    data_by_count = {count: make_plan_data(count) for count in CHAPTER_COUNTS}
+    benches: Dict[str, Callable[[Dict[str, Any], bytes, LearningPlan], Any]] = {
+        "validate": lambda data, raw, plan: LearningPlan.model_validate(data),
+        "construct": lambda data, raw, plan: construct_plan(data),
+        "loads+val": lambda data, raw, plan: LearningPlan.model_validate(json.loads(raw)),
+        "json": lambda data, raw, plan: PLAN_ADAPTER.validate_json(raw),
+        "deepcopy": lambda data, raw, plan: plan.model_copy(deep=True),
+        "copy_plan": lambda data, raw, plan: copy_plan(plan),
+        "response": lambda data, raw, plan: PLAN_ADAPTER.dump_json(
+            PLAN_ADAPTER.validate_python(plan.model_dump())
+        ),
+        "dump": lambda data, raw, plan: PLAN_ADAPTER.dump_json(plan),
+    }
+    print("Time per call in microseconds")
+    print(f"{'chapters':>8} " + " ".join(f"{name:>10}" for name in benches))
+    for count, data in data_by_count.items():
+        raw = json.dumps(data).encode("utf-8")
+        plan = LearningPlan.model_validate(data)
+        number = max(10, 2000 // count)
+        timings = [per_call_us(lambda: bench(data, raw, plan), number) for bench in benches.values()]
+        print(f"{count:>8} " + " ".join(f"{t:>10.1f}" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
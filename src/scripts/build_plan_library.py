@@ -0,0 +1,128 @@
+"""Build the pre-generated plan library (see src/api/plan_library.py).
+
+Generates, validates and stores a plan and its chapter contents for every
+subject × learner profile of a config file:
+
+    {
+        "subjects": ["Docker", "Python"],
+        "profiles": {
+            "debutant": {"context": "Je débute...", "match": ["débutant", "jamais"]}
+        }
+    }
+
+Rebuilds are incremental: entries of the existing library whose prompt
+fingerprint still matches are reused, so only entries affected by a prompt
+change, or new subjects and profiles, are generated. `--force` regenerates
+everything.
+
+Run from the repository root:
+
+    python -m src.scripts.build_plan_library --output plans.lib
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from src.api.content import generate_plan_content
+from src.api.llm import plan_chain, plan_structured_chain, ainvoke_structured, parse_plan_output
+from src.api.models import LearningPlan
+from src.api.plan_graph import build_plan_graph
+from src.api.plan_library import (
+    PlanLibrary, write_library, prompt_fingerprints, plan_key, content_key
+)
+from src.api.validation import PLAN_ADAPTER
+
+DEFAULT_CONFIG = Path(__file__).parent / "plan_library_config.json"
+
+
+async def generate_plan(subject: str, context: str) -> LearningPlan:
+    """Generate a plan as /api/plan does, rejecting degraded output."""
+    plan = await ainvoke_structured(
+        plan_chain, plan_structured_chain, {"sujet": subject, "context": context},
+        LearningPlan, parse_plan_output, "plan"
+    )
+    if not plan.chapters:
+        raise ValueError("Plan has no chapters")
+    build_plan_graph(plan)
+    return plan
+
+
+async def build(
+    config: Dict[str, Any], path: str, force: bool = False, concurrency: int = 4
+) -> Dict[str, int]:
+    """Build or incrementally rebuild the library at `path`.
+
+    Returns:
+        Number of entries reused, generated and failed
+    """
+    previous: Optional[PlanLibrary] = None
+    if not force and os.path.exists(path):
+        previous = PlanLibrary(path)
+    fingerprints = prompt_fingerprints()
+    entries: Dict[str, Tuple[bytes, str]] = {}
+    stats = {"reused": 0, "generated": 0, "failed": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def reuse(key: str, kind: str) -> Optional[bytes]:
+        data = previous.get(key, fingerprints[kind]) if previous else None
+        if data is not None:
+            entries[key] = (data, fingerprints[kind])
+            stats["reused"] += 1
+        return data
+
+    async def build_entry(subject: str, profile: str, context: str) -> None:
+        key = plan_key(subject, profile)
+        try:
+            data = reuse(key, "plan")
+            if data is not None:
+                plan = PLAN_ADAPTER.validate_json(data)
+            else:
+                async with semaphore:
+                    plan = await generate_plan(subject, context)
+                entries[key] = (PLAN_ADAPTER.dump_json(plan), fingerprints["plan"])
+                stats["generated"] += 1
+                print(f"  plan {key}: {len(plan.chapters)} chapters")
+
+            key = content_key(plan)
+            if reuse(key, "content") is None:
+                async with semaphore:
+                    full_plan, failures = await generate_plan_content(plan)
+                if failures:
+                    raise ValueError(f"Chapters without content: {', '.join(failures)}")
+                entries[key] = (PLAN_ADAPTER.dump_json(full_plan), fingerprints["content"])
+                stats["generated"] += 1
+                print(f"  content {key} ({subject}, {profile})")
+        except Exception as e:
+            stats["failed"] += 1
+            print(f"  {key} failed: {e}")
+
+    await asyncio.gather(*(
+        build_entry(subject, name, profile["context"])
+        for subject in config["subjects"]
+        for name, profile in config["profiles"].items()
+    ))
+    version = previous.version + 1 if previous else 1
+    if previous:
+        previous.close()
+    write_library(path, dict(sorted(entries.items())), config["profiles"], version)
+    print(f"Plan library v{version} written to {path} ({len(entries)} entries)")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default=str(DEFAULT_CONFIG), help="subjects and learner profiles (JSON)")
+    parser.add_argument("--output", default=os.environ.get("PLAN_LIBRARY_PATH") or "plans.lib", help="library file")
+    parser.add_argument("--force", action="store_true", help="regenerate every entry")
+    parser.add_argument("--concurrency", type=int, default=4, help="plans generated at the same time")
+    args = parser.parse_args()
+    with open(args.config, encoding="utf-8") as f:
+        config = json.load(f)
+    start = time.perf_counter()
+    stats = asyncio.run(build(config, args.output, args.force, args.concurrency))
+    print(f"{stats['reused']} reused, {stats['generated']} generated, "
+          f"{stats['failed']} failed in {time.perf_counter() - start:.0f}s")
@@ -1,10 +1,21 @@
+"""Interactive command-line client for the learning path generator.
+
+Runs the same chains as the API, asynchronously: chapter contents are
+generated concurrently along the prerequisite graph with progress printed as
+each chapter completes, and with `--prefetch` content generation starts in
+the background while the plan is still being discussed.
+
+Run from the repository root:
+
+    python -m src.scripts.calls [--prefetch]
+"""
+import argparse
+import asyncio
 import os
-import json
+import tempfile
+import threading
 from pathlib import Path
-from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_mistralai.chat_models import ChatMistralAI
-from typing import Dict, List, Optional, Tuple
+from typing import List, Optional, Tuple
 
 # Check for Mistral API key
 MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY")
@@ -19,221 +30,202 @@ Veuillez configurer la variable d'environnement MISTRAL_API_KEY :
 Vous pouvez obtenir une clé API sur : https://console.mistral.ai/
 """)
 
-# Initialize the Mistral LLM
-llm = ChatMistralAI(
-    mistral_api_key=MISTRAL_API_KEY,
-    temperature=0.7
-)
-
-# Read prompt templates from files
-def read_prompt_template(file_path: str) -> str:
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return f.read()
-
-# Get paths to prompt files
-prompts_dir = Path(__file__).parent.parent / 'prompts'
-context_prompt_path = prompts_dir / 'prompt_context.txt'
-plan_prompt_path = prompts_dir / 'prompt_plan.txt'
-chapters_batch_prompt_path = prompts_dir / 'prompt_chapters_batch.txt'
-feedback_prompt_path = prompts_dir / 'prompt_feedback.txt'
-
-# Create the prompts
-context_prompt = PromptTemplate(
-    input_variables=["subject"],
-    template=read_prompt_template(context_prompt_path)
-)
-
-plan_prompt = PromptTemplate(
-    input_variables=["sujet", "context"],
-    template=read_prompt_template(plan_prompt_path)
+from src.api.compaction import feedback_plan, restore_contents
+from src.api.content import generate_plan_content
+from src.api.llm import (
+    context_chain, plan_chain, feedback_chain, parse_plan_output, parse_feedback_output
 )
+from src.api.models import Chapter, LearningPlan
+from src.api.validation import PLAN_ADAPTER
 
-chapters_batch_prompt = PromptTemplate(
-    input_variables=["learning_plan"],
-    template=read_prompt_template(chapters_batch_prompt_path)
-)
+OUTPUT_PATH = Path(__file__).parent.parent.parent / "final_output.json"
 
-feedback_prompt = PromptTemplate(
-    input_variables=["context", "current_plan", "user_message", "conversation_history"],
-    template=read_prompt_template(feedback_prompt_path)
-)
 
-# Create the chains
-context_chain = context_prompt | llm
-plan_chain = plan_prompt | llm
-chapters_chain = chapters_batch_prompt | llm
-feedback_chain = feedback_prompt | llm
+async def ask(prompt: str) -> str:
+    """Read a line from the terminal without blocking background generation.
 
-def get_user_input() -> Dict[str, str]:
+    `input` cannot be interrupted, so it runs in a daemon thread rather than
+    the default executor: after Ctrl-C the program exits without waiting for
+    the user to press Enter.
+    """
+    loop = asyncio.get_running_loop()
+    answer = loop.create_future()
+
+    def settle(line: Optional[str], error: Optional[BaseException]) -> None:
+        if answer.done():
+            return
+        if error is not None:
+            answer.set_exception(error)
+        else:
+            answer.set_result(line)
+
+    def read() -> None:
+        try:
+            line, error = input(prompt), None
+        except Exception as e:
+            line, error = None, e
+        try:
+            loop.call_soon_threadsafe(settle, line, error)
+        except RuntimeError:
+            # The loop is closed: nobody is waiting for this answer anymore
+            pass
+
+    threading.Thread(target=read, daemon=True).start()
+    return await answer
+
+
+async def get_user_input() -> Tuple[str, str]:
     """Get subject and context from user interaction."""
     # Ask what they want to learn
-    subject = input("\nQue souhaitez-vous apprendre ? ")
-    
+    subject = await ask("\nQue souhaitez-vous apprendre ? ")
+
     # Generate context question
     print("\nGénération de la question de contexte...")
-    
+    question = await context_chain.ainvoke({"subject": subject})
+
     # Ask for context
-    print("\nDonne nous un peu plus de contexte pour pouvoir personnaliser ton parcours d'apprentissage\n" + context_chain.invoke({"subject": subject}).content)
-    context = input("Votre réponse : ")
-    
-    return {
-        "sujet": subject,
-        "context": context
-    }
-
-def process_prompts(inputs: Dict[str, str]) -> Dict[str, str]:
-    """Process the prompts with batch chapter content generation.
-    
-    Args:
-        inputs: Dictionary containing subject and context
-    
-    Returns:
-        Dictionary containing the learning plan and detailed chapter contents
-    """
-    print("\nGénération du plan d'apprentissage...")
-    # First: Generate learning plan
-    plan_result = plan_chain.invoke(inputs)
-    learning_plan = json.loads(plan_result.content)
-    
-    print("\nGénération du contenu des chapitres...")
-    # Second: Generate all chapter contents in a single batch
-    chapters_result = chapters_chain.invoke({"learning_plan": plan_result.content})
-    chapters_content = json.loads(chapters_result.content)
-    
-    # Update each chapter with its content
-    for chapter in learning_plan["chapters"]:
-        matching_content = next(
-            (c for c in chapters_content["chapters"] if c["id"] == chapter["id"]),
-            None
-        )
-        if matching_content:
-            chapter["content"] = matching_content["content"]
-    
-    print("Génération du contenu terminée")
-    
-    return {
-        "learning_plan": plan_result.content,
-        "final_output": json.dumps(learning_plan, ensure_ascii=False, indent=2)
-    }
-
-def save_outputs(results: Dict[str, str]) -> None:
-    """Save outputs to JSON files."""
-    output_dir = Path(__file__).parent.parent.parent
-    
-    # Save the learning plan to a file
-    learning_plan_path = output_dir / "learning_plan.json"
-    with open(learning_plan_path, "w", encoding="utf-8") as f:
-        json.dump(json.loads(results["final_output"]), f, ensure_ascii=False, indent=2)
-    print(f"\nPlan d'apprentissage sauvegardé dans : {learning_plan_path}")
-
-    # Save the final output to a file
-    final_output_path = output_dir / "final_output.json"
-    with open(final_output_path, "w", encoding="utf-8") as f:
-        json.dump(json.loads(results["final_output"]), f, ensure_ascii=False, indent=2)
-    print(f"Contenu détaillé sauvegardé dans : {final_output_path}")
-
-def pretty_print_plan(plan: dict) -> None:
+    print("\nDonne nous un peu plus de contexte pour pouvoir personnaliser ton parcours d'apprentissage\n" + question.content)
+    context = await ask("Votre réponse : ")
+    return subject, context
+
+
+def pretty_print_plan(plan: LearningPlan) -> None:
     """Print the learning plan in a readable format."""
     print("\n=== Plan d'apprentissage ===\n")
-    print(f"Titre: {plan['title']}")
-    print(f"Description: {plan['description']}\n")
+    print(f"Titre: {plan.title}")
+    print(f"Description: {plan.description}\n")
     print("Chapitres:")
-    for chapter in plan['chapters']:
-        print(f"\n{chapter['id']}. {chapter['title']}")
-        if chapter.get('prerequisites'):
-            print(f"   Prérequis: {', '.join(chapter['prerequisites'])}")
+    for chapter in plan.chapters:
+        print(f"\n{chapter.id}. {chapter.title}")
+        if chapter.prerequisites:
+            print(f"   Prérequis: {', '.join(chapter.prerequisites)}")
 
-def process_feedback(context: str, current_plan: dict, user_message: str, conversation: List[str]) -> tuple[str, Optional[dict]]:
+
+async def process_feedback(
+    context: str, current_plan: LearningPlan, user_message: str, conversation: List[str]
+) -> Tuple[str, Optional[LearningPlan]]:
     """Process user feedback about the learning plan.
-    
+
     Args:
         context: Original learning context
         current_plan: Current learning plan
         user_message: User's feedback or question
         conversation: List of previous messages
-    
+
     Returns:
         Tuple of (response message, updated plan or None)
     """
-    # Convert conversation history to string format
-    conversation_history = "\n".join(conversation)
-    
-    # Get feedback from LLM
-    result = feedback_chain.invoke({
+    result = await feedback_chain.ainvoke({
         "context": context,
-        "current_plan": json.dumps(current_plan, ensure_ascii=False),
+        "current_plan": feedback_plan(current_plan),
         "user_message": user_message,
-        "conversation_history": conversation_history
+        "conversation_history": "\n".join(conversation)
     })
-    
-    # Parse the response
+    feedback = parse_feedback_output(result)
+    return feedback.response, restore_contents(current_plan, feedback.plan)
+
+
+async def generate_contents(plan: LearningPlan, quiet: bool = False) -> LearningPlan:
+    """Generate all chapter contents concurrently, printing progress as chapters complete."""
+    done = 0
+
+    def on_chapter(chapter: Chapter) -> None:
+        nonlocal done
+        done += 1
+        if not quiet:
+            status = "✓" if chapter.content is not None else "✗ échec"
+            print(f"  [{done}/{len(plan.chapters)}] {chapter.id}. {chapter.title} {status}")
+
+    updated_plan, failures = await generate_plan_content(plan, on_chapter)
+    if failures and not quiet:
+        print(f"Chapitres sans contenu : {', '.join(failures)}")
+    return updated_plan
+
+
+def save_output(plan: LearningPlan, path: Optional[Path] = None) -> None:
+    """Write the final plan once, atomically (temporary file then rename)."""
+    path = path or OUTPUT_PATH
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
     try:
-        feedback = json.loads(result.content)
-        response = feedback["response"]
-        new_plan = feedback["plan"]
-        if isinstance(new_plan, str):
-            new_plan = json.loads(new_plan)
-        return response, new_plan
-    except json.JSONDecodeError as e:
-        print(f"\nErreur de format dans la réponse : {str(e)}")
-        print("\nRéponse reçue :")
-        print(result.content)
-        return "Désolé, je n'ai pas pu traiter cette réponse. Pouvez-vous reformuler votre demande ?", None
-
-def main():
+        with os.fdopen(fd, "wb") as f:
+            f.write(PLAN_ADAPTER.dump_json(plan, indent=2))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    print(f"\nPlan d'apprentissage et contenu détaillé sauvegardés dans : {path}")
+
+
+async def discard(task: asyncio.Task) -> None:
+    """Cancel a background generation and consume its outcome, error included."""
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def main(prefetch: bool = False) -> None:
+    subject, user_context = await get_user_input()
+
+    # Generate initial plan
+    print("\nGénération du plan d'apprentissage...")
+    current_plan = parse_plan_output(
+        await plan_chain.ainvoke({"sujet": subject, "context": user_context})
+    )
+    pretty_print_plan(current_plan)
+
+    # Content generated in the background for the plan currently displayed
+    prefetched: Optional[asyncio.Task] = None
+    if prefetch:
+        prefetched = asyncio.create_task(generate_contents(current_plan, quiet=True))
+
     try:
-        # Get user input
-        inputs = get_user_input()
-        user_context = inputs["context"]  # Store context for feedback loop
-        
-        # Generate initial plan
-        print("\nGénération du plan d'apprentissage...")
-        plan_result = plan_chain.invoke(inputs)
-        current_plan = json.loads(plan_result.content)
-        pretty_print_plan(current_plan)
-        
         # Start feedback loop
-        conversation = []
+        conversation: List[str] = []
         while True:
             print("\nQue pensez-vous de ce plan ? (V pour valider, ou donnez vos commentaires)")
-            user_input = input("> ")
-            
+            user_input = await ask("> ")
+
             if user_input.lower() == 'v':
                 break
-            
+
             # Process feedback
-            response, new_plan = process_feedback(user_context, current_plan, user_input, conversation)
+            response, new_plan = await process_feedback(user_context, current_plan, user_input, conversation)
             conversation.extend([f"User: {user_input}", f"Assistant: {response}"])
-            
+
             # Update plan if changed
             if new_plan:
                 current_plan = new_plan
                 pretty_print_plan(current_plan)
+                if prefetched is not None:
+                    await discard(prefetched)
+                    prefetched = asyncio.create_task(generate_contents(current_plan, quiet=True))
             else:
                 print(f"\n{response}")
-        
+
         # Generate detailed chapter contents
         print("\nGénération du contenu détaillé des chapitres...")
-        chapters_result = chapters_chain.invoke({"learning_plan": json.dumps(current_plan)})
-        chapters_content = json.loads(chapters_result.content)
-        
-        # Update each chapter with its content
-        for chapter in current_plan["chapters"]:
-            matching_content = next(
-                (c for c in chapters_content["chapters"] if c["id"] == chapter["id"]),
-                None
-            )
-            if matching_content:
-                chapter["content"] = matching_content["content"]
-        
-        # Save final plan
-        save_outputs({
-            "learning_plan": json.dumps(current_plan),
-            "final_output": json.dumps(current_plan, ensure_ascii=False, indent=2)
-        })
-        
-    except Exception as e:
-        print(f"\nErreur : {str(e)}")
+        if prefetched is not None:
+            final_plan = await prefetched
+            prefetched = None
+            print("Contenu pré-généré pendant la discussion")
+        else:
+            final_plan = await generate_contents(current_plan)
+    finally:
+        if prefetched is not None:
+            await discard(prefetched)
+
+    save_output(final_plan)
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--prefetch", action="store_true",
+        help="generate chapter contents in the background during the feedback loop"
+    )
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(prefetch=args.prefetch))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"\nErreur : {str(e)}")
@@ -0,0 +1,127 @@
+"""Build the synthetic cassette replayed by the test suite.
+
+The cassette in src/api/cassettes is not a recording of the live provider:
+it is produced by running the replay regression journey in record mode
+against a scripted chat model, which answers each chain with fixed,
+templated text streamed in 40-character chunks at a constant pace. It
+exercises the replay path, parsing and every endpoint without a Mistral
+key; its timings say nothing about real provider latency. Record a real
+session with `replay_regression --record` for that.
+
+Run from the repository root after changing prompts the journey uses:
+
+    python -m src.scripts.make_synthetic_cassette
+"""
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+
+DEFAULT_PATH = Path(__file__).parent.parent / "api" / "cassettes" / "synthetic_session.jsonl"
+
+PLAN = {
+    "title": "Découverte de Docker",
+    "description": "Apprenez les bases de Docker en une semaine",
+    "chapters": [
+        {"id": "c1", "title": "Introduction aux conteneurs", "prerequisites": []},
+        {"id": "c2", "title": "Images et Dockerfile", "prerequisites": ["c1"]},
+        {"id": "c3", "title": "Volumes et réseaux", "prerequisites": ["c1"]},
+        {"id": "c4", "title": "Docker Compose", "prerequisites": ["c2", "c3"]},
+    ],
+}
+CHUNK_CHARS = 40
+FIRST_TOKEN_DELAY = 0.2
+
+
+def chapter_text(title: str) -> str:
+    return "\n\n".join([
+        f"<introduction>\nCe chapitre présente {title} et son rôle dans un flux de travail moderne.\n</introduction>",
+        "<theory>\n" + f"{title} repose sur l'isolation des processus. " * 6 + "\n</theory>",
+        "<guided_practice>\n1. Lancez `docker run hello-world`.\n2. Listez les conteneurs avec `docker ps -a`.\n</guided_practice>",
+        "<challenge>\nConteneurisez une petite application Flask.\n</challenge>",
+        "<conclusion>\nQuestions : qu'est-ce qu'une image ? Qu'est-ce qu'un conteneur ?\n</conclusion>",
+        "<resources>\n- https://docs.docker.com/get-started/\n</resources>",
+    ])
+
+
+def answer(prompt: str):
+    """Scripted answer to a rendered prompt, with the delay between chunks."""
+    if "Chapitre à rédiger" in prompt:
+        requested = prompt.split("Chapitre à rédiger : ")[1]
+        for chapter in PLAN["chapters"]:
+            if requested.startswith(f"{chapter['id']}."):
+                return chapter_text(chapter["title"]), 0.0125
+    if "Plan d'apprentissage actuel" in prompt:
+        plan = json.loads(json.dumps(PLAN))
+        plan["chapters"][1]["title"] = "Images, Dockerfile et exercices"
+        feedback = {"response": "J'ai ajouté des exercices pratiques au chapitre 2.", "plan": plan}
+        return "```json\n" + json.dumps(feedback, ensure_ascii=False) + "\n```", 0.0075
+    if "Sujet du cours" in prompt:
+        return "```json\n" + json.dumps(PLAN, ensure_ascii=False, indent=2) + "\n```", 0.0075
+    if "prochain message de l'apprenant" in prompt:
+        return "Par exemple, `docker run -p 8080:80 nginx` lance un serveur web accessible sur le port 8080.", 0.005
+    return "Parle-nous de ton expérience, de tes objectifs et du temps dont tu disposes.", 0.005
+
+
+def scripted_model():
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessageChunk
+    from langchain_core.outputs import ChatGenerationChunk
+
+    class ScriptedChatModel(BaseChatModel):
+        """Streams `answer(prompt)` like a provider would."""
+
+        @property
+        def _llm_type(self) -> str:
+            return "scripted"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            raise RuntimeError("The scripted model only streams")
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            prompt = "\n".join(m.content for m in messages)
+            text, delay = answer(prompt)
+            pieces = [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)]
+            await asyncio.sleep(FIRST_TOKEN_DELAY)
+            for i, piece in enumerate(pieces):
+                await asyncio.sleep(delay)
+                extra = {}
+                if i == len(pieces) - 1:
+                    extra = {
+                        "response_metadata": {"finish_reason": "stop"},
+                        "usage_metadata": {
+                            "input_tokens": len(prompt) // 4,
+                            "output_tokens": len(text) // 4,
+                            "total_tokens": (len(prompt) + len(text)) // 4,
+                        },
+                    }
+                yield ChatGenerationChunk(message=AIMessageChunk(content=piece, **extra))
+
+    return ScriptedChatModel()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--path", default=str(DEFAULT_PATH), help="cassette to write (replaced)")
+    args = parser.parse_args()
+
+    path = Path(args.path)
+    if path.exists():
+        path.unlink()
+    # The LLM clients are built at import time, so configure them before importing the app
+    os.environ.update(
+        LLM_CASSETTE_MODE="record", LLM_CASSETTE_PATH=str(path), MISTRAL_API_KEY="unused",
+        CONTEXT_CACHE_TTL="0", LLM_HEDGING="0", LLM_STRUCTURED_OUTPUT="off",
+    )
+    from src.api import llm
+    from src.scripts import replay_regression
+
+    # Record the scripted model instead of the provider
+    object.__setattr__(llm.llm, "inner", scripted_model())
+    report = asyncio.run(replay_regression.run(["Docker"], 1, 1))
+    print(f"{path}: {sum(stats['calls'] for stats in report['endpoints'].values())} endpoint calls recorded")
+
+
+if __name__ == "__main__":
+    main()
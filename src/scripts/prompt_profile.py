@@ -0,0 +1,106 @@
+"""Prompt size by template variable, verbose versus compact plan serialization.
+
+Renders the chapter and feedback prompts for plans of 5 to 100 chapters (with
+generated content, as sent back by clients) and prints the estimated tokens of
+each variable with the verbose JSON serialization and with compaction (see
+src/api/compaction.py).
+
+With `--quality`, also generates the same chapters and feedback with both
+serializations through the live provider and compares parse success and
+output size, to check that compaction does not degrade output:
+
+    python -m src.scripts.prompt_profile
+    python -m src.scripts.prompt_profile --quality --chapters 10
+"""
+import argparse
+import asyncio
+from typing import Any, Dict, List
+
+from src.api.compaction import plan_outline, chapter_reference, feedback_plan
+from src.api.content import summarize_chapter
+from src.api.llm import chapter_prompt, feedback_prompt
+from src.api.models import LearningPlan
+from src.api.prompt_profile import estimate_tokens, template_tokens
+from src.scripts.bench_validation import make_plan_data
+
+CHAPTER_COUNTS = [5, 10, 25, 50, 100]
+
+
+def chapter_inputs(plan: LearningPlan, index: int, compact: bool) -> Dict[str, str]:
+    chapter = plan.chapters[index]
+    prerequisites = [c for c in plan.chapters if c.id in chapter.prerequisites]
+    return {
+        "learning_plan": plan_outline(plan, compact),
+        "chapter": chapter_reference(chapter, compact),
+        "prerequisites_summary": "\n".join(summarize_chapter(p) for p in prerequisites)
+        or "Aucun (chapitre d'entrée)",
+    }
+
+
+def feedback_inputs(plan: LearningPlan, compact: bool) -> Dict[str, str]:
+    return {
+        "context": "Débutant, environ 5 heures par semaine.",
+        "current_plan": feedback_plan(plan, compact),
+        "user_message": "Peux-tu ajouter un chapitre sur la sécurité ?",
+        "conversation_history": "",
+    }
+
+
+def print_profile() -> None:
+    print("Estimated prompt tokens (verbose -> compact)")
+    for count in CHAPTER_COUNTS:
+        plan = LearningPlan.model_validate(make_plan_data(count))
+        rows = [
+            ("chapter", chapter_prompt, chapter_inputs(plan, count - 1, False), chapter_inputs(plan, count - 1, True)),
+            ("feedback", feedback_prompt, feedback_inputs(plan, False), feedback_inputs(plan, True)),
+        ]
+        print(f"\n{count} chapters")
+        for name, prompt, verbose, compact in rows:
+            total_verbose = total_compact = template_tokens(prompt)
+            for variable in prompt.input_variables:
+                before, after = estimate_tokens(verbose[variable]), estimate_tokens(compact[variable])
+                total_verbose += before
+                total_compact += after
+                print(f"  {name:<9} {variable:<22} {before:>8} -> {after:>8}")
+            saved = 1 - total_compact / total_verbose
+            print(f"  {name:<9} {'total':<22} {total_verbose:>8} -> {total_compact:>8}  (-{saved:.0%})")
+
+
+async def quality(chapters: int) -> None:
+    """Generate with both serializations and compare outputs."""
+    from src.api.llm import chapter_chain, feedback_chain, parse_chapter_output, parse_feedback_output
+
+    data = make_plan_data(chapters)
+    plan = LearningPlan.model_validate(data)
+    results: Dict[bool, Dict[str, List[Any]]] = {}
+    for compact in (False, True):
+        outcome = results[compact] = {"chapters": [], "feedback": []}
+        for index in range(len(plan.chapters)):
+            result = await chapter_chain.ainvoke(chapter_inputs(plan, index, compact))
+            try:
+                content = parse_chapter_output(result)
+                outcome["chapters"].append(sum(len(v) for v in content.model_dump().values() if isinstance(v, str)))
+            except Exception:
+                outcome["chapters"].append(None)
+        feedback = parse_feedback_output(await feedback_chain.ainvoke(feedback_inputs(plan, compact)))
+        outcome["feedback"].append(len(feedback.plan.chapters) if feedback.plan else None)
+
+    for compact, outcome in results.items():
+        parsed = [size for size in outcome["chapters"] if size is not None]
+        label = "compact" if compact else "verbose"
+        print(
+            f"{label}: chapters parsed {len(parsed)}/{len(outcome['chapters'])}, "
+            f"mean content {sum(parsed) // max(1, len(parsed))} chars, "
+            f"feedback plan chapters {outcome['feedback'][0]}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quality", action="store_true", help="compare live outputs of both serializations")
+    parser.add_argument("--chapters", type=int, default=5, help="plan size for --quality")
+    args = parser.parse_args()
+    print_profile()
+    if args.quality:
+        print()
+        asyncio.run(quality(args.chapters))
@@ -0,0 +1,199 @@
+"""Replay recorded LLM cassettes through every API endpoint and check performance.
+
+Runs the full user journey (context question, plan, feedback, chapter
+contents, chat) against the ASGI app in-process, with LLM calls answered from
+a cassette (see src/api/cassette.py), and reports per-endpoint latency,
+throughput and parse success as JSON. Exits with status 1 when a threshold is
+violated, so it can gate a deployment on parse success:
+
+    python -m src.scripts.replay_regression --sessions 20 --concurrency 5 --min-parse-success 1.0
+
+The default cassette is synthetic (see src/scripts/make_synthetic_cassette.py),
+so its latencies say nothing about the provider. `--max-p95` and
+`--min-throughput` are only meaningful with a cassette recorded from the
+provider:
+
+    python -m src.scripts.replay_regression --record --cassette session.jsonl.gz
+    python -m src.scripts.replay_regression --cassette session.jsonl.gz --speed 10 --max-p95 2.0
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DEFAULT_CASSETTE = Path(__file__).parent.parent / "api" / "cassettes" / "synthetic_session.jsonl"
+ENDPOINTS = ["context", "plan", "feedback", "generate_content", "chat"]
+
+
+class CallLog:
+    """Latency and parse outcome of each endpoint call."""
+
+    def __init__(self):
+        self.calls: Dict[str, List[Dict[str, Any]]] = {name: [] for name in ENDPOINTS}
+
+    async def post(self, client, endpoint: str, payload: Dict[str, Any], parsed):
+        """POST `payload`, record the call, and return the response if it parsed.
+
+        `parsed` decides from the response whether the LLM output was parsed
+        without falling back to a degraded result.
+        """
+        start = time.perf_counter()
+        response = await client.post(f"/api/{endpoint}", json=payload)
+        latency = time.perf_counter() - start
+        body = response.json() if response.status_code == 200 else None
+        ok = body is not None and parsed(response, body)
+        self.calls[endpoint].append({"latency": latency, "status": response.status_code, "parsed": ok})
+        return response if ok else None
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints = {}
+        for name, calls in self.calls.items():
+            if not calls:
+                continue
+            latencies = sorted(call["latency"] for call in calls)
+            endpoints[name] = {
+                "calls": len(calls),
+                "errors": sum(call["status"] != 200 for call in calls),
+                "parse_success": sum(call["parsed"] for call in calls) / len(calls),
+                "p50": percentile(latencies, 0.5),
+                "p95": percentile(latencies, 0.95),
+                "max": latencies[-1],
+            }
+        total = sum(len(calls) for calls in self.calls.values())
+        return {
+            "elapsed": elapsed,
+            "requests": total,
+            "throughput": total / elapsed if elapsed > 0 else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted `values`."""
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_session(client, log: CallLog, subject: str) -> None:
+    """One user journey; later steps are skipped when an earlier one fails."""
+    response = await log.post(
+        client, "context", {"subject": subject}, lambda r, body: bool(body)
+    )
+    if response is None:
+        return
+    learner = "Débutant, environ 5 heures par semaine."
+    context = f"{response.json()}\n{learner}"
+    response = await log.post(
+        client, "plan", {"subject": subject, "context": context},
+        lambda r, body: bool(body["chapters"])
+    )
+    if response is None:
+        return
+    plan = response.json()
+    response = await log.post(
+        client, "feedback",
+        {"context": context, "current_plan": plan, "user_message": "Peux-tu ajouter plus de pratique ?"},
+        lambda r, body: bool(body["response"])
+    )
+    if response is not None and response.json().get("plan"):
+        plan = response.json()["plan"]
+    response = await log.post(
+        client, "generate_content", {"plan": plan},
+        lambda r, body: "x-failed-chapters" not in r.headers
+    )
+    if response is None:
+        return
+    # Chat as the front end does: the server retrieves passages of the indexed plan
+    plan = response.json()
+    await log.post(
+        client, "chat",
+        {
+            "plan_id": response.headers["x-plan-id"],
+            "current_chapter": plan["chapters"][0]["id"],
+            "context": learner,
+            "message": "Peux-tu me donner un exemple concret de conteneurs ?",
+        },
+        lambda r, body: bool(body["response"])
+    )
+
+
+async def run(subjects: List[str], sessions: int, concurrency: int) -> Dict[str, Any]:
+    import httpx
+    from src.api.main import app
+    from src.api import metrics
+
+    metrics.reset()
+    log = CallLog()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def session(i: int) -> None:
+        async with semaphore:
+            await run_session(client, log, subjects[i % len(subjects)])
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(session(i) for i in range(sessions)))
+        elapsed = time.perf_counter() - start
+
+    report = log.report(elapsed)
+    report["llm_parse"] = {
+        counter["labels"]["method"]: counter["value"]
+        for counter in metrics.snapshot()["counters"] if counter["name"] == "llm_parse"
+    }
+    return report
+
+
+def check(report: Dict[str, Any], args: argparse.Namespace) -> List[str]:
+    """Threshold violations in `report`."""
+    failures = []
+    if args.min_throughput is not None and report["throughput"] < args.min_throughput:
+        failures.append(f"throughput {report['throughput']:.2f} req/s < {args.min_throughput}")
+    for name in ENDPOINTS:
+        stats = report["endpoints"].get(name)
+        if stats is None:
+            failures.append(f"{name}: never reached")
+            continue
+        if args.max_p95 is not None and stats["p95"] > args.max_p95:
+            failures.append(f"{name}: p95 latency {stats['p95']:.3f}s > {args.max_p95}s")
+        if stats["parse_success"] < args.min_parse_success:
+            failures.append(f"{name}: parse success {stats['parse_success']:.0%} < {args.min_parse_success:.0%}")
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cassette", default=str(DEFAULT_CASSETTE), help="cassette file (.jsonl or .jsonl.gz)")
+    parser.add_argument("--record", action="store_true", help="call the live provider and record the cassette")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay timing divisor (0 = no delay)")
+    parser.add_argument("--subject", action="append", help="subject to learn (repeatable)")
+    parser.add_argument("--sessions", type=int, default=1, help="number of user journeys")
+    parser.add_argument("--concurrency", type=int, default=1, help="journeys run at the same time")
+    parser.add_argument("--max-p95", type=float, help="maximum p95 latency per endpoint, in seconds")
+    parser.add_argument("--min-throughput", type=float, help="minimum requests per second")
+    parser.add_argument("--min-parse-success", type=float, default=1.0, help="minimum parse success ratio")
+    parser.add_argument("--report", help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    # The LLM clients are built at import time, so configure them before importing the app
+    os.environ["LLM_CASSETTE_MODE"] = "record" if args.record else "replay"
+    os.environ["LLM_CASSETTE_PATH"] = args.cassette
+    os.environ["LLM_CASSETTE_SPEED"] = str(args.speed)
+    os.environ.setdefault("CONTEXT_CACHE_TTL", "0")
+    os.environ.setdefault("LLM_HEDGING", "0")
+    os.environ["LLM_STRUCTURED_OUTPUT"] = "off"
+
+    report = asyncio.run(run(args.subject or ["Docker"], args.sessions, args.concurrency))
+    report["failures"] = [] if args.record else check(report, args)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.report:
+        Path(args.report).write_text(output, encoding="utf-8")
+    return 1 if report["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())